@@ -1,8 +1,17 @@
-use axum::{routing::post, Router, Json, response::IntoResponse};
+use axum::{
+    extract::Path,
+    http::{header, StatusCode},
+    response::{IntoResponse, Response},
+    routing::{get, post},
+    Json, Router,
+};
 use serde::{Deserialize, Serialize};
+use serde_json::Value;
+use std::path::PathBuf;
 use std::process::Stdio;
-use tokio::net::TcpListener;
-use tokio::{io::{AsyncBufReadExt, BufReader}, process::Command as TokioCommand};
+use std::time::{SystemTime, UNIX_EPOCH};
+use tokio::net::{TcpListener, UnixStream};
+use tokio::{io::{AsyncBufReadExt, AsyncWriteExt, BufReader}, process::Command as TokioCommand};
 
 #[derive(Deserialize, Serialize)]
 struct CrewRequest {
@@ -10,11 +19,77 @@ struct CrewRequest {
     first_date: String,
     second_date: String,
     current_year: String,
+    // "crew" (agentes LLM, por omissão), "pipeline" (tools encadeadas sem LLM) ou
+    // "timeseries" (cubo NDVI do local entre first_date e second_date)
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    mode: Option<String>,
+    // No modo "pipeline", pede também o relatório narrativo à crew
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    report: Option<bool>,
+    // No modo "pipeline", índices espectrais a calcular além do NDVI (NDBI, NDWI, MNDWI, EVI, SAVI)
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    indices: Option<Vec<String>>,
+    // No modo "timeseries", dias entre composites (30 por omissão)
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    cadence_days: Option<u32>,
 }
 
 async fn run_crew(Json(payload): Json<CrewRequest>) -> impl IntoResponse {
+    // Com GEOSYNC_WORKER_SOCKET definido, usa o worker Python persistente (geosync.worker);
+    // caso contrário, mantém o comportamento antigo de lançar um processo por pedido
+    match std::env::var("GEOSYNC_WORKER_SOCKET") {
+        Ok(socket_path) => run_via_worker(&socket_path, &payload).await,
+        Err(_) => run_via_spawn(&payload).await,
+    }
+}
+
+fn error_response(status: StatusCode, message: String) -> (StatusCode, Json<Value>) {
+    (status, Json(serde_json::json!({"error": message})))
+}
+
+async fn run_via_worker(socket_path: &str, payload: &CrewRequest) -> (StatusCode, Json<Value>) {
+    let stream = match UnixStream::connect(socket_path).await {
+        Ok(stream) => stream,
+        Err(e) => return error_response(
+            StatusCode::SERVICE_UNAVAILABLE,
+            format!("Worker indisponível em {socket_path}: {e}"),
+        ),
+    };
+    let (read_half, mut write_half) = stream.into_split();
+
+    // Protocolo: um pedido JSON por linha, uma resposta JSON por linha
+    let mut request = serde_json::to_string(payload).unwrap();
+    request.push('\n');
+    if let Err(e) = write_half.write_all(request.as_bytes()).await {
+        return error_response(StatusCode::BAD_GATEWAY, format!("Falha ao enviar pedido ao worker: {e}"));
+    }
+
+    let mut reader = BufReader::new(read_half).lines();
+    let line = match reader.next_line().await {
+        Ok(Some(line)) => line,
+        Ok(None) => return error_response(StatusCode::BAD_GATEWAY, "Worker fechou a ligação".to_string()),
+        Err(e) => return error_response(StatusCode::BAD_GATEWAY, format!("Falha ao ler resposta do worker: {e}")),
+    };
+
+    let response: Value = match serde_json::from_str(&line) {
+        Ok(value) => value,
+        Err(e) => return error_response(StatusCode::BAD_GATEWAY, format!("Resposta inválida do worker: {e}")),
+    };
+
+    let error = response.get("error").and_then(Value::as_str).unwrap_or("Unknown worker error").to_string();
+    if response.get("ok").and_then(Value::as_bool) == Some(true) {
+        (StatusCode::OK, Json(response.get("result").cloned().unwrap_or(Value::Null)))
+    } else if response.get("busy").and_then(Value::as_bool) == Some(true) {
+        // Fila cheia no worker: o cliente deve tentar mais tarde
+        error_response(StatusCode::SERVICE_UNAVAILABLE, error)
+    } else {
+        error_response(StatusCode::INTERNAL_SERVER_ERROR, error)
+    }
+}
+
+async fn run_via_spawn(payload: &CrewRequest) -> (StatusCode, Json<Value>) {
     // Serializa o payload para JSON
-    let json_args = serde_json::to_string(&payload).unwrap();
+    let json_args = serde_json::to_string(payload).unwrap();
 
     // Usa TokioCommand para async streaming
     let mut child = TokioCommand::new("../geosync/.venv/bin/python")
@@ -38,9 +113,11 @@ async fn run_crew(Json(payload): Json<CrewRequest>) -> impl IntoResponse {
     // Lê stdout do Python em tempo real
     while let Some(line) = reader.next_line().await.unwrap_or(None) {
         println!("[PYTHON STDOUT] {line}");
-        // Se a linha for JSON válido, verifica se tem as duas keys
-        if let Ok(json_val) = serde_json::from_str::<serde_json::Value>(&line) {
-            if json_val.get("image_path_1").is_some() && json_val.get("image_path_2").is_some() {
+        // Se a linha for JSON válido, verifica se tem as duas keys (ou o cubo, no modo "timeseries")
+        if let Ok(json_val) = serde_json::from_str::<Value>(&line) {
+            if (json_val.get("image_path_1").is_some() && json_val.get("image_path_2").is_some())
+                || json_val.get("cube").is_some()
+            {
                 last_json = Some(json_val);
             }
         }
@@ -56,17 +133,183 @@ async fn run_crew(Json(payload): Json<CrewRequest>) -> impl IntoResponse {
 
     // Só responde ao cliente quando tiver o JSON do último agente
     match last_json {
-        Some(json) => (axum::http::StatusCode::OK, Json(json)),
-        None => (
-            axum::http::StatusCode::INTERNAL_SERVER_ERROR,
-            Json(serde_json::json!({"error": "No JSON output from crew"})),
-        ),
+        Some(json) => (StatusCode::OK, Json(json)),
+        None => error_response(StatusCode::INTERNAL_SERVER_ERROR, "No JSON output from crew".to_string()),
+    }
+}
+
+// Diretório dos pedidos (GEOSYNC_JOBS_DIR do Python, relativo a ../geosync por omissão)
+fn jobs_dir() -> PathBuf {
+    std::env::var("GEOSYNC_JOBS_DIR")
+        .map(PathBuf::from)
+        .unwrap_or_else(|_| PathBuf::from("../geosync/jobs"))
+}
+
+// Só aceita nomes simples (sem "/", "..", etc.) nos segmentos que vão parar ao caminho
+fn is_safe_segment(segment: &str) -> bool {
+    !segment.is_empty()
+        && segment.chars().all(|c| c.is_ascii_alphanumeric() || c == '-' || c == '_')
+}
+
+// Tiles XYZ gerados pelo analisador (GEOSYNC_TILES=1) em jobs/<job_id>/output/tiles/
+async fn get_tile(
+    Path((job_id, layer, z, x, tile)): Path<(String, String, u32, u32, String)>,
+) -> Response {
+    let Some((y, extension)) = tile.split_once('.') else {
+        return StatusCode::NOT_FOUND.into_response();
+    };
+    let content_type = match extension {
+        "png" => "image/png",
+        "webp" => "image/webp",
+        _ => return StatusCode::NOT_FOUND.into_response(),
+    };
+    if !is_safe_segment(&job_id) || !is_safe_segment(&layer) || y.parse::<u32>().is_err() {
+        return StatusCode::NOT_FOUND.into_response();
+    }
+
+    let path = jobs_dir()
+        .join(&job_id)
+        .join("output")
+        .join("tiles")
+        .join(&layer)
+        .join(z.to_string())
+        .join(x.to_string())
+        .join(&tile);
+    match tokio::fs::read(&path).await {
+        // Os tiles de um pedido nunca mudam depois de publicados
+        Ok(bytes) => (
+            [
+                (header::CONTENT_TYPE, content_type),
+                (header::CACHE_CONTROL, "public, max-age=86400, immutable"),
+            ],
+            bytes,
+        )
+            .into_response(),
+        // Tiles sem dados (fora da ROI) não são escritos
+        Err(e) if e.kind() == std::io::ErrorKind::NotFound => StatusCode::NOT_FOUND.into_response(),
+        Err(e) => error_response(StatusCode::INTERNAL_SERVER_ERROR, format!("Falha ao ler tile: {e}")).into_response(),
+    }
+}
+
+// Diretório das execuções em lote (geosync.batch), relativo a ../geosync por omissão
+fn batches_dir() -> PathBuf {
+    std::env::var("GEOSYNC_BATCHES_DIR")
+        .map(PathBuf::from)
+        .unwrap_or_else(|_| PathBuf::from("../geosync/batches"))
+}
+
+#[derive(Deserialize)]
+struct BatchRequest {
+    // Sítios no formato do geosync.batch: {"address", "first_date", "second_date", "site_id"?, "indices"?}
+    sites: Vec<Value>,
+    #[serde(default)]
+    urban_growth: Option<bool>,
+}
+
+// Lança `python -m geosync.batch` em segundo plano e devolve logo o id do lote (202)
+async fn create_batch(Json(payload): Json<BatchRequest>) -> (StatusCode, Json<Value>) {
+    if payload.sites.is_empty() {
+        return error_response(StatusCode::BAD_REQUEST, "Lista de sítios vazia".to_string());
+    }
+
+    let now = SystemTime::now().duration_since(UNIX_EPOCH).unwrap_or_default();
+    let batch_id = format!("{}-{:08x}", now.as_secs(), now.subsec_nanos() ^ std::process::id());
+    let batch_dir = batches_dir().join(&batch_id);
+    if let Err(e) = tokio::fs::create_dir_all(&batch_dir).await {
+        return error_response(StatusCode::INTERNAL_SERVER_ERROR, format!("Falha ao criar o lote: {e}"));
+    }
+    let batch_dir = tokio::fs::canonicalize(&batch_dir).await.unwrap_or(batch_dir);
+
+    let sites_path = batch_dir.join("sites.jsonl");
+    let lines: String = payload.sites.iter().map(|site| format!("{site}\n")).collect();
+    if let Err(e) = tokio::fs::write(&sites_path, lines).await {
+        return error_response(StatusCode::INTERNAL_SERVER_ERROR, format!("Falha ao guardar os sítios: {e}"));
+    }
+
+    let mut command = TokioCommand::new("../geosync/.venv/bin/python");
+    command
+        .args(["-m", "geosync.batch"])
+        .arg(&sites_path)
+        .arg("--output")
+        .arg(&batch_dir)
+        .current_dir("../geosync")
+        .stdout(Stdio::null())
+        .stderr(Stdio::inherit());
+    if payload.urban_growth == Some(false) {
+        command.arg("--no-urban-growth");
+    }
+    let mut child = match command.spawn() {
+        Ok(child) => child,
+        Err(e) => return error_response(StatusCode::INTERNAL_SERVER_ERROR, format!("Falha ao executar python: {e}")),
+    };
+    // Recolhe o processo quando terminar; o estado fica em status.json. Se o Python morrer
+    // (sítio inválido, erro de importação, OOM...) o lote é marcado como falhado aqui, senão
+    // ficaria eternamente em {"finished": false}
+    let status_dir = batch_dir.clone();
+    tokio::spawn(async move {
+        let error = match child.wait().await {
+            Ok(status) if status.success() => return,
+            Ok(status) => format!("geosync.batch terminou com {status}"),
+            Err(e) => format!("Falha ao aguardar o geosync.batch: {e}"),
+        };
+        eprintln!("[BATCH] {}: {error}", status_dir.display());
+        mark_batch_failed(&status_dir, error).await;
+    });
+
+    (
+        StatusCode::ACCEPTED,
+        Json(serde_json::json!({
+            "batch_id": batch_id,
+            "sites": payload.sites.len(),
+            "status_url": format!("/batch/{batch_id}"),
+        })),
+    )
+}
+
+// Escreve um status.json terminado e com erro, mantendo o progresso já registado pelo Python
+async fn mark_batch_failed(batch_dir: &std::path::Path, error: String) {
+    let status_path = batch_dir.join("status.json");
+    let mut status = match tokio::fs::read_to_string(&status_path).await {
+        Ok(text) => serde_json::from_str::<Value>(&text).unwrap_or_else(|_| serde_json::json!({})),
+        Err(_) => serde_json::json!({"done": 0}),
+    };
+    if let Some(fields) = status.as_object_mut() {
+        fields.insert("finished".to_string(), Value::Bool(true));
+        fields.insert("error".to_string(), Value::String(error));
+    }
+    // Escrita atómica, como no geosync.batch: um GET concorrente nunca lê um ficheiro a meio
+    let tmp_path = batch_dir.join(".status.json.tmp");
+    if tokio::fs::write(&tmp_path, status.to_string()).await.is_ok() {
+        let _ = tokio::fs::rename(&tmp_path, &status_path).await;
+    }
+}
+
+// Progresso do lote (status.json escrito pelo geosync.batch após cada sítio)
+async fn get_batch(Path(batch_id): Path<String>) -> (StatusCode, Json<Value>) {
+    if !is_safe_segment(&batch_id) {
+        return error_response(StatusCode::NOT_FOUND, "Lote desconhecido".to_string());
+    }
+    let batch_dir = batches_dir().join(&batch_id);
+    match tokio::fs::read_to_string(batch_dir.join("status.json")).await {
+        Ok(text) => match serde_json::from_str::<Value>(&text) {
+            Ok(status) => (StatusCode::OK, Json(status)),
+            Err(e) => error_response(StatusCode::INTERNAL_SERVER_ERROR, format!("Estado inválido: {e}")),
+        },
+        // O lote existe mas o Python ainda não escreveu o primeiro estado
+        Err(_) if tokio::fs::metadata(&batch_dir).await.is_ok() => {
+            (StatusCode::OK, Json(serde_json::json!({"finished": false, "done": 0})))
+        }
+        Err(_) => error_response(StatusCode::NOT_FOUND, "Lote desconhecido".to_string()),
     }
 }
 
 #[tokio::main]
 async fn main() {
-    let app = Router::new().route("/crew", post(run_crew));
+    let app = Router::new()
+        .route("/crew", post(run_crew))
+        .route("/batch", post(create_batch))
+        .route("/batch/:batch_id", get(get_batch))
+        .route("/tiles/:job_id/:layer/:z/:x/:tile", get(get_tile));
     println!("Servidor Axum em [http://127.0.0.1](http://127.0.0.1):8080/crew");
     
     let listener = TcpListener::bind("0.0.0.0:8080").await.unwrap();
@@ -0,0 +1,114 @@
+"""
+Compara o SegFormer FP32 com as variantes INT8 de quantize_model.py no conjunto de validação
+(data/val/images + data/val/gt, como no main_fine_tuning.py):
+
+- IoU da classe edifício (1) face às máscaras de referência, e a diferença para o FP32;
+- concordância (IoU) entre as máscaras INT8 e as FP32;
+- latência em CPU (média e p95, batch 1) e memória (pico de RSS do processo e tamanho do ficheiro).
+
+Cada modelo é avaliado num processo próprio, para que o pico de memória de um não conte no outro.
+
+Uso:
+    python evaluate_quantized.py --model segformer_dynamic.onnx --threads 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import onnxruntime as ort
+from PIL import Image
+
+from quantize_model import IMG_SIZE, list_images, preprocess, variant_path
+
+BUILDING_CLASS = 1
+
+
+def load_mask(mask_path, size):
+    """Máscara de referência (0=fundo, 255=edifício) -> booleano no tamanho da saída do modelo."""
+    mask = Image.open(mask_path).convert("L").resize(size, Image.NEAREST)
+    return np.asarray(mask) > 127
+
+
+def iou(prediction, reference):
+    union = np.logical_or(prediction, reference).sum()
+    return float(np.logical_and(prediction, reference).sum() / union) if union else 1.0
+
+
+def evaluate(model_path, pairs, threads):
+    """Corre o modelo em todas as imagens; devolve as máscaras previstas e as métricas."""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    session.run(None, {input_name: preprocess(pairs[0][0])})  # warm-up
+    latencies, ious, predictions = [], [], []
+    for image_path, mask_path in pairs:
+        input_data = preprocess(image_path)
+        start = time.perf_counter()
+        logits = session.run(None, {input_name: input_data})[0]
+        latencies.append(time.perf_counter() - start)
+
+        # Os logits saem a 1/4 da resolução de entrada (128x128 para 512x512)
+        prediction = logits[0].argmax(axis=0) == BUILDING_CLASS
+        predictions.append(prediction)
+        ious.append(iou(prediction, load_mask(mask_path, prediction.shape[::-1])))
+
+    latencies_ms = np.array(latencies) * 1000
+    return predictions, {
+        "iou": float(np.mean(ious)),
+        "latency_ms": float(latencies_ms.mean()),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        # ru_maxrss vem em KB no Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "size_mb": os.path.getsize(model_path) / 1024 ** 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="segformer_dynamic.onnx")
+    parser.add_argument("--variants", nargs="+", default=["int8_dynamic", "int8_static"])
+    parser.add_argument("--img-dir", default="data/val/images")
+    parser.add_argument("--mask-dir", default="data/val/gt")
+    parser.add_argument("--limit", type=int, default=None, help="Número máximo de imagens")
+    parser.add_argument("--threads", type=int, default=0, help="intra_op_num_threads (0 = todos os cores)")
+    args = parser.parse_args()
+
+    pairs = [(path, os.path.join(args.mask_dir, os.path.basename(path))) for path in list_images(args.img_dir)]
+    pairs = [pair for pair in pairs if os.path.exists(pair[1])][:args.limit]
+    if not pairs:
+        raise SystemExit(f"Nenhum par imagem/máscara em {args.img_dir} e {args.mask_dir}")
+    print(f"Avaliação em {len(pairs)} imagens de validação ({IMG_SIZE[0]}x{IMG_SIZE[1]})")
+
+    models = {"fp32": args.model}
+    for variant in args.variants:
+        path = variant_path(args.model, variant)
+        if os.path.exists(path):
+            models[variant] = path
+        else:
+            print(f"Aviso: {path} não existe (gerar com quantize_model.py)")
+
+    results, predictions = {}, {}
+    context = multiprocessing.get_context("spawn")
+    for name, path in models.items():
+        with context.Pool(1) as pool:
+            predictions[name], results[name] = pool.apply(evaluate, (path, pairs, args.threads))
+
+    baseline = results["fp32"]
+    print(f"\n{'modelo':>13} {'IoU':>7} {'ΔIoU':>8} {'conc.':>7} {'lat. ms':>8} {'p95 ms':>8} "
+          f"{'speedup':>8} {'RSS MB':>8} {'MB':>7}")
+    for name, metrics in results.items():
+        agreement = np.mean([iou(a, b) for a, b in zip(predictions[name], predictions["fp32"])])
+        print(f"{name:>13} {metrics['iou']:>7.4f} {metrics['iou'] - baseline['iou']:>+8.4f} {agreement:>7.4f} "
+              f"{metrics['latency_ms']:>8.1f} {metrics['latency_p95_ms']:>8.1f} "
+              f"{baseline['latency_ms'] / metrics['latency_ms']:>7.2f}x "
+              f"{metrics['peak_rss_mb']:>8.0f} {metrics['size_mb']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
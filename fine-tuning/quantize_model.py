@@ -0,0 +1,155 @@
+"""
+Quantização pós-treino (INT8) do SegFormer exportado por export_model_dynamic_images.py.
+
+- dynamic: pesos em INT8, ativações quantizadas em tempo de execução (não precisa de dados);
+- static: pesos e ativações em INT8 (formato QDQ), com as escalas das ativações calibradas
+  num subconjunto das imagens de validação (data/val/images, as mesmas do main_fine_tuning.py).
+
+Os modelos gerados ficam ao lado do original (segformer_dynamic.int8_dynamic.onnx e
+segformer_dynamic.int8_static.onnx) e são escolhidos no UrbanGrowthAnalyzerTool com
+model_variant em config/model_runtime.yaml (ou GEOSYNC_ORT_MODEL_VARIANT).
+
+Uso:
+    python quantize_model.py --model segformer_dynamic.onnx --mode both --calibration-dir data/val/images
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import onnx
+from onnx import version_converter
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quant_pre_process, quantize_dynamic, quantize_static)
+from PIL import Image
+
+IMG_SIZE = (512, 512)
+
+# Normalização ImageNet, a mesma do SegformerImageProcessor e do UrbanGrowthAnalyzerTool
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# A quantização QDQ por canal precisa do atributo axis do QuantizeLinear (opset 13)
+MIN_OPSET = 13
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+
+
+def preprocess(image_path):
+    """Imagem -> tensor (1, 3, 512, 512) normalizado, como na inferência."""
+    image = Image.open(image_path).convert("RGB").resize(IMG_SIZE)
+    image_np = (np.asarray(image, dtype=np.float32) / 255.0 - MEAN) / STD
+    return np.ascontiguousarray(image_np.transpose(2, 0, 1)[None], dtype=np.float32)
+
+
+def list_images(img_dir):
+    return sorted(str(path) for path in Path(img_dir).iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def variant_path(model_path, variant):
+    """segformer_dynamic.onnx -> segformer_dynamic.<variant>.onnx"""
+    path = Path(model_path)
+    return str(path.with_name(f"{path.stem}.{variant}{path.suffix}"))
+
+
+class ValidationDataReader(CalibrationDataReader):
+    """
+    Fornece ao calibrador um subconjunto aleatório (fixo pela seed) das imagens de validação,
+    uma de cada vez, sem as carregar todas em memória.
+    """
+
+    def __init__(self, img_dir, input_name, size=64, seed=0):
+        images = list_images(img_dir)
+        if not images:
+            raise ValueError(f"Nenhuma imagem de calibração encontrada em {img_dir}")
+        random.Random(seed).shuffle(images)
+        self.images = images[:size]
+        self.input_name = input_name
+        self._iterator = iter(self.images)
+        print(f"Calibração com {len(self.images)} imagens de {img_dir}")
+
+    def get_next(self):
+        path = next(self._iterator, None)
+        return None if path is None else {self.input_name: preprocess(path)}
+
+    def rewind(self):
+        self._iterator = iter(self.images)
+
+
+def prepare_model(model_path, work_dir):
+    """
+    Converte o modelo para opset >= 13 (o export usa o 12) e aplica o pré-processamento
+    recomendado para a quantização (inferência de formas e otimizações sem perda).
+    """
+    model = onnx.load(model_path)
+    opset = next(op.version for op in model.opset_import if op.domain in ("", "ai.onnx"))
+    if opset < MIN_OPSET:
+        print(f"A converter o modelo do opset {opset} para o {MIN_OPSET}...")
+        model = version_converter.convert_version(model, MIN_OPSET)
+    converted = os.path.join(work_dir, "converted.onnx")
+    onnx.save(model, converted)
+
+    prepared = os.path.join(work_dir, "prepared.onnx")
+    quant_pre_process(converted, prepared, skip_symbolic_shape=False)
+    return prepared, model.graph.input[0].name
+
+
+def quantize_dynamic_int8(prepared, output_path):
+    quantize_dynamic(prepared, output_path, weight_type=QuantType.QInt8, per_channel=True)
+    return output_path
+
+
+def quantize_static_int8(prepared, output_path, reader, calibrate_method):
+    quantize_static(
+        prepared,
+        output_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=calibrate_method,
+    )
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="segformer_dynamic.onnx")
+    parser.add_argument("--mode", choices=["dynamic", "static", "both"], default="both")
+    parser.add_argument("--calibration-dir", default="data/val/images")
+    parser.add_argument("--calibration-size", type=int, default=64)
+    parser.add_argument("--calibrate-method", choices=["minmax", "percentile", "entropy"], default="percentile")
+    args = parser.parse_args()
+
+    methods = {
+        "minmax": CalibrationMethod.MinMax,
+        "percentile": CalibrationMethod.Percentile,
+        "entropy": CalibrationMethod.Entropy,
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepared, input_name = prepare_model(args.model, work_dir)
+
+        outputs = []
+        if args.mode in ("dynamic", "both"):
+            print("Quantização dinâmica (pesos INT8)...")
+            outputs.append(quantize_dynamic_int8(prepared, variant_path(args.model, "int8_dynamic")))
+        if args.mode in ("static", "both"):
+            print(f"Quantização estática (QDQ, calibração {args.calibrate_method})...")
+            reader = ValidationDataReader(args.calibration_dir, input_name, args.calibration_size)
+            outputs.append(quantize_static_int8(prepared, variant_path(args.model, "int8_static"), reader,
+                                                methods[args.calibrate_method]))
+
+    fp32_size = os.path.getsize(args.model) / 1024 ** 2
+    print(f"FP32: {args.model} ({fp32_size:.1f} MB)")
+    for output in outputs:
+        print(f"INT8: {output} ({os.path.getsize(output) / 1024 ** 2:.1f} MB)")
+    print("Avaliar com: python evaluate_quantized.py --model " + args.model)
+
+
+if __name__ == "__main__":
+    main()
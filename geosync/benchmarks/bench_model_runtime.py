@@ -0,0 +1,88 @@
+"""
+Thread-count sweep for the segmentation model's ONNX Runtime session: session creation time
+(with and without the optimized-graph cache) and throughput in images/s for each
+intra_op_num_threads / execution_mode / batch size combination.
+
+Use the result to pick GEOSYNC_ORT_INTRA_OP_NUM_THREADS for a host (roughly cores / workers on
+shared machines).
+
+Usage (from the geosync/ directory):
+    python benchmarks/bench_model_runtime.py --threads 1 2 4 8 --batch 1 2 8 --repeat 5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from geosync.tools.model_runtime import ModelRuntimeConfig, create_session
+from geosync.tools.urban_analysis_tool import INPUT_SIZE
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(__file__), "..", "src", "geosync", "models", "segformer_dynamic.onnx")
+
+
+def default_threads():
+    cores = os.cpu_count() or 1
+    threads, count = [], 1
+    while count < cores:
+        threads.append(count)
+        count *= 2
+    return threads + [cores]
+
+
+def timed_session(model, config):
+    start = time.perf_counter()
+    session = create_session(model, config)
+    return session, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--threads", type=int, nargs="+", default=default_threads())
+    parser.add_argument("--modes", nargs="+", default=["sequential"], choices=["sequential", "parallel"])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 2, 8])
+    parser.add_argument("--size", type=int, default=INPUT_SIZE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    base = ModelRuntimeConfig.load()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Criação da sessão: otimização completa do grafo vs grafo otimizado lido da cache
+        config = base.model_copy(update={"optimized_model_cache": False})
+        _, cold = timed_session(args.model, config)
+        config = base.model_copy(update={"optimized_model_dir": cache_dir})
+        timed_session(args.model, config)
+        _, cached = timed_session(args.model, config)
+        print(f"session creation: {cold * 1000:.0f}ms optimizing, {cached * 1000:.0f}ms from the cache\n")
+
+        print(f"{'mode':>10} {'threads':>7} {'batch':>5} {'best':>10} {'median':>10} {'img/s':>8}")
+        for mode in args.modes:
+            for threads in args.threads:
+                config = base.model_copy(update={
+                    "intra_op_num_threads": threads,
+                    "inter_op_num_threads": threads if mode == "parallel" else 0,
+                    "execution_mode": mode,
+                    "optimized_model_dir": cache_dir,
+                })
+                session, _ = timed_session(args.model, config)
+                input_name = session.get_inputs()[0].name
+                for batch_size in args.batch:
+                    batch = rng.standard_normal((batch_size, 3, args.size, args.size), dtype=np.float32)
+                    session.run(None, {input_name: batch})  # warm-up (memory arena allocation)
+                    times = []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        session.run(None, {input_name: batch})
+                        times.append(time.perf_counter() - start)
+                    best, median = min(times), sorted(times)[len(times) // 2]
+                    print(f"{mode:>10} {threads:>7} {batch_size:>5} {best * 1000:>8.1f}ms {median * 1000:>8.1f}ms "
+                          f"{batch_size / median:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark of the NDVI kernel backends (numpy out=/where=, numexpr, numba) against the
+original fancy-indexing implementation, across raster sizes.
+
+Usage (from the geosync/ directory):
+    python benchmarks/bench_spectral_kernels.py --sizes 256 1024 4096 10000 --repeat 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from geosync.tools.spectral_kernels import available_backends, ndvi
+
+
+def legacy_ndvi(red, nir):
+    """The pre-kernel implementation: boolean masks, fancy indexing and full-size temporaries."""
+    nir_band = nir.astype(np.float32)
+    red_band = red.astype(np.float32)
+    nir_band[np.isnan(nir_band) | np.isinf(nir_band)] = 0
+    red_band[np.isnan(red_band) | np.isinf(red_band)] = 0
+    denominator = nir_band + red_band
+    valid_mask = denominator > 1e-6
+    result = np.zeros_like(nir_band)
+    result[valid_mask] = (nir_band[valid_mask] - red_band[valid_mask]) / denominator[valid_mask]
+    return (result + 1) / 2
+
+
+def timed(func, repeat):
+    func()  # warm-up (numba compilation, page faults of the output buffer)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 4096, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=available_backends())
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>7} {'backend':>8} {'best':>10} {'median':>10} {'Mpx/s':>8}")
+    for size in args.sizes:
+        red = rng.integers(0, 4000, size=(size, size), dtype=np.uint16)
+        nir = rng.integers(0, 4000, size=(size, size), dtype=np.uint16)
+        out = np.empty((size, size), dtype=np.float32)
+
+        candidates = {"legacy": lambda: legacy_ndvi(red, nir)}
+        for backend in args.backends:
+            candidates[backend] = lambda backend=backend: ndvi(red, nir, out=out, backend=backend)
+
+        for name, func in candidates.items():
+            best, median = timed(func, args.repeat)
+            print(f"{size:>6}² {name:>8} {best * 1000:>8.1f}ms {median * 1000:>8.1f}ms "
+                  f"{size * size / best / 1e6:>8.1f}")
+        del red, nir, out
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Latency benchmark: spawn-per-request (what the API used to do) vs the persistent worker.
+
+Usage (from the geosync/ directory, with the worker already running for the "worker" run):
+    python -m geosync.worker --workers 2 &
+    python benchmarks/bench_worker.py --requests 20 --concurrency 2 \
+        --payload '{"address": "Rua Augusta, Lisboa", "first_date": "2024-04-06", "second_date": "2024-04-13", "mode": "pipeline"}'
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MAIN_PY = Path(__file__).resolve().parent.parent / "src" / "geosync" / "main.py"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def request_spawn(payload):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(MAIN_PY), json.dumps(payload)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    )
+    return time.perf_counter() - start
+
+
+def request_worker(payload, socket_path):
+    start = time.perf_counter()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        stream = sock.makefile("rwb")
+        stream.write((json.dumps(payload) + "\n").encode("utf-8"))
+        stream.flush()
+        stream.readline()
+    return time.perf_counter() - start
+
+
+def run(name, func, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda _: func(), range(requests)))
+    print(f"{name:>7}: n={len(latencies)} p50={percentile(latencies, 50):.3f}s "
+          f"p99={percentile(latencies, 99):.3f}s max={max(latencies):.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload", required=True, help="JSON payload, as sent to /crew")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--socket", default=os.getenv("GEOSYNC_WORKER_SOCKET", "/tmp/geosync.sock"))
+    parser.add_argument("--only", choices=["spawn", "worker"])
+    args = parser.parse_args()
+
+    payload = json.loads(args.payload)
+    if args.only != "worker":
+        run("spawn", lambda: request_spawn(payload), args.requests, args.concurrency)
+    if args.only != "spawn":
+        run("worker", lambda: request_worker(payload, args.socket), args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Análise em lote de muitos sítios (morada + par de datas) numa só execução.
+
+Os sítios vêm de um ficheiro CSV ou JSONL com as colunas/chaves address, first_date,
+second_date e, opcionalmente, site_id e indices (separados por ";" no CSV). Cada sítio passa
+pelas etapas do pipeline (geocode -> fetch -> difference -> urban_growth), mas:
+
+- o trabalho é partilhado: cada morada normalizada é geocodificada uma só vez, e os sítios
+  na mesma célula de ROI com as mesmas datas e índices partilham o download e as análises;
+- as etapas sobrepõem-se: os sítios correm em paralelo e cada etapa tem o seu limite de
+  concorrência, pelo que downloads, análise NDVI e segmentação de sítios diferentes decorrem
+  ao mesmo tempo;
+- as execuções são retomáveis: cada etapa concluída é acrescentada ao checkpoint.jsonl e
+  reaproveitada na execução seguinte com o mesmo diretório de saída, pelo que uma execução
+  interrompida continua onde parou.
+
+O diretório de saída recebe o results.csv (uma linha por sítio), o status.json (progresso)
+e os artefactos das análises em jobs/<job da ROI>/.
+
+Utilização:
+    python -m geosync.batch sites.csv --output batches/weekly
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from geosync.jobs import JobWorkspace
+from geosync.pipeline import (DifferenceResult, GeocodeResult, GeosyncPipeline, PipelineError, SatelliteImages,
+                              UrbanGrowthResult)
+from geosync.tools.earthengine_tool import ROI_CELL_METERS
+from geosync.tools.geocode_cache import normalize_address
+from geosync.tools.tile_cache import snap_to_grid
+
+STAGES = ("geocode", "fetch", "difference", "urban_growth")
+
+# O geocoding é um pedido HTTP barato; os downloads estão limitados pelas quotas do Earth
+# Engine e as análises pelo CPU, e a sessão ONNX já usa todos os núcleos
+DEFAULT_LIMITS = {"geocode": 8, "fetch": 4, "difference": 2, "urban_growth": 1}
+
+RESULT_COLUMNS = [
+    "site_id", "address", "first_date", "second_date", "status", "failed_stage", "error",
+    "lat", "lon", "roi_cell", "job_id", "ndvi_diff", "index_diff_tif",
+    "buildings_first", "buildings_second", "new_buildings", "demolished_buildings", "unchanged_buildings",
+    "footprints",
+]
+
+
+class Site(BaseModel):
+    site_id: str
+    address: str
+    first_date: str
+    second_date: str
+    indices: Optional[List[str]] = None
+
+
+def load_sites(path: str) -> List[Site]:
+    """Lê os sítios de um ficheiro .csv ou .jsonl; as linhas sem site_id são numeradas pela posição."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+            for row in rows:
+                indices = (row.get("indices") or "").strip()
+                row["indices"] = [name.strip() for name in indices.split(";") if name.strip()] or None
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    sites = []
+    for i, row in enumerate(rows, start=1):
+        row = {key: value for key, value in row.items() if value not in (None, "")}
+        row.setdefault("site_id", f"site-{i}")
+        sites.append(Site(**row))
+    return sites
+
+
+class Checkpoint:
+    """Registo só de acrescentos dos resultados das etapas concluídas (uma linha JSON por etapa e chave)."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._done: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Última linha de uma execução que morreu a meio da escrita
+                        continue
+                    self._done[(entry["stage"], entry["key"])] = entry["output"]
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def get(self, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        return self._done.get((stage, key))
+
+    def record(self, stage: str, key: str, output: Dict[str, Any]) -> None:
+        line = json.dumps({"stage": stage, "key": key, "output": output}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._done[(stage, key)] = output
+
+
+def _write_atomic(path: Path, write: Callable) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """
+    Corre muitos sítios por um GeosyncPipeline, como um grafo de tarefas.
+
+    Cada (etapa, chave) é calculada uma única vez: o primeiro sítio que precisa dela
+    calcula-a, e os outros sítios com a mesma chave esperam pelo mesmo future (ou leem-na
+    do checkpoint).
+    """
+
+    def __init__(self, output_dir: str, pipeline: Optional[GeosyncPipeline] = None,
+                 limits: Optional[Dict[str, int]] = None):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.pipeline = pipeline or GeosyncPipeline()
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.checkpoint = Checkpoint(self.output_dir / "checkpoint.jsonl")
+        self._semaphores = {stage: threading.BoundedSemaphore(max(1, self.limits[stage])) for stage in STAGES}
+        self._futures: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._status = {"total": 0, "done": 0, "failed": 0, "finished": False}
+
+    def _once(self, stage: str, key: str, compute: Callable[[], BaseModel]) -> Dict[str, Any]:
+        """Resultado de uma etapa para uma chave, calculado no máximo uma vez por lote (e entre retomas)."""
+        done = self.checkpoint.get(stage, key)
+        if done is not None:
+            return done
+
+        with self._lock:
+            future = self._futures.get((stage, key))
+            owner = future is None
+            if owner:
+                future = self._futures[(stage, key)] = Future()
+        if owner:
+            try:
+                with self._semaphores[stage]:
+                    output = compute().model_dump()
+                self.checkpoint.record(stage, key, output)
+                future.set_result(output)
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def roi_key(self, site: Site, coordinates: GeocodeResult) -> Tuple[str, str]:
+        """(célula da ROI, chave partilhada pelos sítios com a mesma célula, datas e índices)."""
+        # A mesma grelha a que o fetcher alinha a ROI: sítios na mesma célula descarregam as mesmas imagens
+        _, _, cell = snap_to_grid(coordinates.lat, coordinates.lon, ROI_CELL_METERS)
+        indices = ",".join(sorted(name.upper() for name in site.indices or []))
+        return cell, f"{cell}|{site.first_date}|{site.second_date}|{indices}"
+
+    def run_site(self, site: Site) -> Dict[str, Any]:
+        row: Dict[str, Any] = {"site_id": site.site_id, "address": site.address,
+                               "first_date": site.first_date, "second_date": site.second_date}
+        pipeline = self.pipeline
+        try:
+            coordinates = GeocodeResult(**self._once(
+                "geocode", normalize_address(site.address), lambda: pipeline.geocode(site.address)))
+            row.update(lat=coordinates.lat, lon=coordinates.lon)
+
+            cell, key = self.roi_key(site, coordinates)
+            workspace = JobWorkspace(job_id=f"roi-{hashlib.sha1(key.encode()).hexdigest()[:12]}",
+                                     root=str(self.output_dir / "jobs"))
+            row.update(roi_cell=cell, job_id=workspace.job_id)
+
+            images = SatelliteImages(**self._once(
+                "fetch", key,
+                lambda: pipeline.fetch(coordinates, site.first_date, site.second_date, site.indices)))
+            difference = DifferenceResult(**self._once(
+                "difference", key, lambda: pipeline.difference(images, workspace, site.indices)))
+            row.update(ndvi_diff=difference.ndvi_diff, index_diff_tif=difference.index_diff_tif)
+
+            if pipeline.urban_growth:
+                urban_growth = UrbanGrowthResult(**self._once(
+                    "urban_growth", key, lambda: pipeline.segment(difference, workspace)))
+                row.update(
+                    buildings_first=urban_growth.buildings_first,
+                    buildings_second=urban_growth.buildings_second,
+                    new_buildings=urban_growth.new_buildings,
+                    demolished_buildings=urban_growth.demolished_buildings,
+                    unchanged_buildings=urban_growth.unchanged_buildings,
+                    footprints=(urban_growth.footprints or {}).get("parquet"),
+                )
+            row["status"] = "ok"
+        except PipelineError as e:
+            row.update(status="error", failed_stage=e.stage, error=e.message)
+        except Exception as e:
+            row.update(status="error", error=str(e))
+
+        with self._lock:
+            self._status["done"] += 1
+            self._status["failed"] += row["status"] == "error"
+            self._write_status()
+        print(f"[BATCH] {site.site_id}: {row['status']} ({self._status['done']}/{self._status['total']})",
+              file=sys.stderr)
+        return row
+
+    def _write_status(self) -> None:
+        _write_atomic(self.output_dir / "status.json", lambda f: json.dump(self._status, f))
+
+    def write_results(self, rows: List[Dict[str, Any]]) -> Path:
+        path = self.output_dir / "results.csv"
+
+        def write(f):
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        _write_atomic(path, write)
+        return path
+
+    def run(self, sites: List[Site]) -> Dict[str, Any]:
+        """Corre todos os sítios e escreve o results.csv; devolve o estado final."""
+        start = time.time()
+        with self._lock:
+            self._status = {"total": len(sites), "done": 0, "failed": 0, "finished": False}
+            self._write_status()
+
+        # Sítios em curso suficientes para manter todas as etapas ocupadas; os semáforos limitam cada etapa
+        workers = max(1, min(len(sites), sum(self.limits.values())))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(self.run_site, sites))
+
+        results = self.write_results(rows)
+        with self._lock:
+            self._status.update(finished=True, results=str(results.resolve()),
+                                elapsed_seconds=round(time.time() - start, 1))
+            self._write_status()
+        return dict(self._status)
+
+
+def main(argv: Optional[list] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Análise Geosync em lote de muitos sítios")
+    parser.add_argument("sites", help="Ficheiro CSV ou JSONL com address, first_date, second_date")
+    parser.add_argument("--output", default=os.path.join("batches", time.strftime("%Y%m%dT%H%M%S")),
+                        help="Diretório de saída; correr de novo com o mesmo diretório retoma o lote")
+    for stage in STAGES:
+        env = f"GEOSYNC_BATCH_{stage.upper()}_WORKERS"
+        parser.add_argument(f"--{stage.replace('_', '-')}-workers", type=int,
+                            default=int(os.getenv(env, DEFAULT_LIMITS[stage])),
+                            help=f"Chamadas {stage} em paralelo ({env})")
+    parser.add_argument("--fetch-mode", default=os.getenv("GEOSYNC_FETCH_MODE", "geotiff"),
+                        choices=["geotiff", "quadrants", "server", "auto"])
+    parser.add_argument("--no-urban-growth", action="store_true", help="Não segmentar as construções")
+    args = parser.parse_args(argv)
+
+    runner = BatchRunner(
+        args.output,
+        GeosyncPipeline(urban_growth=not args.no_urban_growth, fetch_mode=args.fetch_mode),
+        limits={stage: getattr(args, f"{stage}_workers") for stage in STAGES},
+    )
+    if len(runner.checkpoint):
+        print(f"[BATCH] A retomar: {len(runner.checkpoint)} etapas já concluídas", file=sys.stderr)
+    status = runner.run(load_sites(args.sites))
+    print(json.dumps(status, ensure_ascii=False))
+    return status
+
+
+if __name__ == "__main__":
+    main()
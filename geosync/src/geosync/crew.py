@@ -127,3 +127,39 @@ class Geosync():
             verbose=True,
             # process=Process.hierarchical, # In case you wanna use that instead https://docs.crewai.com/how-to/Hierarchical/
         )
+
+
+@CrewBase
+class GeosyncReport():
+    """Narrative report crew, run on top of results computed by the deterministic pipeline"""
+
+    agents_config = 'config/report_agents.yaml'
+    tasks_config = 'config/report_tasks.yaml'
+
+    @agent
+    def report_agent(self) -> Agent:
+        return Agent(
+            config=self.agents_config['report_agent'],
+            llm=ChatOpenAI(
+                model="gpt-3.5-turbo",
+                temperature=0.5,
+                api_key=os.getenv("OPENAI_API_KEY")
+            ),
+            verbose=True
+        )
+
+    @task
+    def report_task(self) -> Task:
+        return Task(
+            config=self.tasks_config['report_task']
+        )
+
+    @crew
+    def crew(self) -> Crew:
+        """Creates the Geosync report crew"""
+        return Crew(
+            agents=self.agents,
+            tasks=self.tasks,
+            process=Process.sequential,
+            verbose=True,
+        )
@@ -0,0 +1,105 @@
+"""
+Per-request working directories, so concurrent analyses never share output or temp paths.
+
+Each request gets jobs/<job_id>/ with a tmp/ directory for intermediate files and an
+output/ directory for finished artifacts. Artifacts are written into tmp/ first and
+moved into output/ with an atomic rename, so readers never see half-written files.
+"""
+
+import os
+import shutil
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+DEFAULT_JOBS_DIR = "jobs"
+DEFAULT_RETENTION_HOURS = 24.0
+
+
+def jobs_root(root: Optional[str] = None) -> Path:
+    return Path(root or os.getenv("GEOSYNC_JOBS_DIR", DEFAULT_JOBS_DIR))
+
+
+class JobWorkspace:
+    """Isolated working directory of a single request."""
+
+    def __init__(self, job_id: Optional[str] = None, root: Optional[str] = None):
+        self.job_id = job_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.path = jobs_root(root) / self.job_id
+        self.output_dir = self.path / "output"
+        self.tmp_dir = self.path / "tmp"
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_dir(cls, job_dir: str) -> "JobWorkspace":
+        """Reopens an existing job directory (e.g. the one created by a previous stage)."""
+        path = Path(job_dir)
+        return cls(job_id=path.name, root=str(path.parent))
+
+    @classmethod
+    def for_artifact(cls, artifact_path: str) -> Optional["JobWorkspace"]:
+        """Returns the job an artifact (jobs/<job_id>/output/<name>) belongs to, if any."""
+        output_dir = Path(artifact_path).resolve().parent
+        if output_dir.name == "output" and output_dir.parent.parent == jobs_root().resolve():
+            return cls.from_dir(str(output_dir.parent))
+        return None
+
+    def output_path(self, name: str) -> str:
+        return str(self.output_dir / name)
+
+    def publish(self, tmp_path: str, name: str) -> str:
+        """Moves a finished file from tmp/ into output/ (atomic on the same filesystem)."""
+        final_path = self.output_dir / name
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, final_path)
+        return str(final_path)
+
+    @contextmanager
+    def artifact(self, name: str) -> Iterator[str]:
+        """
+        Yields a temporary path to write `name` to; on success the file (or directory, e.g.
+        a tile pyramid) is published to output/, on error it is discarded.
+        """
+        tmp_path = self.tmp_dir / name
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            yield str(tmp_path)
+        except BaseException:
+            if tmp_path.is_dir():
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            elif tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        self.publish(str(tmp_path), name)
+
+    def cleanup_tmp(self) -> None:
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def gc_jobs(root: Optional[str] = None, retention_hours: Optional[float] = None) -> int:
+    """
+    Removes job directories older than the retention period (GEOSYNC_JOB_RETENTION_HOURS).
+
+    Returns:
+        Number of job directories removed
+    """
+    if retention_hours is None:
+        retention_hours = float(os.getenv("GEOSYNC_JOB_RETENTION_HOURS", DEFAULT_RETENTION_HOURS))
+    base = jobs_root(root)
+    if not base.exists():
+        return 0
+
+    cutoff = time.time() - retention_hours * 3600
+    removed = 0
+    for job_dir in base.iterdir():
+        try:
+            if job_dir.is_dir() and job_dir.stat().st_mtime < cutoff:
+                shutil.rmtree(job_dir)
+                removed += 1
+        except OSError as e:
+            print(f"[JOBS] Não foi possível remover {job_dir}: {e}", file=sys.stderr)
+    return removed
@@ -16,6 +16,8 @@ project_root = Path(__file__).parent.parent.parent
 os.environ["PYTHONPATH"] = str(project_root)
 
 from geosync.crew import Geosync
+from geosync.pipeline import GeosyncPipeline, run_report
+from geosync.tools.timeseries import DEFAULT_CADENCE_DAYS
 
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
@@ -47,6 +49,14 @@ def run(inputs=None):
     #     "second_date": "2024-04-13",
     #     "current_year": str(datetime.datetime.now().year)
     # }
+
+    # "crew" (default) runs the LLM agents; "pipeline" chains the tools directly;
+    # "timeseries" updates the site's NDVI cube between first_date and second_date
+    if inputs.get("mode", "crew") == "pipeline":
+        return run_pipeline(inputs)
+    if inputs.get("mode") == "timeseries":
+        return run_timeseries(inputs)
+
     try:
         print("[DEBUG] Running the crew: KICKOFF")
         Geosync().crew().kickoff(inputs=inputs)
@@ -54,6 +64,48 @@ def run(inputs=None):
         raise Exception(f"An error occurred while running the crew: {e}")
 
 
+def run_pipeline(inputs):
+    """
+    Run the deterministic pipeline (no LLM agents) and print the result as a JSON line.
+    Set "report": true in the inputs to also get a narrative written by the report crew.
+    """
+    try:
+        result = GeosyncPipeline().run(
+            address=inputs["address"],
+            first_date=inputs["first_date"],
+            second_date=inputs["second_date"],
+            indices=inputs.get("indices"),
+        )
+        if inputs.get("report"):
+            result.report = run_report(result)
+    except Exception as e:
+        raise Exception(f"An error occurred while running the pipeline: {e}")
+
+    output = result.to_output()
+    print(json.dumps(output, ensure_ascii=False))
+    return output
+
+
+def run_timeseries(inputs):
+    """
+    Append the missing composites (one every "cadence_days", default 30) to the site's
+    NDVI cube and print the result, with the trend rasters, as a JSON line.
+    """
+    try:
+        result = GeosyncPipeline().timeseries(
+            address=inputs["address"],
+            start_date=inputs["first_date"],
+            end_date=inputs["second_date"],
+            cadence_days=int(inputs.get("cadence_days", DEFAULT_CADENCE_DAYS)),
+        )
+    except Exception as e:
+        raise Exception(f"An error occurred while running the time series: {e}")
+
+    output = result.model_dump()
+    print(json.dumps(output, ensure_ascii=False))
+    return output
+
+
 def train():
     """
     Train the crew for a given number of iterations.
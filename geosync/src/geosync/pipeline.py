@@ -0,0 +1,366 @@
+"""
+Deterministic pipeline that chains the Geosync tools without going through the LLM agents.
+"""
+
+import datetime
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from geosync.jobs import JobWorkspace, gc_jobs
+from geosync.tools.geocoding_tool import GeoapifyTool
+from geosync.tools.earthengine_tool import DEFAULT_BANDS, EarthEngineImageFetcherTool
+from geosync.tools.image_difference_analyzer_tool import ImageDifferenceAnalyzerTool
+from geosync.tools.tile_cache import snap_to_grid
+from geosync.tools.timeseries import DEFAULT_CADENCE_DAYS, NDVICube, cube_lock, ndvi_from_composite, step_windows
+
+DEFAULT_TIMESERIES_DIR = "timeseries"
+
+# One cube per cell of the fetcher's ROI grid (scale 10 m x snap_pixels 32)
+TIMESERIES_CELL_METERS = 320.0
+
+
+class PipelineError(Exception):
+    """Raised when one of the pipeline stages fails."""
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(f"[{stage}] {message}")
+        self.stage = stage
+        self.message = message
+
+    def __reduce__(self):
+        # Permite enviar o erro entre processos (worker pool)
+        return (PipelineError, (self.stage, self.message))
+
+
+class GeocodeResult(BaseModel):
+    lat: float
+    lon: float
+
+
+class SatelliteImages(BaseModel):
+    first_date_images: Dict[str, str]
+    second_date_images: Dict[str, str]
+    # Cena Sentinel-2 escolhida para cada data: {"id", "time", "cloud"}
+    scenes: Optional[Dict[str, Any]] = None
+    # Ordem das bandas nos GeoTIFF multibanda (fetch_mode="geotiff")
+    bands: Optional[List[str]] = None
+    # fetch_mode="server": diferença NDVI calculada no Earth Engine (as imagens de cada data
+    # são então bandas reduzidas, só para pré-visualização)
+    ndvi_diff_tiles: Optional[List[str]] = None
+    # fetch_mode="auto"/"server": estimativas do modelo de custo e modo escolhido
+    fetch_plan: Optional[Dict[str, Any]] = None
+
+
+class DifferenceResult(BaseModel):
+    image_path_1: str
+    image_path_2: str
+    ndvi_antiga: str
+    ndvi_recente: str
+    ndvi_diff: str
+    ndvi_diff_enhanced: Optional[str] = None
+    index_diff_tif: Optional[str] = None
+    # GeoTIFFs georreferenciados com as bandas B4/B3/B2 em bruto de cada data
+    rgb_tif_1: Optional[str] = None
+    rgb_tif_2: Optional[str] = None
+    indices: Optional[List[str]] = None
+    index_stats: Optional[Dict[str, Dict[str, float]]] = None
+    job_dir: Optional[str] = None
+
+
+class UrbanGrowthResult(BaseModel):
+    # A tool devolve chaves em português, mapeadas aqui para nomes estáveis
+    model_config = ConfigDict(populate_by_name=True)
+
+    buildings_first: int = Field(alias="Edifícios na data 1")
+    buildings_second: int = Field(alias="Edifícios na data 2")
+    new_buildings: int = Field(alias="Novas construções")
+    diff_image: str = Field(alias="Imagem de diferença guardada em")
+    buildings_first_image: str = Field(alias="Edifícios identificados na primeira imagem")
+    buildings_second_image: str = Field(alias="Edifícios identificados na segunda imagem")
+    images_per_second: Optional[float] = Field(default=None, alias="Imagens por segundo")
+    # Máscaras GeoTIFF (256x256 no modo "resize", à resolução nativa no modo "tiled")
+    mask_first: Optional[str] = Field(default=None, alias="Máscara de construções na data 1")
+    mask_second: Optional[str] = Field(default=None, alias="Máscara de construções na data 2")
+    new_buildings_mask: Optional[str] = Field(default=None, alias="Máscara de novas construções")
+    # Emparelhamento dos footprints entre datas e ficheiros vetoriais (formato -> caminho)
+    demolished_buildings: Optional[int] = Field(default=None, alias="Construções demolidas")
+    unchanged_buildings: Optional[int] = Field(default=None, alias="Construções inalteradas")
+    footprints: Optional[Dict[str, str]] = Field(default=None, alias="Footprints das construções")
+
+
+class PipelineResult(BaseModel):
+    address: str
+    first_date: str
+    second_date: str
+    coordinates: GeocodeResult
+    images: SatelliteImages
+    difference: DifferenceResult
+    urban_growth: Optional[UrbanGrowthResult] = None
+    job_id: Optional[str] = None
+    report: Optional[str] = None
+
+    def to_output(self) -> Dict[str, Any]:
+        """Serializes the result, keeping the top-level image paths the API looks for."""
+        output = self.model_dump()
+        output["image_path_1"] = self.difference.image_path_1
+        output["image_path_2"] = self.difference.image_path_2
+        return output
+
+
+class TimeSeriesResult(BaseModel):
+    address: str
+    coordinates: GeocodeResult
+    cube: str
+    cadence_days: int
+    # Every date in the cube, and the ones added by this run
+    dates: List[str]
+    appended: List[str]
+    # Per-pixel NDVI trend (per year) and largest drop from an earlier peak
+    slope_tif: Optional[str] = None
+    max_drop_tif: Optional[str] = None
+    job_id: Optional[str] = None
+
+
+def _as_dict(stage: str, output: Any) -> Dict[str, Any]:
+    """Normalizes a tool output (dict, JSON string or error message) into a dict."""
+    if isinstance(output, dict):
+        data = output
+    else:
+        try:
+            data = json.loads(output)
+        except (TypeError, ValueError):
+            raise PipelineError(stage, str(output))
+        if not isinstance(data, dict):
+            raise PipelineError(stage, str(output))
+
+    if "error" in data:
+        raise PipelineError(stage, str(data["error"]))
+    return data
+
+
+class GeosyncPipeline:
+    """
+    Runs geocode -> satellite fetch -> NDVI difference -> urban growth by calling the
+    tools' `_run` methods directly. Tools are created once and reused between runs,
+    so a long-lived process only loads models and sessions on the first request.
+    """
+
+    def __init__(
+        self,
+        urban_growth: bool = True,
+        fetch_mode: Optional[str] = None,
+        geocoder: Optional[GeoapifyTool] = None,
+        fetcher: Optional[EarthEngineImageFetcherTool] = None,
+        analyzer: Optional[ImageDifferenceAnalyzerTool] = None,
+        urban_analyzer=None,
+    ):
+        self.urban_growth = urban_growth
+        # "geotiff", "quadrants", "server" or "auto" (geotiff or server, by ROI size)
+        self.fetch_mode = fetch_mode or os.getenv("GEOSYNC_FETCH_MODE", "geotiff")
+        self._geocoder = geocoder
+        self._fetcher = fetcher
+        self._analyzer = analyzer
+        self._urban_analyzer = urban_analyzer
+
+    @property
+    def geocoder(self) -> GeoapifyTool:
+        if self._geocoder is None:
+            self._geocoder = GeoapifyTool()
+        return self._geocoder
+
+    @property
+    def fetcher(self) -> EarthEngineImageFetcherTool:
+        if self._fetcher is None:
+            self._fetcher = EarthEngineImageFetcherTool()
+        return self._fetcher
+
+    @property
+    def analyzer(self) -> ImageDifferenceAnalyzerTool:
+        if self._analyzer is None:
+            self._analyzer = ImageDifferenceAnalyzerTool()
+        return self._analyzer
+
+    @property
+    def urban_analyzer(self):
+        if self._urban_analyzer is None:
+            # Importado aqui para não carregar o onnxruntime quando a etapa está desligada
+            from geosync.tools.urban_analysis_tool import UrbanGrowthAnalyzerTool
+            self._urban_analyzer = UrbanGrowthAnalyzerTool()
+        return self._urban_analyzer
+
+    def _stage(self, stage: str, func, **kwargs) -> Dict[str, Any]:
+        print(f"[PIPELINE] {stage}: {kwargs}", file=sys.stderr)
+        try:
+            output = func(**kwargs)
+        except PipelineError:
+            raise
+        except Exception as e:
+            raise PipelineError(stage, str(e)) from e
+        return _as_dict(stage, output)
+
+    def geocode(self, address: str) -> GeocodeResult:
+        return GeocodeResult(**self._stage("geocode", self.geocoder._run, address=address))
+
+    def fetch(self, coordinates: GeocodeResult, first_date: str, second_date: str,
+              indices: Optional[List[str]] = None) -> SatelliteImages:
+        kwargs = {}
+        if self.fetch_mode in ("auto", "server"):
+            # Server-side NDVI only brings reduced RGB, too coarse for the building segmentation
+            kwargs["full_res_rgb"] = self.urban_growth
+        return SatelliteImages(**self._stage(
+            "fetch",
+            self.fetcher._run,
+            lat=coordinates.lat,
+            lon=coordinates.lon,
+            first_date=first_date,
+            second_date=second_date,
+            fetch_mode=self.fetch_mode,
+            indices=indices,
+            **kwargs,
+        ))
+
+    def difference(self, images: SatelliteImages, workspace: JobWorkspace,
+                   indices: Optional[List[str]] = None) -> DifferenceResult:
+        kwargs = {}
+        if images.ndvi_diff_tiles:
+            kwargs["ndvi_diff_tiles"] = images.ndvi_diff_tiles
+        return DifferenceResult(**self._stage(
+            "difference",
+            self.analyzer._run,
+            first_date_images=images.first_date_images,
+            second_date_images=images.second_date_images,
+            bands=images.bands,
+            job_dir=str(workspace.path),
+            indices=indices,
+            **kwargs,
+        ))
+
+    def segment(self, difference: DifferenceResult, workspace: JobWorkspace) -> UrbanGrowthResult:
+        return UrbanGrowthResult(**self._stage(
+            "urban_growth",
+            self.urban_analyzer._run,
+            # As bandas georreferenciadas, em vez das pré-visualizações PNG (estiradas e sem coordenadas)
+            image_path_1=difference.rgb_tif_1 or difference.image_path_1,
+            image_path_2=difference.rgb_tif_2 or difference.image_path_2,
+            job_dir=str(workspace.path),
+        ))
+
+    def run(self, address: str, first_date: str, second_date: str,
+            indices: Optional[List[str]] = None) -> PipelineResult:
+        """
+        Args:
+            indices: spectral indices to compute besides NDVI (e.g. ["NDBI", "EVI"]);
+                the fetcher downloads whatever extra bands they need
+        """
+        # Every run writes into its own jobs/<job_id>/ so concurrent requests never collide
+        gc_jobs()
+        workspace = JobWorkspace()
+
+        coordinates = self.geocode(address)
+        images = self.fetch(coordinates, first_date, second_date, indices)
+        difference = self.difference(images, workspace, indices)
+        urban_growth = self.segment(difference, workspace) if self.urban_growth else None
+
+        return PipelineResult(
+            address=address,
+            first_date=first_date,
+            second_date=second_date,
+            coordinates=coordinates,
+            images=images,
+            difference=difference,
+            urban_growth=urban_growth,
+            job_id=workspace.job_id,
+        )
+
+    def timeseries(self, address: str, start_date: str, end_date: str,
+                   cadence_days: int = DEFAULT_CADENCE_DAYS) -> TimeSeriesResult:
+        """
+        Keeps a per-site NDVI cube up to date: one composite per `cadence_days` window
+        between the dates. Only windows that have closed and come after the last date already
+        in the cube are fetched and appended. Windows follow the cube's grid (anchored at the
+        start date of the request that created it), and a file lock serializes requests for
+        the same cube. The slope and max-drop rasters then come from the cube's running
+        per-pixel sums.
+        """
+        gc_jobs()
+        workspace = JobWorkspace()
+        coordinates = self.geocode(address)
+        _, _, cell = snap_to_grid(coordinates.lat, coordinates.lon, TIMESERIES_CELL_METERS)
+        cube_path = os.path.join(os.getenv("GEOSYNC_TIMESERIES_DIR", DEFAULT_TIMESERIES_DIR),
+                                 f"{cell.replace(':', '_')}_{cadence_days}d.h5")
+
+        # O lock cobre a leitura da última data, o fetch e os appends: dois pedidos do mesmo
+        # local (ex. no pool de workers) não pedem as mesmas janelas nem intercalam escritas
+        with cube_lock(cube_path):
+            # As janelas seguem a grelha do cubo (ancorada no início do primeiro pedido), qualquer
+            # que seja o start_date deste pedido
+            anchor, last = start_date, None
+            if os.path.exists(cube_path):
+                with NDVICube(cube_path) as cube:
+                    anchor = cube.anchor or start_date
+                    last = cube.dates[-1].isoformat() if len(cube) else None
+            today = datetime.date.today().isoformat()
+            pending = [(start, end) for start, end in step_windows(start_date, end_date, cadence_days, anchor)
+                       if end <= today and (last is None or start > last)]
+
+            composites = {}
+            if pending:
+                composites = self._stage("fetch", self.fetcher.fetch_composites,
+                                         lat=coordinates.lat, lon=coordinates.lon, windows=pending,
+                                         bands=DEFAULT_BANDS)
+
+            appended = []
+            cube = None
+            try:
+                for start, _ in pending:
+                    path = composites.get(start)
+                    if path is None:
+                        print(f"[PIPELINE] timeseries: sem cenas na janela de {start}", file=sys.stderr)
+                        continue
+                    ndvi, profile = ndvi_from_composite(path, DEFAULT_BANDS)
+                    if cube is None:
+                        cube = NDVICube(cube_path, profile, anchor=anchor)
+                    cube.append(start, ndvi)
+                    appended.append(start)
+
+                if cube is None:
+                    if not os.path.exists(cube_path):
+                        raise PipelineError("timeseries", f"No composites found between {start_date} and {end_date}")
+                    cube = NDVICube(cube_path)
+                with workspace.artifact("ndvi_slope.tif") as slope_tmp, \
+                        workspace.artifact("ndvi_max_drop.tif") as drop_tmp:
+                    cube.write_trends(slope_tmp, drop_tmp)
+                dates = [date.isoformat() for date in cube.dates]
+            finally:
+                if cube is not None:
+                    cube.close()
+        workspace.cleanup_tmp()
+
+        return TimeSeriesResult(
+            address=address,
+            coordinates=coordinates,
+            cube=os.path.abspath(cube_path),
+            cadence_days=cadence_days,
+            dates=dates,
+            appended=appended,
+            slope_tif=os.path.abspath(workspace.output_path("ndvi_slope.tif")),
+            max_drop_tif=os.path.abspath(workspace.output_path("ndvi_max_drop.tif")),
+            job_id=workspace.job_id,
+        )
+
+
+def run_report(result: PipelineResult) -> str:
+    """Asks the report crew for a narrative on top of already computed results."""
+    from geosync.crew import GeosyncReport
+
+    output = GeosyncReport().crew().kickoff(inputs={
+        "address": result.address,
+        "first_date": result.first_date,
+        "second_date": result.second_date,
+        "results": json.dumps(result.model_dump(exclude={"report"}), ensure_ascii=False),
+    })
+    return output.raw
@@ -1,13 +1,24 @@
 from crewai.tools import BaseTool
-from pydantic import BaseModel, Field
-from typing import Type, List, Dict
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Type, List, Dict, Optional, Tuple
 import datetime
 import os
 import requests
 import ee
 import logging
 import json
+import math
 import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from geosync.tools.fetch_planner import DEFAULT_PREVIEW_FACTOR, FetchPlan, plan_fetch
+from geosync.tools.index_engine import DIFF_NODATA
+from geosync.tools.spectral_indices import required_bands, resolve_indices
+from geosync.tools.tile_cache import TileCache, snap_to_grid
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -18,73 +29,315 @@ logging.basicConfig(
     ]
 )
 
+# O Earth Engine só precisa de ser inicializado uma vez por processo
+_ee_initialized = False
+
+def initialize_earth_engine(project: str = "ee-syncearth") -> None:
+    """Inicializa o Earth Engine se ainda não tiver sido inicializado neste processo."""
+    global _ee_initialized
+    if not _ee_initialized:
+        ee.Initialize(project=project)
+        _ee_initialized = True
+
+COLLECTION_ID = 'COPERNICUS/S2_HARMONIZED'
+
+# Bandas usadas pela análise: azul, verde, vermelho e infravermelho próximo
+DEFAULT_BANDS = ["B2", "B3", "B4", "B8"]
+
+# Limite de tamanho de um pedido getDownloadURL do Earth Engine (com margem de segurança)
+EE_DOWNLOAD_LIMIT_BYTES = int(50331648 * 0.9)
+
+# Pixels por lado de cada quadrante (a ROI tem o dobro de lado)
+DEFAULT_MAX_PIXELS = 256
+
+# Resolução (m/pixel) dos downloads e grelha, em pixels, a que o centro da ROI é alinhado:
+# moradas na mesma célula de ROI_CELL_METERS descarregam exatamente as mesmas imagens
+DEFAULT_SCALE = 10
+DEFAULT_SNAP_PIXELS = 32
+ROI_CELL_METERS = DEFAULT_SCALE * DEFAULT_SNAP_PIXELS
+
+# Bits da banda QA60 com nuvens opacas (10) e cirros (11)
+QA60_CLOUD_BITS = (1 << 10) | (1 << 11)
+
+# Probabilidade de nuvem do s2cloudless, emparelhada com as cenas pelo system:index
+CLOUD_PROBABILITY_ID = "COPERNICUS/S2_CLOUD_PROBABILITY"
+
+# Máscara de nuvens (GEOSYNC_CLOUD_MASK): "s2cloudless" ou "qa60" (a QA60 não tem nuvens
+# entre 2022-01 e 2024-02); píxeis com probabilidade acima de GEOSYNC_CLOUD_PROBABILITY são nuvem
+DEFAULT_CLOUD_MASK = "s2cloudless"
+DEFAULT_CLOUD_PROBABILITY = 40
+
+# Fração máxima da ROI com nuvens ou sem dados (GEOSYNC_MAX_ROI_CLOUD) para uma data ser usada
+DEFAULT_MAX_ROI_CLOUD = 0.2
+
+# Composite da janela em vez da melhor cena (GEOSYNC_COMPOSITE): "never", "auto" ou "always"
+DEFAULT_COMPOSITE = "auto"
+
+# Resolução (m) a que a cobertura de nuvens da ROI é avaliada (a da QA60)
+CLOUD_EVAL_SCALE = 60
+
+
+def _fraction(value: Optional[float]) -> float:
+    # Sem píxeis avaliados (ex.: ROI fora da cena) conta como ROI inutilizável
+    return 1.0 if value is None else float(value)
+
+
+def choose_scene_source(scene: Optional[dict], label: str, max_roi_cloud: float = DEFAULT_MAX_ROI_CLOUD,
+                        composite: str = DEFAULT_COMPOSITE) -> Dict:
+    """
+    Decide, antes de descarregar qualquer píxel, se uma data usa a melhor cena da janela,
+    um composite da janela, ou se é rejeitada por ter nuvens a mais sobre a ROI.
+
+    Args:
+        scene: resumo do scene_summary ({"id", "roi_cloud", "composite_cloud", ...}) ou None
+        label: data, para as mensagens de erro (ex.: "start date: 2024-04-06")
+        composite: "never" (só cenas), "auto" (composite quando a melhor cena não serve) ou "always"
+
+    Returns:
+        O resumo com "composite" True/False, ou {"error": ...}
+    """
+    if not scene:
+        return {"error": f"No image found for {label}"}
+
+    roi_cloud = _fraction(scene.get("roi_cloud"))
+    composite_cloud = _fraction(scene.get("composite_cloud"))
+    if composite != "always" and roi_cloud <= max_roi_cloud:
+        return {**scene, "composite": False}
+    if composite != "never" and composite_cloud <= max_roi_cloud:
+        return {**scene, "composite": True}
+
+    details = f"best scene {roi_cloud:.0%} of the ROI clouded or without data"
+    if composite != "never":
+        details += f", {composite_cloud:.0%} even for a composite of the {scene.get('scenes', 0)} scenes"
+    return {"error": f"No usable image for {label}: {details} (limit {max_roi_cloud:.0%}). Try other dates."}
+
+# Memo local (célula da ROI, janela de datas) -> cena escolhida, partilhado pelo processo.
+# Só janelas já fechadas são memorizadas: o Earth Engine ainda pode ingerir cenas recentes.
+_SCENE_MEMO_MAX = 1024
+_SCENE_MEMO_SETTLE_DAYS = 7
+_scene_memo: "OrderedDict[tuple, Optional[dict]]" = OrderedDict()
+_scene_memo_lock = threading.Lock()
+
 class SatelliteImageFetcherInput(BaseModel):
     lat: float = Field(..., description="Latitude coordinate")
     lon: float = Field(..., description="Longitude coordinate")
     first_date: str = Field(..., description="Start date for image acquisition (YYYY-MM-DD)")
     second_date: str = Field(..., description="End date for image acquisition (YYYY-MM-DD)")
+    fetch_mode: str = Field("quadrants", description="'quadrants' (4 zips per date), 'geotiff' (one multi-band GeoTIFF per date), 'server' (NDVI difference computed on Earth Engine) or 'auto' (geotiff or server, by cost)")
+    indices: Optional[List[str]] = Field(None, description="Spectral indices to be computed besides NDVI (e.g. NDBI, EVI); selects the bands to download")
+    full_res_rgb: bool = Field(False, description="Whether full-resolution RGB bands are needed (building segmentation); 'auto' then stays local and 'server' falls back to 'geotiff'")
 
 class EarthEngineImageFetcherTool(BaseTool):
     name: str = "EarthEngineImageFetcher"
     description: str = "Obtém imagens de satélite utilizando coordenadas (latitude e longitude)"
     args_schema: Type[BaseModel] = SatelliteImageFetcherInput
 
-    def download_image_if_not_exists(self, url: str, filename: str) -> str:
-        """Download an image if it doesn't exist locally."""
-        # Check if the directory exists, create if not
-        mkdir_result = os.makedirs("raw_images", exist_ok=True)
-        print("Directory created: raw_images", mkdir_result, file=sys.stderr)
+    _tile_cache: Optional[TileCache] = PrivateAttr(default=None)
+    _session: Optional[requests.Session] = PrivateAttr(default=None)
 
-        # Format the full filepath
-        filepath = os.path.join("raw_images", filename)
-        
-        # Check if the image already exists
-        if os.path.exists(filepath):
-            return f"Image already exists: {filepath}"
+    @property
+    def tile_cache(self) -> TileCache:
+        if self._tile_cache is None:
+            self._tile_cache = TileCache()
+        return self._tile_cache
 
-        # Download the image
-        print("Downloading image...", file=sys.stderr)
-        try:
-            response = requests.get(url, stream=True)
+    @property
+    def download_workers(self) -> int:
+        return int(os.getenv("GEOSYNC_DOWNLOAD_WORKERS", "8"))
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Sessão HTTP partilhada entre downloads (ligações reutilizadas), com retry e
+        backoff exponencial em 429/5xx.
+        """
+        if self._session is None:
+            retry = Retry(
+                total=5,
+                backoff_factor=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=self.download_workers,
+                pool_maxsize=self.download_workers,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    def stream_to_file(self, url: str, f, chunk_size: int = 1024 * 1024) -> None:
+        """Escreve a resposta em blocos, sem carregar o ficheiro inteiro em memória."""
+        with self.session.get(url, stream=True, timeout=(10, 300)) as response:
             if response.status_code != 200:
-                return f"Failed to download image: {response.status_code}"
+                raise RuntimeError(f"Failed to download image: {response.status_code}")
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    def download_to_cache(self, image: ee.Image, image_id: str, region: ee.Geometry, region_name: str,
+                          cell: str, scale: int, bands: Optional[List[str]] = None,
+                          file_format: Optional[str] = None) -> str:
+        """
+        Devolve o ficheiro (zip, ou GeoTIFF com file_format="GEO_TIFF") da imagem para a
+        região pedida, descarregando-o apenas se ainda não estiver na cache. O URL de
+        download só é pedido ao Earth Engine em caso de miss.
+        """
+        key = TileCache.make_key(image_id, cell, f"{region_name}:{file_format or 'ZIPPED_GEO_TIFF'}", scale, bands)
+        cached = self.tile_cache.get(key)
+        if cached:
+            print(f"Image found in cache: {cached}", file=sys.stderr)
+            return cached
+
+        print("Downloading image...", file=sys.stderr)
+        url = self.get_image_url(image, region, scale, bands, file_format)
+
+        return self.tile_cache.put(
+            key,
+            lambda f: self.stream_to_file(url, f),
+            suffix=".tif" if file_format == "GEO_TIFF" else ".zip",
+            image_id=image_id,
+            cell=cell,
+            region=region_name,
+            scale=scale,
+            bands=bands,
+        )
+
+    @property
+    def cloud_mask_method(self) -> str:
+        return os.getenv("GEOSYNC_CLOUD_MASK", DEFAULT_CLOUD_MASK).lower()
+
+    @property
+    def cloud_probability(self) -> int:
+        return int(os.getenv("GEOSYNC_CLOUD_PROBABILITY", DEFAULT_CLOUD_PROBABILITY))
+
+    @property
+    def cloud_mask_id(self) -> str:
+        """Identifica a máscara nas chaves da cache (os composites dependem dela)."""
+        if self.cloud_mask_method == "s2cloudless":
+            return f"s2cloudless{self.cloud_probability}"
+        return self.cloud_mask_method
 
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            return filepath
-        except Exception as e:
-            return f"Error downloading image: {str(e)}"
-    
     def get_image_collection(self, ROI: ee.Geometry) -> ee.ImageCollection:
         # collection = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
         #         .filterBounds(ROI) \
         #         .filterDate(image_date.strftime('%Y-%m-%d'), (image_date + datetime.timedelta(days=1)).strftime('%Y-%m-%d')) \
         #         .sort("CLOUDY_PIXEL_PERCENTAGE")
-        collection = ee.ImageCollection('COPERNICUS/S2_HARMONIZED').filterBounds(ROI)
+        collection = ee.ImageCollection(COLLECTION_ID).filterBounds(ROI)
         return collection
         
-    def get_image_url(self, image: ee.Image, ROI: ee.Geometry, scale: int = 100) -> str:
-        return image.getDownloadURL({
+    def get_image_url(self, image: ee.Image, ROI: ee.Geometry, scale: int = 100,
+                      bands: Optional[List[str]] = None, file_format: Optional[str] = None) -> str:
+        params = {
             'scale': scale,
             'region': ROI,
             #'format': 'GEO_TIFF'
             'crs': 'EPSG:4326'
-        })
+        }
+        if bands:
+            params['bands'] = bands
+        if file_format:
+            params['format'] = file_format
+        return image.getDownloadURL(params)
     
-    def get_nearest_image(self, collection: ee.ImageCollection, date: datetime.datetime, window: int = 30, after=True) -> ee.Image:
+    def date_window(self, date: datetime.datetime, window: int = 30, after=True) -> Tuple[str, str]:
         if after:
-            filtered = collection.filterDate(
-                date.strftime('%Y-%m-%d'),
-                (date + datetime.timedelta(days=window)).strftime('%Y-%m-%d')
-            )
-        else:
-            filtered = collection.filterDate(
-                (date - datetime.timedelta(days=window)).strftime('%Y-%m-%d'),
-                date.strftime('%Y-%m-%d')
-            )
-        if filtered.size().getInfo() > 0:
-            return filtered.sort("CLOUDY_PIXEL_PERCENTAGE").first()
-        return None
+            return date.strftime('%Y-%m-%d'), (date + datetime.timedelta(days=window)).strftime('%Y-%m-%d')
+        return (date - datetime.timedelta(days=window)).strftime('%Y-%m-%d'), date.strftime('%Y-%m-%d')
+
+    def with_cloud_probability(self, collection: ee.ImageCollection, roi: ee.Geometry, start: str,
+                               end: str) -> ee.ImageCollection:
+        """Cenas da janela; com o s2cloudless, cada uma leva a sua probabilidade de nuvem (join)."""
+        windowed = collection.filterDate(start, end)
+        if self.cloud_mask_method != "s2cloudless":
+            return windowed
+        probability = ee.ImageCollection(CLOUD_PROBABILITY_ID).filterBounds(roi).filterDate(start, end)
+        return ee.ImageCollection(ee.Join.saveFirst("cloud_probability").apply(
+            primary=windowed,
+            secondary=probability,
+            condition=ee.Filter.equals(leftField="system:index", rightField="system:index"),
+        ))
+
+    def cloud_mask(self, image: ee.Image) -> ee.Image:
+        """Banda "cloud": 1 onde há nuvem, 0 onde o píxel está limpo."""
+        if self.cloud_mask_method == "s2cloudless":
+            probability = ee.Image(image.get("cloud_probability")).select("probability")
+            return probability.gt(self.cloud_probability).rename("cloud")
+        return image.select("QA60").bitwiseAnd(QA60_CLOUD_BITS).neq(0).rename("cloud")
+
+    def roi_fraction(self, image: ee.Image, roi: ee.Geometry) -> ee.ComputedObject:
+        """Média de uma banda 0/1 sobre a ROI, à resolução CLOUD_EVAL_SCALE."""
+        return image.reduceRegion(reducer=ee.Reducer.mean(), geometry=roi, scale=CLOUD_EVAL_SCALE,
+                                  maxPixels=1e9, bestEffort=True).values().get(0)
+
+    def scene_summary(self, collection: ee.ImageCollection, roi: ee.Geometry, start: str,
+                      end: str) -> ee.ComputedObject:
+        """
+        Expressão (server-side) com a cena da janela com menos nuvens sobre a própria ROI
+        (não sobre o tile inteiro, como o CLOUDY_PIXEL_PERCENTAGE), e a fração da ROI que
+        continuaria coberta num composite da janela (píxeis sem nenhuma observação limpa).
+        Píxeis sem dados (fora da cena) contam como nublados.
+        """
+        windowed = self.with_cloud_probability(collection, roi, start, end)
+        scored = windowed.map(
+            lambda image: image.set("roi_cloud", self.roi_fraction(self.cloud_mask(image).unmask(1), roi)))
+        best = ee.Image(scored.sort("roi_cloud").first())
+        # 1 onde pelo menos uma cena da janela tem o píxel limpo
+        clear_any = windowed.map(lambda image: self.cloud_mask(image).Not()).max().unmask(0)
+        return ee.Algorithms.If(
+            windowed.size().gt(0),
+            ee.Dictionary({
+                "id": best.get("system:index"),
+                "time": best.get("system:time_start"),
+                "cloud": best.get("CLOUDY_PIXEL_PERCENTAGE"),
+                "roi_cloud": best.get("roi_cloud"),
+                "composite_cloud": ee.Number(1).subtract(self.roi_fraction(clear_any, roi)),
+                "scenes": windowed.size(),
+                "start": start,
+                "end": end,
+            }),
+            None,
+        )
+
+    def resolve_scenes(self, collection: ee.ImageCollection, roi: ee.Geometry, cell: str,
+                       dates: List[datetime.datetime], window: int = 30, after=True,
+                       roi_key: str = "") -> List[Optional[dict]]:
+        """
+        Escolhe a cena de cada data com um único getInfo para todas as datas,
+        em vez de um size().getInfo() e um get("system:index").getInfo() por data.
+
+        Args:
+            roi_key: distingue ROIs com o mesmo centro (célula) e tamanhos diferentes no memo
+
+        Returns:
+            Para cada data, o resumo do scene_summary ou None se não houver imagens na janela
+        """
+        windows = [self.date_window(date, window, after) for date in dates]
+        settled_before = (datetime.datetime.now() - datetime.timedelta(days=_SCENE_MEMO_SETTLE_DAYS)).strftime('%Y-%m-%d')
+
+        scenes = {}
+        with _scene_memo_lock:
+            for start, end in windows:
+                key = (COLLECTION_ID, self.cloud_mask_id, cell, roi_key, start, end)
+                if key in _scene_memo:
+                    _scene_memo.move_to_end(key)
+                    scenes[(start, end)] = _scene_memo[key]
+
+        missing = [w for w in dict.fromkeys(windows) if w not in scenes]
+        if missing:
+            resolved = ee.List([self.scene_summary(collection, roi, start, end) for start, end in missing]).getInfo()
+            with _scene_memo_lock:
+                for (start, end), scene in zip(missing, resolved):
+                    scenes[(start, end)] = scene
+                    if end <= settled_before:
+                        _scene_memo[(COLLECTION_ID, self.cloud_mask_id, cell, roi_key, start, end)] = scene
+                        while len(_scene_memo) > _SCENE_MEMO_MAX:
+                            _scene_memo.popitem(last=False)
+
+        return [scenes[w] for w in windows]
 
     def create_quadrant_roi(self, lat: float, lon: float, scale: int, max_pixels: int = 100) -> List[ee.Geometry.Rectangle]:
         """
@@ -147,54 +400,299 @@ class EarthEngineImageFetcherTool(BaseTool):
             lat + half_side_deg
         ])
 
-    def process_quadrant_images(self, lat: float, lon: float, first_date: datetime.datetime, 
-                               second_date: datetime.datetime, scale: int, max_pixels: int = 256) -> Dict:
+    def select_scenes(self, regions: List[ee.Geometry], cell: str, first_date: datetime.datetime,
+                      second_date: datetime.datetime, roi_key: str = "", composite: Optional[str] = None) -> Dict:
         """
-        Processa os 4 quadrantes e retorna os resultados.
+        Escolhe as cenas das duas datas para as regiões dadas (um único getInfo).
+
+        Datas cuja melhor cena tem nuvens a mais sobre a ROI passam a um composite da janela
+        ou são rejeitadas aqui, antes de qualquer download (ver choose_scene_source).
         """
-        quadrants = self.create_quadrant_roi(lat, lon, scale, max_pixels)
-        quadrant_names = ["NE", "NO", "SO", "SE"]
-        
-        collection = self.get_image_collection(ee.Geometry.MultiPolygon(quadrants))
+        roi = ee.Geometry.MultiPolygon(regions)
+        collection = self.get_image_collection(roi)
 
         #dates_window = second_date - first_date
         
-        first_image = self.get_nearest_image(collection, first_date)
-        second_image = self.get_nearest_image(collection, second_date)
-        
-        if not first_image:
-            return {"error": f"No image found for start date: {first_date.date()}"}
-        
-        if not second_image:
-            return {"error": f"No image found for end date: {second_date.date()}"}
-            
-        print("First image ID:", first_image.get("system:index").getInfo())
-        print("Second image ID:", second_image.get("system:index").getInfo())
-        
+        first_scene, second_scene = self.resolve_scenes(collection, roi, cell, [first_date, second_date],
+                                                        roi_key=roi_key)
+
+        max_roi_cloud = float(os.getenv("GEOSYNC_MAX_ROI_CLOUD", DEFAULT_MAX_ROI_CLOUD))
+        composite = composite or os.getenv("GEOSYNC_COMPOSITE", DEFAULT_COMPOSITE).lower()
+        first_scene = choose_scene_source(first_scene, f"start date: {first_date.date()}", max_roi_cloud, composite)
+        if "error" in first_scene:
+            return first_scene
+
+        second_scene = choose_scene_source(second_scene, f"end date: {second_date.date()}", max_roi_cloud, composite)
+        if "error" in second_scene:
+            return second_scene
+
+        for label, scene in (("First", first_scene), ("Second", second_scene)):
+            source = f"composite {scene['start']}..{scene['end']}" if scene["composite"] else f"image ID {scene['id']}"
+            print(f"{label} {source} (ROI cloud {_fraction(scene['roi_cloud']):.0%})", file=sys.stderr)
+
+        return {"first_date": first_scene, "second_date": second_scene}
+
+    def scene_image(self, collection: ee.ImageCollection, roi: ee.Geometry, scene: Dict) -> Tuple[ee.Image, str]:
+        """Imagem a descarregar para uma cena escolhida, e o seu ID para a cache."""
+        if scene.get("composite"):
+            composite = self.cloud_masked_composite(collection, roi, scene["start"], scene["end"])
+            return composite.toUint16(), f"median:{self.cloud_mask_id}:{scene['start']}:{scene['end']}"
+        # Referência direta à cena pelo ID, sem nova ida ao servidor
+        return ee.Image(f"{COLLECTION_ID}/{scene['id']}"), scene["id"]
+
+    def download_regions(self, scenes: Dict, regions: List[Tuple[str, ee.Geometry, str]], cell: str, scale: int,
+                         bands: Optional[List[str]] = None, file_format: Optional[str] = None) -> Dict:
+        """
+        Descarrega cada região para as duas cenas. Os downloads correm em paralelo,
+        limitados pelo pool (ex: 4 quadrantes x 2 datas = 8 pedidos).
+        """
         results = {
             "first_date": {},
-            "second_date": {}
+            "second_date": {},
+            "scenes": scenes
         }
-        
-        # Process each quadrant for both dates
-        for i, (quadrant, name) in enumerate(zip(quadrants, quadrant_names)):
-            # First date
-            first_url = self.get_image_url(first_image, quadrant, scale)
-            first_filename = f"satellite_image_{lat}_{lon}_{first_date.strftime('%Y-%m-%d')}_{name}.zip"
-            first_result = self.download_image_if_not_exists(first_url, first_filename)
-            results["first_date"][name] = first_result
-            
-            # Second date
-            second_url = self.get_image_url(second_image, quadrant, scale)
-            second_filename = f"satellite_image_{lat}_{lon}_{second_date.strftime('%Y-%m-%d')}_{name}.zip"
-            second_result = self.download_image_if_not_exists(second_url, second_filename)
-            results["second_date"][name] = second_result
+
+        roi = ee.Geometry.MultiPolygon([region for _, region, _ in regions])
+        collection = self.get_image_collection(roi)
+        jobs = []
+        for date_key in ("first_date", "second_date"):
+            image, image_id = self.scene_image(collection, roi, scenes[date_key])
+            for name, region, region_name in regions:
+                jobs.append((date_key, name, image, image_id, region, region_name))
+
+        with ThreadPoolExecutor(max_workers=min(self.download_workers, len(jobs))) as executor:
+            futures = {
+                (date_key, name): executor.submit(
+                    self.download_to_cache, image, image_id, region, region_name, cell, scale, bands, file_format
+                )
+                for date_key, name, image, image_id, region, region_name in jobs
+            }
+            for (date_key, name), future in futures.items():
+                results[date_key][name] = future.result()
+
+        logging.info(f"TileCache stats: {self.tile_cache.stats()}")
         
         return results
 
-    def _run(self, lat: float, lon: float, first_date: str, second_date: str) -> str:
+    def process_quadrant_images(self, lat: float, lon: float, first_date: datetime.datetime, 
+                               second_date: datetime.datetime, scale: int, max_pixels: int = 256,
+                               snap_pixels: int = DEFAULT_SNAP_PIXELS) -> Dict:
         """
-        Process input data and fetch satellite images for 4 quadrants.
+        Processa os 4 quadrantes e retorna os resultados.
+
+        O centro é alinhado a uma grelha de `snap_pixels * scale` metros, para que moradas
+        próximas reutilizem os mesmos downloads da cache.
+        """
+        lat, lon, cell = snap_to_grid(lat, lon, scale * snap_pixels)
+        quadrants = self.create_quadrant_roi(lat, lon, scale, max_pixels)
+        quadrant_names = ["NE", "NO", "SO", "SE"]
+
+        scenes = self.select_scenes(quadrants, cell, first_date, second_date, roi_key=f"{2 * max_pixels}")
+        if "error" in scenes:
+            return scenes
+
+        regions = [(name, quadrant, f"{name}:{max_pixels}") for quadrant, name in zip(quadrants, quadrant_names)]
+        return self.download_regions(scenes, regions, cell, scale)
+
+    def tiles_per_side(self, pixels_per_side: int, n_bands: int, bytes_per_pixel: int = 2,
+                       limit_bytes: int = EE_DOWNLOAD_LIMIT_BYTES) -> int:
+        """Número de tiles por lado para que cada pedido fique abaixo do limite do Earth Engine."""
+        n = 1
+        while math.ceil(pixels_per_side / n) ** 2 * n_bands * bytes_per_pixel > limit_bytes:
+            n += 1
+        return n
+
+    def split_roi(self, lat: float, lon: float, scale: int, pixels_per_side: int, n: int) -> List[Tuple[str, ee.Geometry]]:
+        """Divide a ROI centrada em (lat, lon) numa grelha n x n de retângulos."""
+        half_side_deg = (scale * pixels_per_side / 2.0) / 111320.0
+        step = 2 * half_side_deg / n
+        west, north = lon - half_side_deg, lat + half_side_deg
+
+        tiles = []
+        for row in range(n):
+            for col in range(n):
+                name = "FULL" if n == 1 else f"R{row}C{col}"
+                tiles.append((name, ee.Geometry.Rectangle([
+                    west + col * step,
+                    north - (row + 1) * step,
+                    west + (col + 1) * step,
+                    north - row * step
+                ])))
+        return tiles
+
+    def process_geotiff_images(self, lat: float, lon: float, first_date: datetime.datetime,
+                               second_date: datetime.datetime, scale: int, max_pixels: int = 256,
+                               snap_pixels: int = DEFAULT_SNAP_PIXELS, bands: Optional[List[str]] = None) -> Dict:
+        """
+        Descarrega apenas as bandas necessárias como um único GeoTIFF multibanda por data,
+        cobrindo a mesma área que os 4 quadrantes. Só divide em tiles quando o pedido
+        excederia o limite de tamanho do Earth Engine.
+        """
+        bands = bands or DEFAULT_BANDS
+        lat, lon, cell = snap_to_grid(lat, lon, scale * snap_pixels)
+
+        # A área total é a dos 4 quadrantes: 2 * max_pixels por lado
+        pixels_per_side = 2 * max_pixels
+        n = self.tiles_per_side(pixels_per_side, len(bands))
+        tiles = self.split_roi(lat, lon, scale, pixels_per_side, n)
+
+        scenes = self.select_scenes([tile for _, tile in tiles], cell, first_date, second_date,
+                                    roi_key=f"{pixels_per_side}")
+        if "error" in scenes:
+            return scenes
+
+        regions = [(name, tile, f"{name}:{pixels_per_side}:{n}") for name, tile in tiles]
+        results = self.download_regions(scenes, regions, cell, scale, bands=bands, file_format="GEO_TIFF")
+        results["bands"] = bands
+        return results
+
+    def cloud_masked_composite(self, collection: ee.ImageCollection, roi: ee.Geometry, start: str,
+                               end: str) -> ee.Image:
+        """Mediana das cenas da janela, com as nuvens (ver cloud_mask) mascaradas em cada cena."""
+        windowed = self.with_cloud_probability(collection, roi, start, end)
+        return windowed.map(lambda image: image.updateMask(self.cloud_mask(image).Not())).median()
+
+    def plan_fetch(self, max_pixels: int, bands: List[str], indices: Optional[List[str]] = None,
+                   full_res_rgb: bool = False) -> FetchPlan:
+        """Modelo de custo local vs. server para a ROI (ver fetch_planner.plan_fetch)."""
+        pixels_per_side = 2 * max_pixels
+        return plan_fetch(
+            pixels_per_side,
+            bands,
+            local_tiles=self.tiles_per_side(pixels_per_side, len(bands)),
+            server_tiles=self.tiles_per_side(pixels_per_side, 1, bytes_per_pixel=4),
+            indices=indices,
+            full_res_rgb=full_res_rgb,
+        )
+
+    def process_server_images(self, lat: float, lon: float, first_date: datetime.datetime,
+                              second_date: datetime.datetime, scale: int, max_pixels: int = 256,
+                              snap_pixels: int = DEFAULT_SNAP_PIXELS, preview_factor: int = DEFAULT_PREVIEW_FACTOR) -> Dict:
+        """
+        Calcula a diferença NDVI no Earth Engine, entre composites das janelas das duas datas
+        (mediana das cenas com as nuvens mascaradas), e descarrega só:
+
+        - a diferença, uma banda float32 à resolução total (em tiles se exceder o limite);
+        - as bandas B2/B3/B4/B8 de cada composite, reduzidas preview_factor vezes, para as
+          pré-visualizações RGB/NIR/NDVI.
+
+        Cobre a mesma área do fetch_mode="geotiff"; píxeis sem dados ficam com DIFF_NODATA.
+        """
+        lat, lon, cell = snap_to_grid(lat, lon, scale * snap_pixels)
+        pixels_per_side = 2 * max_pixels
+        n = self.tiles_per_side(pixels_per_side, 1, bytes_per_pixel=4)
+        tiles = self.split_roi(lat, lon, scale, pixels_per_side, n)
+
+        # Rejeita, antes do cálculo, janelas em que nem o composite deixa a ROI utilizável
+        scenes = self.select_scenes([tile for _, tile in tiles], cell, first_date, second_date,
+                                    roi_key=f"{pixels_per_side}", composite="always")
+        if "error" in scenes:
+            return scenes
+
+        roi = self.create_safe_roi(lat, lon, scale, pixels_per_side)
+        collection = self.get_image_collection(roi)
+        windows = [self.date_window(date) for date in (first_date, second_date)]
+        composites = [self.cloud_masked_composite(collection, roi, start, end) for start, end in windows]
+        first_ndvi, second_ndvi = [composite.normalizedDifference(["B8", "B4"]) for composite in composites]
+        diff = second_ndvi.subtract(first_ndvi).rename("NDVI").unmask(DIFF_NODATA).toFloat()
+        diff_id = f"ndvidiff:{self.cloud_mask_id}:" + ":".join(start + ":" + end for start, end in windows)
+
+        # (tipo, nome) -> argumentos do download_to_cache
+        jobs = {
+            ("diff", name): (diff, diff_id, tile, f"{name}:{pixels_per_side}:{n}", scale, ["NDVI"])
+            for name, tile in tiles
+        }
+        for date_key, composite, (start, end) in zip(("first_date", "second_date"), composites, windows):
+            jobs[(date_key, "FULL")] = (composite.select(DEFAULT_BANDS).toUint16(),
+                                        f"median:{self.cloud_mask_id}:{start}:{end}", roi,
+                                        f"FULL:{pixels_per_side}:preview", scale * preview_factor, DEFAULT_BANDS)
+
+        results = {"first_date": {}, "second_date": {}, "diff": {}, "scenes": scenes, "bands": DEFAULT_BANDS}
+        with ThreadPoolExecutor(max_workers=min(self.download_workers, len(jobs))) as executor:
+            futures = {
+                key: executor.submit(self.download_to_cache, image, image_id, region, region_name, cell,
+                                     job_scale, job_bands, "GEO_TIFF")
+                for key, (image, image_id, region, region_name, job_scale, job_bands) in jobs.items()
+            }
+            for (kind, name), future in futures.items():
+                results[kind][name] = future.result()
+
+        logging.info(f"TileCache stats: {self.tile_cache.stats()}")
+        return results
+
+    def fetch_composites(self, lat: float, lon: float, windows: List[Tuple[str, str]], scale: int = DEFAULT_SCALE,
+                         max_pixels: int = 256, snap_pixels: int = DEFAULT_SNAP_PIXELS,
+                         bands: Optional[List[str]] = None,
+                         max_cloud: float = 60) -> Dict[str, Optional[str]]:
+        """
+        Um composite (mediana das cenas com menos de max_cloud % de nuvens, com as nuvens
+        mascaradas em cada cena) por janela, como GeoTIFF multibanda da mesma área do
+        fetch_mode="geotiff".
+
+        O número de cenas e a fração da ROI sem nenhuma observação limpa de todas as janelas
+        são pedidos num único getInfo; janelas sem cenas, ou com mais de GEOSYNC_MAX_ROI_CLOUD
+        da ROI coberta, ficam com None sem descarregar nada. Os composites vão para a
+        TileCache, indexados pela janela.
+
+        Returns:
+            início da janela -> caminho do GeoTIFF (ou None)
+        """
+        bands = bands or DEFAULT_BANDS
+        initialize_earth_engine()
+        lat, lon, cell = snap_to_grid(lat, lon, scale * snap_pixels)
+        pixels_per_side = 2 * max_pixels
+        if self.tiles_per_side(pixels_per_side, len(bands)) > 1:
+            raise ValueError(f"ROI de {pixels_per_side} px excede o limite de download de um composite")
+        region = self.create_safe_roi(lat, lon, scale, pixels_per_side)
+
+        collection = (self.get_image_collection(region)
+                      .filter(ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", max_cloud)))
+
+        def summary(start: str, end: str) -> ee.Dictionary:
+            windowed = self.with_cloud_probability(collection, region, start, end)
+            clear_any = windowed.map(lambda image: self.cloud_mask(image).Not()).max().unmask(0)
+            return ee.Dictionary({
+                "size": windowed.size(),
+                "cloud": ee.Algorithms.If(windowed.size().gt(0),
+                                          ee.Number(1).subtract(self.roi_fraction(clear_any, region)), None),
+            })
+
+        summaries = ee.List([summary(start, end) for start, end in windows]).getInfo()
+        max_roi_cloud = float(os.getenv("GEOSYNC_MAX_ROI_CLOUD", DEFAULT_MAX_ROI_CLOUD))
+
+        def download(start: str, end: str) -> str:
+            composite = self.cloud_masked_composite(collection, region, start, end).select(bands).toUint16()
+            return self.download_to_cache(composite, f"median:{self.cloud_mask_id}:{max_cloud:g}:{start}:{end}",
+                                          region, f"FULL:{pixels_per_side}:1", cell, scale, bands,
+                                          file_format="GEO_TIFF")
+
+        results: Dict[str, Optional[str]] = {start: None for start, _ in windows}
+        jobs = []
+        for (start, end), window_summary in zip(windows, summaries):
+            if not window_summary["size"]:
+                continue
+            if _fraction(window_summary["cloud"]) > max_roi_cloud:
+                print(f"[FETCH] composite {start}..{end} rejeitado: {_fraction(window_summary['cloud']):.0%} "
+                      f"da ROI sem observações limpas", file=sys.stderr)
+                continue
+            jobs.append((start, end))
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(self.download_workers, len(jobs))) as executor:
+                futures = {start: executor.submit(download, start, end) for start, end in jobs}
+                for start, future in futures.items():
+                    results[start] = future.result()
+        return results
+
+    def _run(self, lat: float, lon: float, first_date: str, second_date: str, fetch_mode: str = "quadrants",
+             indices: Optional[List[str]] = None, full_res_rgb: bool = False) -> str:
+        """
+        Process input data and fetch satellite images for 4 quadrants
+        (or as a single multi-band GeoTIFF per date with fetch_mode="geotiff").
+
+        fetch_mode="server" computes the NDVI difference on Earth Engine and downloads only that
+        band plus reduced previews; fetch_mode="auto" picks "geotiff" or "server" with the cost
+        model in fetch_planner. With full_res_rgb (building segmentation) "server" falls back to
+        "geotiff", since its reduced previews cannot be segmented.
         """
         print("[**DEBUG**] EarthEngineImageFetcherTool _run called!", file=sys.stderr)
         logging.debug("[**DEBUG**] EarthEngineImageFetcherTool _run called!")
@@ -208,18 +706,40 @@ class EarthEngineImageFetcherTool(BaseTool):
             return "Error: GOOGLE_APPLICATION_CREDENTIALS not found in environment variables"
 
         try:
-            ee.Initialize(project="ee-syncearth")
+            initialize_earth_engine()
             logging.debug("Autenticação GEE bem-sucedida via Conta de Serviço (env).")
         except Exception as e:
             return f"Failed to initialize Earth Engine: {str(e)}"
         
         try:
             # Define a resolução desejada
-            scale = 10  # metros por pixel
-            max_pixels = 256  # pixels por lado
+            scale = DEFAULT_SCALE  # metros por pixel
+            max_pixels = int(os.getenv("GEOSYNC_ROI_MAX_PIXELS", DEFAULT_MAX_PIXELS))  # pixels por lado
 
-            # Processa os 4 quadrantes
-            results = self.process_quadrant_images(lat, lon, start_date, end_date, scale, max_pixels)
+            # Só as bandas necessárias: as do RGB/NIR mais as dos índices pedidos (ex.: B11 para o NDBI)
+            bands = DEFAULT_BANDS + [band for band in required_bands(resolve_indices(indices))
+                                     if band not in DEFAULT_BANDS]
+            plan = None
+            if fetch_mode in ("auto", "server"):
+                plan = self.plan_fetch(max_pixels, bands, indices, full_res_rgb)
+                print(f"[FETCH] plano: {plan._asdict()}", file=sys.stderr)
+                if fetch_mode == "server" and len(bands) > len(DEFAULT_BANDS):
+                    return "Error: fetch_mode 'server' only computes NDVI; use 'geotiff' or 'auto' for other indices"
+                if fetch_mode == "server" and full_res_rgb:
+                    # O modo server só traz as bandas reduzidas: a segmentação precisa do RGB à resolução total
+                    print("[FETCH] RGB à resolução total pedido: modo 'server' trocado por 'geotiff'", file=sys.stderr)
+                    fetch_mode = "geotiff"
+                if fetch_mode == "auto":
+                    fetch_mode = "server" if plan.mode == "server" else "geotiff"
+
+            if fetch_mode == "server":
+                results = self.process_server_images(lat, lon, start_date, end_date, scale, max_pixels)
+            elif fetch_mode == "geotiff":
+                results = self.process_geotiff_images(lat, lon, start_date, end_date, scale, max_pixels,
+                                                      bands=bands)
+            else:
+                # Processa os 4 quadrantes
+                results = self.process_quadrant_images(lat, lon, start_date, end_date, scale, max_pixels)
             
             if "error" in results:
                 return results["error"]
@@ -230,9 +750,17 @@ class EarthEngineImageFetcherTool(BaseTool):
             print("[**DEBUG**] _run OUTPUTS:", results, file=sys.stderr)
             logging.debug(f"[**DEBUG**] _run OUTPUTS: {results}")
             
-            return json.dumps({
+            output = {
                 "first_date_images": results["first_date"],
-                "second_date_images": results["second_date"]
-            })
+                "second_date_images": results["second_date"],
+                "scenes": results["scenes"]
+            }
+            if "bands" in results:
+                output["bands"] = results["bands"]
+            if "diff" in results:
+                output["ndvi_diff_tiles"] = list(results["diff"].values())
+            if plan is not None:
+                output["fetch_plan"] = {**plan._asdict(), "fetch_mode": fetch_mode}
+            return json.dumps(output)
         except Exception as e:
             return f"Error processing quadrants: {str(e)}"
\ No newline at end of file
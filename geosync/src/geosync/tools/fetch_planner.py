@@ -0,0 +1,76 @@
+import math
+import os
+from typing import List, NamedTuple, Optional
+
+# Fator de redução das bandas descarregadas no modo "server", só usadas nas pré-visualizações
+DEFAULT_PREVIEW_FACTOR = 4
+
+# Parâmetros do modelo de custo (ajustáveis por variáveis de ambiente, ver plan_fetch)
+DEFAULT_BANDWIDTH_MBPS = 50.0
+# Latência de um pedido getDownloadURL até ao início da resposta
+DEFAULT_REQUEST_SECONDS = 3.0
+# Composites e diferença calculadas no Earth Engine, por megapíxel da ROI
+DEFAULT_SERVER_SECONDS_PER_MPX = 0.5
+# Índices calculados localmente por janelas, por megapíxel da ROI
+DEFAULT_LOCAL_SECONDS_PER_MPX = 0.05
+
+
+class FetchPlan(NamedTuple):
+    mode: str  # "local" ou "server"
+    reason: str
+    local_bytes: int
+    server_bytes: int
+    local_seconds: float
+    server_seconds: float
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def plan_fetch(pixels_per_side: int, bands: List[str], local_tiles: int = 1, server_tiles: int = 1,
+               indices: Optional[List[str]] = None, full_res_rgb: bool = False,
+               preview_factor: int = DEFAULT_PREVIEW_FACTOR) -> FetchPlan:
+    """
+    Escolhe entre descarregar as bandas e calcular o NDVI localmente ("local") ou calcular a
+    diferença no Earth Engine e descarregar só o resultado ("server").
+
+    O custo de cada modo é o tempo estimado de transferência (bytes / GEOSYNC_FETCH_BANDWIDTH_MBPS),
+    mais a latência de cada pedido (GEOSYNC_FETCH_REQUEST_SECONDS), mais o cálculo por megapíxel
+    no Earth Engine (GEOSYNC_EE_SECONDS_PER_MPX) ou local (GEOSYNC_LOCAL_SECONDS_PER_MPX).
+    Para ROIs pequenas domina a latência (ganha o local); para ROIs grandes domina a
+    transferência das bandas em bruto (ganha o server).
+
+    O modo "server" só calcula o NDVI e só traz as bandas reduzidas: outros índices, ou RGB à
+    resolução total (para a segmentação de construções), obrigam ao modo local.
+
+    Args:
+        pixels_per_side: lado da ROI em píxeis, à resolução total
+        bands: bandas que o modo local descarregaria (uint16, duas datas)
+        local_tiles, server_tiles: tiles por lado de cada modo, pelo limite de download do Earth Engine
+    """
+    pixels = pixels_per_side ** 2
+    preview_pixels = math.ceil(pixels_per_side / preview_factor) ** 2
+    local_bytes = 2 * pixels * len(bands) * 2
+    # Diferença float32 à resolução total + B2/B3/B4/B8 uint16 reduzidas, por data
+    server_bytes = pixels * 4 + 2 * preview_pixels * 4 * 2
+
+    bytes_per_second = _env_float("GEOSYNC_FETCH_BANDWIDTH_MBPS", DEFAULT_BANDWIDTH_MBPS) * 1e6 / 8
+    request_seconds = _env_float("GEOSYNC_FETCH_REQUEST_SECONDS", DEFAULT_REQUEST_SECONDS)
+    megapixels = pixels / 1e6
+    local_seconds = (local_bytes / bytes_per_second + 2 * local_tiles ** 2 * request_seconds
+                     + megapixels * _env_float("GEOSYNC_LOCAL_SECONDS_PER_MPX", DEFAULT_LOCAL_SECONDS_PER_MPX))
+    server_seconds = (server_bytes / bytes_per_second + (server_tiles ** 2 + 2) * request_seconds
+                      + megapixels * _env_float("GEOSYNC_EE_SECONDS_PER_MPX", DEFAULT_SERVER_SECONDS_PER_MPX))
+
+    extra = [name for name in indices or [] if name.upper() != "NDVI"]
+    if extra:
+        mode, reason = "local", f"índices além do NDVI: {', '.join(extra)}"
+    elif full_res_rgb:
+        mode, reason = "local", "RGB à resolução total para a segmentação"
+    elif server_seconds < local_seconds:
+        mode, reason = "server", "menor custo estimado"
+    else:
+        mode, reason = "local", "menor custo estimado"
+
+    return FetchPlan(mode, reason, local_bytes, server_bytes, round(local_seconds, 2), round(server_seconds, 2))
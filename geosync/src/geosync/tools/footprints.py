@@ -0,0 +1,299 @@
+import json
+import math
+import os
+import sys
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from rasterio import features, windows
+from rasterio.crs import CRS
+from rasterio.windows import Window
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+from geosync.tools.tiled_segmentation import iter_mask_strips, open_raster
+
+# Área mínima (em píxeis da máscara) de uma construção; regiões menores são ruído
+DEFAULT_MIN_PIXELS = 4
+
+# Tolerância da simplificação dos polígonos, em píxeis da máscara
+DEFAULT_SIMPLIFY_PIXELS = 1.0
+
+# IoU mínimo entre footprints das duas datas para serem a mesma construção
+DEFAULT_MATCH_IOU = 0.3
+
+# Linhas da máscara lidas e vetorizadas de cada vez
+DEFAULT_STRIP_ROWS = 1024
+
+DEFAULT_FORMATS = "parquet"
+
+# Aproximação: 1 grau de latitude ~ 111.32 km (a mesma usada para criar as ROIs)
+METERS_PER_DEGREE = 111320.0
+
+NEW, DEMOLISHED, UNCHANGED = "new", "demolished", "unchanged"
+
+
+class Footprints(NamedTuple):
+    """Polígonos das construções de uma máscara, nas coordenadas do seu CRS."""
+    polygons: List[shapely.Polygon]
+    crs: Optional[CRS]
+
+
+def polygonize(mask_path: str, min_pixels: Optional[int] = None,
+               simplify_pixels: Optional[float] = None, strip_rows: int = DEFAULT_STRIP_ROWS) -> Footprints:
+    """
+    Vetoriza uma máscara binária (1 = construção) com rasterio.features.shapes, faixa a faixa.
+
+    Cada faixa de strip_rows linhas é etiquetada com cv2.connectedComponents (conectividade 8)
+    e vetorizada à parte; as regiões que continuam na faixa seguinte são unidas (union-find)
+    pelas linhas de fronteira e os seus polígonos fundidos. Um polígono é emitido assim que a
+    sua região deixa de tocar a última linha lida, pelo que a memória fica limitada a uma faixa
+    e às construções que a atravessam, sem carregar a máscara inteira.
+
+    Os vértices saem nas coordenadas do CRS da máscara (pelo transform); os polígonos são
+    simplificados (GEOSYNC_FOOTPRINT_SIMPLIFY, em píxeis) e os menores que
+    GEOSYNC_FOOTPRINT_MIN_PIXELS descartados.
+    """
+    if min_pixels is None:
+        min_pixels = int(os.getenv("GEOSYNC_FOOTPRINT_MIN_PIXELS", DEFAULT_MIN_PIXELS))
+    if simplify_pixels is None:
+        simplify_pixels = float(os.getenv("GEOSYNC_FOOTPRINT_SIMPLIFY", DEFAULT_SIMPLIFY_PIXELS))
+
+    with open_raster(mask_path) as src:
+        transform, crs, width = src.transform, src.crs, src.width
+    pixel_area = abs(transform.a * transform.e - transform.b * transform.d)
+    tolerance = simplify_pixels * math.sqrt(pixel_area)
+
+    parent: List[int] = []
+
+    def find(label: int) -> int:
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    polygons: List[shapely.Polygon] = []
+
+    def emit(pieces: List[shapely.Polygon], pixels: int) -> None:
+        if pixels < min_pixels:
+            return
+        geometry = pieces[0] if len(pieces) == 1 else shapely.union_all(pieces)
+        # Regiões que só se tocam na diagonal através da fronteira ficam em partes separadas
+        for polygon in getattr(geometry, "geoms", [geometry]):
+            if tolerance > 0:
+                polygon = polygon.simplify(tolerance, preserve_topology=True)
+            if not polygon.is_empty:
+                polygons.append(polygon)
+
+    # Regiões ainda abertas (tocam a última linha lida): raiz -> (polígonos, píxeis)
+    pending: Dict[int, Tuple[List[shapely.Polygon], int]] = {}
+    previous_last_row: Optional[np.ndarray] = None
+    for row, strip in iter_mask_strips(mask_path, strip_rows):
+        n_labels, labels = cv2.connectedComponents((strip > 0).astype(np.uint8), connectivity=8)
+        offset = len(parent)
+        parent.extend(range(offset, offset + n_labels - 1))
+        # Etiquetas globais: -1 = fundo, as restantes a seguir às faixas anteriores
+        global_labels = np.where(labels > 0, labels - 1 + offset, -1)
+
+        if previous_last_row is not None:
+            for a, b in seam_pairs(previous_last_row, global_labels[0]):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+
+        strip_transform = windows.transform(Window(0, row, width, strip.shape[0]), transform)
+        pixels = np.bincount(labels.ravel(), minlength=n_labels)
+        # Polígonos e píxeis de cada região, pela raiz (as abertas podem ter sido unidas agora)
+        regions: Dict[int, Tuple[List[shapely.Polygon], int]] = {}
+
+        def add(label: int, pieces: List[shapely.Polygon], count: int) -> None:
+            merged, total = regions.get(find(label), ([], 0))
+            regions[find(label)] = (merged + pieces, total + count)
+
+        for label, (pieces, count) in pending.items():
+            add(label, pieces, count)
+        for geometry, value in features.shapes(labels.astype(np.int32), mask=labels > 0,
+                                               transform=strip_transform, connectivity=8):
+            add(int(value) - 1 + offset, [shape(geometry)], int(pixels[int(value)]))
+
+        open_roots = {find(label) for label in np.unique(global_labels[-1]) if label >= 0}
+        pending = {}
+        for root, (pieces, count) in regions.items():
+            if root in open_roots:
+                pending[root] = (pieces, count)
+            else:
+                emit(pieces, count)
+        previous_last_row = global_labels[-1]
+
+    for pieces, count in pending.values():
+        emit(pieces, count)
+    return Footprints(polygons, crs)
+
+
+def seam_pairs(above: np.ndarray, below: np.ndarray) -> set:
+    """Pares de etiquetas (linha de cima, linha de baixo) que se tocam com conectividade 8 (-1 = fundo)."""
+    pairs = set()
+    for shift in (-1, 0, 1):
+        shifted = np.roll(above, shift)
+        if shift == -1:
+            shifted[-1] = -1
+        elif shift == 1:
+            shifted[0] = -1
+        touching = (shifted >= 0) & (below >= 0)
+        pairs.update(zip(shifted[touching].tolist(), below[touching].tolist()))
+    return pairs
+
+
+def match_footprints(first: Sequence[shapely.Polygon], second: Sequence[shapely.Polygon],
+                     min_iou: Optional[float] = None) -> Tuple[List[str], List[str]]:
+    """
+    Classifica as construções das duas datas com um índice espacial (STRtree) sobre a primeira.
+
+    Uma construção da segunda data é "unchanged" se tiver uma da primeira com IoU >= min_iou
+    (GEOSYNC_FOOTPRINT_MATCH_IOU), senão "new"; as da primeira sem correspondência são
+    "demolished".
+
+    Returns:
+        (estado de cada footprint da primeira data, estado de cada footprint da segunda)
+    """
+    if min_iou is None:
+        min_iou = float(os.getenv("GEOSYNC_FOOTPRINT_MATCH_IOU", DEFAULT_MATCH_IOU))
+    first_status = [DEMOLISHED] * len(first)
+    second_status = [NEW] * len(second)
+    if not first or not second:
+        return first_status, second_status
+
+    tree = STRtree(first)
+    pairs = tree.query(second, predicate="intersects")
+    if pairs.size:
+        second_index, first_index = pairs
+        a = np.asarray(second)[second_index]
+        b = np.asarray(first)[first_index]
+        intersection = shapely.area(shapely.intersection(a, b))
+        iou = intersection / (shapely.area(a) + shapely.area(b) - intersection)
+        for i, j in zip(second_index[iou >= min_iou], first_index[iou >= min_iou]):
+            second_status[i] = UNCHANGED
+            first_status[j] = UNCHANGED
+    return first_status, second_status
+
+
+def areas_m2(polygons: Sequence[shapely.Polygon], crs: Optional[CRS]) -> np.ndarray:
+    """Área em m² (em CRS geográficos, aproximada pela latitude do centroide)."""
+    areas = shapely.area(np.asarray(polygons, dtype=object)) if polygons else np.zeros(0)
+    if crs is not None and crs.is_geographic and len(polygons):
+        latitudes = shapely.get_y(shapely.centroid(np.asarray(polygons, dtype=object)))
+        areas = areas * METERS_PER_DEGREE ** 2 * np.cos(np.radians(latitudes))
+    return np.asarray(areas, dtype=np.float64)
+
+
+def geoparquet_metadata(polygons: Sequence[shapely.Polygon], crs: Optional[CRS]) -> Dict:
+    """
+    Metadados "geo" da especificação GeoParquet 1.0 (coluna geometry em WKB).
+
+    Sem CRS (ex. máscaras PNG, em píxeis) o "crs" é escrito como null: a especificação lê a
+    chave ausente como OGC:CRS84, o que rotularia coordenadas de píxel como lon/lat.
+    """
+    column = {"encoding": "WKB", "geometry_types": ["Polygon"],
+              "crs": crs.to_dict(projjson=True) if crs is not None else None}
+    if polygons:
+        column["bbox"] = list(shapely.total_bounds(np.asarray(polygons, dtype=object)))
+    return {"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": column}}
+
+
+def write_geoparquet(path: str, polygons: Sequence[shapely.Polygon], crs: Optional[CRS],
+                     columns: Dict[str, Sequence]) -> str:
+    """GeoParquet escrito diretamente com o pyarrow (geometria em WKB + metadados "geo")."""
+    table = pa.table({
+        **{name: pa.array(values) for name, values in columns.items()},
+        "geometry": pa.array(shapely.to_wkb(np.asarray(polygons, dtype=object)) if polygons else [], pa.binary()),
+    })
+    metadata = {**(table.schema.metadata or {}), b"geo": json.dumps(geoparquet_metadata(polygons, crs)).encode()}
+    pq.write_table(table.replace_schema_metadata(metadata), path, compression="zstd")
+    return path
+
+
+def fiona_available() -> bool:
+    try:
+        import fiona  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_flatgeobuf(path: str, polygons: Sequence[shapely.Polygon], crs: Optional[CRS],
+                     columns: Dict[str, Sequence]) -> str:
+    """FlatGeobuf (com índice espacial) pelo fiona, que é opcional."""
+    import fiona
+
+    types = {str: "str", float: "float", int: "int"}
+    schema = {
+        "geometry": "Polygon",
+        "properties": {name: types[type(values[0])] if len(values) else "str" for name, values in columns.items()},
+    }
+    with fiona.open(path, "w", driver="FlatGeobuf", schema=schema,
+                    crs_wkt=crs.to_wkt() if crs is not None else None) as dst:
+        dst.writerecords(
+            {"geometry": shapely.geometry.mapping(polygon),
+             "properties": {name: values[i] for name, values in columns.items()}}
+            for i, polygon in enumerate(polygons)
+        )
+    return path
+
+
+WRITERS = {"parquet": write_geoparquet, "fgb": write_flatgeobuf}
+
+
+def output_formats(formats: Optional[str] = None) -> List[str]:
+    """
+    Formatos pedidos (GEOSYNC_FOOTPRINT_FORMATS, ex. "parquet,fgb"); o FlatGeobuf só é
+    escrito se o fiona estiver instalado.
+    """
+    names = [name.strip().lower() for name in (formats or os.getenv("GEOSYNC_FOOTPRINT_FORMATS", DEFAULT_FORMATS)).split(",")]
+    unknown = [name for name in names if name not in WRITERS]
+    if unknown:
+        raise ValueError(f"Formato de footprints desconhecido: {', '.join(unknown)}. Opções: {', '.join(WRITERS)}")
+    if "fgb" in names and not fiona_available():
+        print("[FOOTPRINTS] fiona não instalado, FlatGeobuf ignorado", file=sys.stderr)
+        names.remove("fgb")
+    return names
+
+
+class FootprintComparison(NamedTuple):
+    """Footprints das duas datas (primeiro os da data 1) com a data, o estado e a área de cada um."""
+    polygons: List[shapely.Polygon]
+    crs: Optional[CRS]
+    columns: Dict[str, List]
+    counts: Dict[str, int]
+
+    def write(self, path: str, fmt: str) -> str:
+        return WRITERS[fmt](path, self.polygons, self.crs, self.columns)
+
+
+def compare_masks(first_mask: str, second_mask: str) -> FootprintComparison:
+    """
+    Vetoriza as máscaras das duas datas e classifica as construções em novas, demolidas e
+    inalteradas. Todos os footprints vão para uma única tabela (colunas `date` e `status`).
+    """
+    first, second = polygonize(first_mask), polygonize(second_mask)
+    crs = second.crs or first.crs
+    first_status, second_status = match_footprints(first.polygons, second.polygons)
+
+    polygons = first.polygons + second.polygons
+    columns = {
+        "date": ["first"] * len(first.polygons) + ["second"] * len(second.polygons),
+        "status": first_status + second_status,
+        "area_m2": areas_m2(polygons, crs).tolist(),
+    }
+    counts = {
+        "first": len(first.polygons),
+        "second": len(second.polygons),
+        NEW: second_status.count(NEW),
+        DEMOLISHED: first_status.count(DEMOLISHED),
+        UNCHANGED: second_status.count(UNCHANGED),
+    }
+    print(f"[FOOTPRINTS] {counts}", file=sys.stderr)
+    return FootprintComparison(polygons, crs, columns, counts)
@@ -0,0 +1,117 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join("raw_images", "geocode.sqlite")
+
+# As coordenadas de uma morada praticamente não mudam; "não encontrada" expira mais cedo,
+# porque o Geoapify pode vir a conhecê-la
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_NEGATIVE_TTL_SECONDS = 24 * 3600
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_address(address: str) -> str:
+    """
+    Chave da cache de uma morada: sem maiúsculas, acentos, pontuação nem espaços repetidos.
+
+    "Praça do Giraldo, Évora" e "praca do  giraldo evora" dão a mesma chave.
+    """
+    text = unicodedata.normalize("NFKD", address.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class GeocodeCache:
+    """
+    Cache SQLite das respostas do geocoder, indexada pela morada normalizada.
+
+    Guarda coordenadas e também moradas não encontradas (cache negativa, com TTL próprio).
+    Erros da API (chave inválida, 5xx, timeouts) nunca são guardados.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 negative_ttl: Optional[float] = None):
+        self.path = Path(path or os.getenv("GEOSYNC_GEOCODE_CACHE_PATH", DEFAULT_CACHE_PATH))
+        self.ttl = ttl if ttl is not None else float(os.getenv("GEOSYNC_GEOCODE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(
+            os.getenv("GEOSYNC_GEOCODE_NEGATIVE_TTL_SECONDS", DEFAULT_NEGATIVE_TTL_SECONDS)
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS geocodes (
+                    key TEXT PRIMARY KEY,
+                    address TEXT NOT NULL,
+                    result TEXT,
+                    created REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _incr(self, conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get(self, address: str) -> Optional[Dict]:
+        """
+        Resultado em cache: {"lat", "lon"}, {"error": "Address not found."} (cache negativa)
+        ou None (miss ou entrada expirada).
+        """
+        key = normalize_address(address)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT result, created FROM geocodes WHERE key = ?", (key,)).fetchone()
+            if row:
+                result, created = row
+                ttl = self.ttl if result is not None else self.negative_ttl
+                if time.time() - created <= ttl:
+                    self._incr(conn, "hits" if result is not None else "negative_hits")
+                    return json.loads(result) if result is not None else {"error": "Address not found."}
+                conn.execute("DELETE FROM geocodes WHERE key = ?", (key,))
+            self._incr(conn, "misses")
+            return None
+
+    def put(self, address: str, result: Optional[Dict]) -> None:
+        """Guarda as coordenadas de uma morada; result=None regista-a como não encontrada."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocodes (key, address, result, created) VALUES (?, ?, ?, ?)",
+                (normalize_address(address), address, json.dumps(result) if result is not None else None, time.time()),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock, self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, negative = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(result IS NULL), 0) FROM geocodes"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "negative_hits": counters.get("negative_hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+            "negative_entries": negative,
+        }
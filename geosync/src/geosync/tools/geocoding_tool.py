@@ -1,8 +1,24 @@
 import requests
-from pydantic import BaseModel
-from typing import Type
+from pydantic import BaseModel, PrivateAttr
+from typing import Dict, List, Optional, Sequence, Type
 from crewai.tools import BaseTool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import os
+import time
+
+from geosync.tools.geocode_cache import GeocodeCache, normalize_address
+
+SEARCH_URL = "https://api.geoapify.com/v1/geocode/search"
+BATCH_URL = "https://api.geoapify.com/v1/batch/geocode/search"
+
+# (ligação, leitura) em segundos
+REQUEST_TIMEOUT = (5, 20)
+
+# Os pedidos batch são assíncronos: o resultado é consultado até estar pronto
+BATCH_POLL_INTERVAL = 2.0
+BATCH_MAX_WAIT = 300.0
 
 class GeocodeInput(BaseModel):
     address: str
@@ -12,38 +28,132 @@ class GeoapifyTool(BaseTool):
     description: str = "Converts a physical address into latitude and longitude coordinates using the Geoapify API."
     args_schema: Type[BaseModel] = GeocodeInput
 
+    _cache: Optional[GeocodeCache] = PrivateAttr(default=None)
+    _session: Optional[requests.Session] = PrivateAttr(default=None)
+
+    @property
+    def cache(self) -> GeocodeCache:
+        if self._cache is None:
+            self._cache = GeocodeCache()
+        return self._cache
+
+    @property
+    def session(self) -> requests.Session:
+        """Sessão HTTP reutilizada entre pedidos, com retry e backoff em 429/5xx (só GET)."""
+        if self._session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+                respect_retry_after_header=True,
+            )
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry))
+            self._session = session
+        return self._session
+
+    @staticmethod
+    def _coordinates(result: dict) -> Optional[Dict[str, float]]:
+        if result.get("lat") is None or result.get("lon") is None:
+            return None
+        return {"lat": result["lat"], "lon": result["lon"]}
+
     def _run(self, address: str) -> str:
-        import os
         api_key = os.environ.get("GEOAPIFY_KEY")
-        
+
         if not api_key:
             return json.dumps({"error": "Geoapify API key not found."})
-        
-        url = "https://api.geoapify.com/v1/geocode/search"
+
+        cached = self.cache.get(address)
+        if cached is not None:
+            return json.dumps(cached) if "error" in cached else cached
+
         params = {
             "text": address,
             "apiKey": api_key,
             "format": "json"
         }
-        
-        response = requests.get(url, params=params)
-        
+
+        try:
+            response = self.session.get(SEARCH_URL, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            return json.dumps({"error": "Geoapify API error."})
+
         if response.status_code != 200:
             return json.dumps({"error": "Geoapify API error."})
-        
+
         data = response.json()
-        
-        # Verifica se há resultados em vez de features
-        if not data.get("results") or len(data["results"]) == 0:
+
+        # Verifica se há resultados em vez de features; extrai as coordenadas do primeiro
+        coordinates = self._coordinates(data["results"][0]) if data.get("results") else None
+        self.cache.put(address, coordinates)
+        if coordinates is None:
+            # Sem resultados, ou o primeiro sem lat/lon: a mesma resposta que um hit negativo
             return json.dumps({"error": "Address not found."})
-        
-        # Extrai as coordenadas do primeiro resultado
-        first_result = data["results"][0]
-        lat = first_result["lat"]
-        lon = first_result["lon"]
-        formatted = first_result["formatted"]
-
-        return {
-            "lat": lat,
-            "lon": lon
-        }
\ No newline at end of file
+        return coordinates
+
+    def geocode_batch(self, addresses: Sequence[str], poll_interval: float = BATCH_POLL_INTERVAL,
+                      max_wait: float = BATCH_MAX_WAIT) -> Dict[str, dict]:
+        """
+        Geocodifica várias moradas: as que estão em cache não saem daqui e as restantes
+        (sem repetições, pela morada normalizada) seguem num único pedido ao endpoint batch
+        do Geoapify.
+
+        Returns:
+            morada -> {"lat", "lon"} ou {"error": ...}, para todas as moradas pedidas
+        """
+        api_key = os.environ.get("GEOAPIFY_KEY")
+        if not api_key:
+            return {address: {"error": "Geoapify API key not found."} for address in addresses}
+
+        results: Dict[str, dict] = {}
+        pending: Dict[str, str] = {}  # morada normalizada -> morada enviada
+        for address in addresses:
+            cached = self.cache.get(address)
+            if cached is not None:
+                results[address] = cached
+            else:
+                pending.setdefault(normalize_address(address), address)
+
+        resolved: Dict[str, dict] = {}
+        if pending:
+            queries = list(pending.values())
+            try:
+                batch_results = self._run_batch(queries, api_key, poll_interval, max_wait)
+            except (requests.RequestException, RuntimeError, TimeoutError) as e:
+                batch_results = None
+                error = f"Geoapify API error: {e}"
+
+            for i, query in enumerate(queries):
+                if batch_results is None:
+                    resolved[normalize_address(query)] = {"error": error}
+                    continue
+                coordinates = self._coordinates(batch_results[i]) if i < len(batch_results) else None
+                self.cache.put(query, coordinates)
+                resolved[normalize_address(query)] = coordinates or {"error": "Address not found."}
+
+        for address in addresses:
+            if address not in results:
+                results[address] = resolved[normalize_address(address)]
+        return results
+
+    def _run_batch(self, queries: List[str], api_key: str, poll_interval: float, max_wait: float) -> List[dict]:
+        """Cria o trabalho batch e espera pelo resultado (um objeto por morada, pela mesma ordem)."""
+        params = {"apiKey": api_key, "format": "json"}
+        response = self.session.post(BATCH_URL, params=params, json=queries, timeout=REQUEST_TIMEOUT)
+        if response.status_code not in (200, 202):
+            raise RuntimeError(f"batch request failed with status {response.status_code}")
+        job = response.json()
+        if response.status_code == 200 and isinstance(job, list):
+            return job
+
+        deadline = time.monotonic() + max_wait
+        while time.monotonic() < deadline:
+            time.sleep(poll_interval)
+            response = self.session.get(BATCH_URL, params={**params, "id": job["id"]}, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code != 202:
+                raise RuntimeError(f"batch job {job['id']} failed with status {response.status_code}")
+        raise TimeoutError(f"batch job {job['id']} not ready after {max_wait:.0f}s")
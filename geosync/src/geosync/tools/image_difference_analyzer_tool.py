@@ -1,51 +1,47 @@
+import math
 import os
 import numpy as np
 import rasterio
-import matplotlib.pyplot as plt
 import zipfile
-import shutil
-import json
-from rasterio.merge import merge
 
 from pydantic import BaseModel
-from typing import Type, Dict, List, Union, Optional, Tuple
+from typing import Type, Dict, List, Optional, Tuple
 from crewai.tools import BaseTool
 from pathlib import Path
 
+from geosync.jobs import JobWorkspace
+from geosync.tools.earthengine_tool import DEFAULT_BANDS
+from geosync.tools.index_engine import (DEFAULT_BLOCK_SIZE, DIFF_SCALE, WindowedIndexEngine, build_mosaic_vrt,
+                                        iter_windows, read_preview)
+from geosync.tools.raster_stats import describe
+from geosync.tools.scratch_rasters import ScratchRasters
+from geosync.tools import renderer, tiling
+
+QUADRANTS = {"NE", "NO", "SO", "SE"}
+
+# Bandas, por ordem, dos GeoTIFF RGB (rgb_antiga.tif / rgb_recente.tif)
+RGB_BANDS = ["B4", "B3", "B2"]
+
+# Lado máximo (píxeis) das pré-visualizações PNG geradas a partir dos rasters NDVI
+DEFAULT_PREVIEW_MAX_PX = 2048
+
+# Formato das pré-visualizações (png ou webp)
+DEFAULT_PREVIEW_FORMAT = "png"
+
 class ImageDiffInput(BaseModel):
     first_date_images: Dict[str, str]
     second_date_images: Dict[str, str]
+    bands: Optional[List[str]] = None
+    job_dir: Optional[str] = None
+    indices: Optional[List[str]] = None
+    # Modo "server" do fetcher: tiles da diferença NDVI já calculada no Earth Engine
+    ndvi_diff_tiles: Optional[List[str]] = None
 
 class ImageDifferenceAnalyzerTool(BaseTool):
     name: str = "Satellite Image Difference Analyzer"
     description: str = "Compares two satellite images (multiple quadrants) and produces a visual difference raster."
     args_schema: Type[BaseModel] = ImageDiffInput
 
-    def extract_tifs_if_zip(self, path: str, prefix: str = "") -> List[str]:
-        """Extrai ficheiros .tif se o input for um ficheiro .zip. 
-        Caso contrário, devolve o próprio caminho se for um .tif."""
-        if zipfile.is_zipfile(path):
-            extracted_paths = []
-            # Add prefix to avoid overwriting files from different dates
-            output_dir = Path("temp_extracted") / f"{prefix}_{Path(path).stem}"
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            with zipfile.ZipFile(path, 'r') as zip_ref:
-                zip_ref.extractall(output_dir)
-
-            for file in output_dir.glob("*.tif"):
-                extracted_paths.append(str(file.resolve()))
-
-            if not extracted_paths:
-                raise ValueError(f"Nenhum ficheiro .tif encontrado no zip: {path}")
-
-            return extracted_paths
-        else:
-            if path.lower().endswith(".tif"):
-                return [path]
-            else:
-                raise ValueError(f"Formato não suportado: {path}")
-
     def find_band(self, paths: List[str], band_id: str) -> str:
         for path in paths:
             name = Path(path).name.lower()
@@ -59,297 +55,347 @@ class ImageDifferenceAnalyzerTool(BaseTool):
                 return path
         raise ValueError(f"Banda B{band_id} não encontrada.")
 
-    def cleanup_temp_extracted(self):
-        temp_dir = Path("temp_extracted")
-        if temp_dir.exists() and temp_dir.is_dir():
-            shutil.rmtree(temp_dir)
+    def band_path_in_zip(self, path: str, band_id: str) -> str:
+        """Caminho GDAL (/vsizip/) da banda dentro do zip, lida sem extrair para disco.
+        Se o input já for um .tif, devolve o próprio caminho."""
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path, 'r') as zip_ref:
+                members = [name for name in zip_ref.namelist() if name.lower().endswith(".tif")]
+            if not members:
+                raise ValueError(f"Nenhum ficheiro .tif encontrado no zip: {path}")
+            return f"/vsizip/{os.path.abspath(path)}/{self.find_band(members, band_id)}"
+        if path.lower().endswith(".tif"):
+            return self.find_band([path], band_id)
+        raise ValueError(f"Formato não suportado: {path}")
 
-    def merge_rasters(self, raster_paths: List[str], output_path: str) -> str:
-        """Combina múltiplos rasters em um único arquivo"""
-        if len(raster_paths) == 0:
-            raise ValueError("Nenhum raster para mesclar")
-        
-        if len(raster_paths) == 1:
-            # Usar shutil.copyfile em vez de shutil.copy para copiar apenas o conteúdo
-            shutil.copyfile(raster_paths[0], output_path)
-            return output_path
-        
-        src_files_to_mosaic = []
-        for raster_path in raster_paths:
-            try:
-                src = rasterio.open(raster_path)
-                src_files_to_mosaic.append(src)
-            except Exception as e:
-                print(f"Erro ao abrir raster {raster_path}: {str(e)}")
-        
-        if not src_files_to_mosaic:
-            raise ValueError("Nenhum raster pôde ser aberto para mesclagem")
-        
-        try:
-            mosaic, out_trans = merge(src_files_to_mosaic)
-            
-            out_meta = src_files_to_mosaic[0].meta.copy()
-            out_meta.update({
-                "height": mosaic.shape[1],
-                "width": mosaic.shape[2],
-                "transform": out_trans,
-                "driver": "GTiff"
-            })
-            
-            # Escreve o raster unificado para o disco
-            with rasterio.open(output_path, "w", **out_meta) as dest:
-                dest.write(mosaic)
-            
-            print(f"Mescla concluída: {output_path}, shape: {mosaic.shape}, paths usados: {raster_paths}")
-            
-        except Exception as e:
-            print(f"Erro durante a mesclagem: {str(e)}")
-            raise
-        finally:
-            for src in src_files_to_mosaic:
-                src.close()
-            
-        return output_path
+    def is_quadrant_input(self, images: Dict[str, str]) -> bool:
+        return set(images.keys()) == QUADRANTS
 
-    def extract_and_merge_bands(self, quadrant_paths: Dict[str, str], band_id: str, date_prefix: str) -> str:
-        """Extrai e une uma banda específica de múltiplos quadrantes"""
-        band_paths = []
-        
-        # Cria diretório temporário com prefixo para evitar conflitos
-        temp_dir = Path(f"temp_merged_{date_prefix}")
-        temp_dir.mkdir(exist_ok=True)
-        
-        # Para cada quadrante, extrair os TIFFs e encontrar a banda
-        for quadrant_name, zip_path in quadrant_paths.items():
+    def is_multiband_input(self, images: Dict[str, str]) -> bool:
+        return bool(images) and all(path.lower().endswith(".tif") for path in images.values())
+
+    def band_index(self, path: str, band: str, bands: Optional[List[str]] = None) -> int:
+        """
+        Índice (1-based) de uma banda num GeoTIFF multibanda, pela descrição ou pela ordem pedida
+        (por omissão a do fetcher, DEFAULT_BANDS).
+        """
+        with rasterio.open(path) as src:
+            if band in src.descriptions:
+                return src.descriptions.index(band) + 1
+        return (bands or DEFAULT_BANDS).index(band) + 1
+
+    def band_sources(self, images: Dict[str, str], band: str, bands: Optional[List[str]] = None) -> List[Tuple[str, int]]:
+        """
+        Devolve as fontes (caminho, índice da banda) a mosaicar para uma banda.
+
+        - Quadrantes (zips): a banda de cada quadrante, lida diretamente do zip.
+        - GeoTIFF multibanda: a mesma banda em cada tile (normalmente um único ficheiro).
+        """
+        if not self.is_quadrant_input(images):
+            index = self.band_index(next(iter(images.values())), band, bands)
+            return [(path, index) for path in images.values()]
+
+        band_id = band[1:]
+        sources = []
+        for quadrant_name, zip_path in images.items():
             try:
-                # Usar o prefixo da data para evitar conflitos entre datas diferentes
-                tifs = self.extract_tifs_if_zip(zip_path, prefix=f"{date_prefix}_{quadrant_name}")
-                band_path = self.find_band(tifs, band_id)
-                band_paths.append(band_path)
-                print(f"Banda {band_id} encontrada no quadrante {quadrant_name} para {date_prefix}: {band_path}")
+                sources.append((self.band_path_in_zip(zip_path, band_id), 1))
             except Exception as e:
                 print(f"Erro ao processar quadrante {quadrant_name} para banda {band_id}: {str(e)}")
-        
-        if not band_paths:
+
+        if not sources:
             raise ValueError(f"Nenhuma banda {band_id} encontrada em qualquer quadrante")
-        
-        # Unir as bandas extraídas com prefixo único para cada data
-        output_path = f"{temp_dir}/merged_band_{band_id}.tif"
-        self.merge_rasters(band_paths, output_path)
-        
-        return output_path
+        return sources
 
-    def read_normalized(self, path: str) -> np.ndarray:
-        """Carrega uma banda e normaliza seus valores para o intervalo [0,1]"""
-        with rasterio.open(path) as src:
-            arr = src.read(1).astype(np.float32)
-            print(f"[DEBUG] {path}: min={arr.min()}, max={arr.max()}, mean={arr.mean()}")
-            
-            if arr.max() == arr.min():
-                print(f"AVISO: Dados constantes na banda {path}: valor={arr.min()}")
-                return arr * 0  # Retorna uma matriz de zeros do mesmo tamanho
-                
-            # Normalização
-            valid_mask = ~np.isnan(arr) & ~np.isinf(arr)
-            if np.sum(valid_mask) > 0:
-                min_val = np.percentile(arr[valid_mask], 2)  # Ignora outliers inferiores
-                max_val = np.percentile(arr[valid_mask], 98) # Ignora outliers superiores
-                
-                # Evitar a divisão por zero
-                range_val = max_val - min_val
-                if range_val < 1e-6:
-                    range_val = 1
-                
-                # Normalização
-                norm_arr = np.clip((arr - min_val) / range_val, 0, 1)
-                
-                print(f"Normalização: min={min_val}, max={max_val}, range={range_val}")
-                print(f"Valores normalizados: min={norm_arr.min()}, max={norm_arr.max()}")
-                
-                return norm_arr
-            else:
-                print(f"AVISO: Nenhum valor válido na banda {path}")
-                return arr * 0
-
-    def calculate_ndvi(self, red_band_path: str, nir_band_path: str) -> Tuple[np.ndarray, dict]:
-        """Calcula NDVI: (NIR - RED) / (NIR + RED)"""
-        try:
-            with rasterio.open(nir_band_path) as nir_src, rasterio.open(red_band_path) as red_src:
-                nir_band = nir_src.read(1).astype(np.float32)
-                red_band = red_src.read(1).astype(np.float32)
-                
-                # Substituir valores não válidos
-                nir_band[np.isnan(nir_band) | np.isinf(nir_band)] = 0
-                red_band[np.isnan(red_band) | np.isinf(red_band)] = 0
-                
-                # Evitar divisão por zero
-                denominator = nir_band + red_band
-                valid_mask = denominator > 1e-6
-                
-                # Inicializar o NDVI com zeros
-                ndvi = np.zeros_like(nir_band)
-                
-                # Calcular NDVI apenas onde o denominador é válido
-                ndvi[valid_mask] = (nir_band[valid_mask] - red_band[valid_mask]) / denominator[valid_mask]
-                
-                # NDVI está no intervalo [-1, 1], normalizar para [0, 1]
-                ndvi_normalized = (ndvi + 1) / 2
-                
-                print(f"NDVI calculado: min={ndvi.min()}, max={ndvi.max()}")
-                print(f"NDVI normalizado: min={ndvi_normalized.min()}, max={ndvi_normalized.max()}")
-
-                meta = red_src.meta.copy()
-                meta.update(count=1, dtype='float32')
-
-                return ndvi_normalized, meta
-        except Exception as e:
-            print(f"Erro no cálculo do NDVI: {str(e)}")
-            raise
-
-    def save_raster_with_colormap(self, data: np.ndarray, output_path: str, cmap_name: str = 'RdYlGn', vmin: float = 0, vmax: float = 1):
-        """Salva um raster como imagem PNG com um mapa de cores específico e limites definidos"""
-        plt.figure(figsize=(10, 10))
-        plt.imshow(data, cmap=cmap_name, vmin=vmin, vmax=vmax)
-        plt.colorbar(label='Valor')
-        plt.title(f'Visualização: {Path(output_path).stem}')
-        plt.axis('off')
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        print(f"Imagem salva: {output_path}")
-
-    def analyze_difference(self, first_date_images: Dict[str, str], second_date_images: Dict[str, str]) -> Dict:
-        """Analisa as diferenças entre imagens de satélite de duas datas, com múltiplos quadrantes"""
+    def stretch_limits(self, band: np.ndarray, name: str = "") -> Optional[Tuple[float, float]]:
+        """Limites (mínimo, amplitude) do estiramento de uma banda: percentis 2 e 98; None se não houver dados."""
+        # Mínimo, máximo, média e percentis 2/98 numa só passagem (histograma, sem ordenar o raster)
+        stats = describe(band, percentiles=(2, 98))
+        print(f"[DEBUG] {name}: min={stats['min']}, max={stats['max']}, mean={stats['mean']}")
+
+        if not stats["count"]:
+            print(f"AVISO: Nenhum valor válido na banda {name}")
+            return None
+
+        if stats["max"] == stats["min"]:
+            print(f"AVISO: Dados constantes na banda {name}: valor={stats['min']}")
+            return None
+
+        min_val = stats["p2"]  # Ignora outliers inferiores
+        max_val = stats["p98"]  # Ignora outliers superiores
+
+        # Evitar a divisão por zero
+        range_val = max_val - min_val
+        if range_val < 1e-6:
+            range_val = 1
+
+        print(f"Normalização: min={min_val}, max={max_val}, range={range_val}")
+        return min_val, range_val
+
+    def apply_stretch(self, band: np.ndarray, limits: Optional[Tuple[float, float]]) -> np.ndarray:
+        """Estira uma banda para [0, 1] com os limites de stretch_limits (zeros se forem None)."""
+        if limits is None:
+            return np.zeros(band.shape, dtype=np.float32)
+        min_val, range_val = limits
+        # Normalização, feita no próprio array float32
+        norm_arr = band.astype(np.float32)
+        norm_arr -= min_val
+        norm_arr /= range_val
+        np.clip(norm_arr, 0, 1, out=norm_arr)
+        return norm_arr
+
+    def normalize(self, band: np.ndarray, name: str = "") -> np.ndarray:
+        """Normaliza os valores de uma banda para o intervalo [0,1]"""
+        return self.apply_stretch(band, self.stretch_limits(band, name))
+
+    def band_raster(self, images: Dict[str, str], band: str, date_prefix: str, tmp_dir: Path,
+                    bands: Optional[List[str]] = None) -> str:
+        """Raster (ficheiro ou mosaico VRT) de uma banda, para leitura por janelas."""
+        sources = self.band_sources(images, band, bands)
+        return build_mosaic_vrt(sources, str(tmp_dir / f"{date_prefix}_{band}.vrt"))
+
+    def rgb_preview(self, path: str, max_size: int, name: str) -> Tuple[np.ndarray, List]:
+        """
+        RGB uint8 reduzido (no máximo max_size píxeis de lado) de um GeoTIFF B4/B3/B2, e os
+        limites do estiramento de cada banda, calculados sobre a própria pré-visualização.
+        """
+        channels, limits = [], []
+        for i, band in enumerate(RGB_BANDS, start=1):
+            preview = read_preview(path, max_size, band=i)
+            band_limits = self.stretch_limits(preview, f"{name} {band}")
+            channels.append(self.apply_stretch(preview, band_limits))
+            limits.append(band_limits)
+        return renderer.to_uint8(np.stack(channels, axis=-1)), limits
+
+    def write_stretched_rgb(self, src_path: str, limits: List, path: str) -> str:
+        """
+        Guarda, por janelas, o RGB uint8 esticado à resolução total de um GeoTIFF B4/B3/B2
+        (com os limites das pré-visualizações), para gerar os tiles.
+        """
+        with rasterio.open(src_path) as src:
+            profile = src.profile.copy()
+            profile.update(driver="GTiff", count=3, dtype="uint8", nodata=None, compress="deflate",
+                           predictor=1, tiled=True, blockxsize=256, blockysize=256, photometric="RGB")
+            with rasterio.open(path, "w", **profile) as dst:
+                for window in iter_windows(src.width, src.height, DEFAULT_BLOCK_SIZE):
+                    block = src.read(window=window)
+                    rgb = np.stack([self.apply_stretch(band, band_limits)
+                                    for band, band_limits in zip(block, limits)], axis=-1)
+                    dst.write(np.moveaxis(renderer.to_uint8(rgb), -1, 0), window=window)
+        return path
+
+    def build_tiles(self, workspace: JobWorkspace, layers: Dict[str, Tuple[str, List[int], tiling.Colorizer]],
+                    extension: str) -> Dict:
+        """
+        Gera uma pirâmide XYZ por camada em output/tiles/<camada>/{z}/{x}/{y}.<extension>,
+        servida pela API em /tiles/<job_id>/<camada>/{z}/{x}/{y}.<extension>.
+        """
+        def build(name: str, src_path: str, indexes: List[int], colorize: tiling.Colorizer) -> Dict:
+            with workspace.artifact(f"tiles/{name}") as tmp_dir:
+                return tiling.build_tiles(src_path, tmp_dir, colorize, indexes, extension)
+
+        print(f"Gerando tiles de {len(layers)} camadas...")
+        metadata = renderer.render_parallel(
+            [lambda name=name, spec=spec: build(name, *spec) for name, spec in layers.items()]
+        )
+        return {
+            "url": f"/tiles/{workspace.job_id}/{{layer}}/{{z}}/{{x}}/{{y}}.{extension}",
+            "layers": dict(zip(layers, metadata)),
+        }
+
+    def analyze_difference(self, first_date_images: Dict[str, str], second_date_images: Dict[str, str],
+                           bands: Optional[List[str]] = None, job_dir: Optional[str] = None,
+                           indices: Optional[List[str]] = None,
+                           ndvi_diff_tiles: Optional[List[str]] = None) -> Dict:
+        """Analisa as diferenças entre imagens de satélite de duas datas, com múltiplos quadrantes
+        ou com um GeoTIFF multibanda (eventualmente dividido em tiles) por data.
+
+        Além do NDVI, calcula os índices pedidos em `indices` (NDBI, NDWI, MNDWI, EVI, SAVI),
+        todos numa única passagem pelas bandas, e guarda as diferenças num único GeoTIFF
+        multibanda (index_diff.tif, uma banda por índice).
+
+        Com ndvi_diff_tiles (modo "server" do fetcher) a diferença NDVI vem já calculada à
+        resolução total e as imagens de cada data são bandas reduzidas, usadas apenas nas
+        pré-visualizações.
+
+        Todos os ficheiros são escritos no diretório do pedido (job_dir, ou um novo
+        jobs/<job_id>/), para que análises em paralelo não interfiram entre si."""
         print("Processando imagens de múltiplos quadrantes...")
 
-        expected_quadrants = {"NE", "NO", "SO", "SE"}
-        if set(first_date_images.keys()) != expected_quadrants or set(second_date_images.keys()) != expected_quadrants:
-            raise ValueError("Input inválido: Esperado dicionário com as chaves NE, NO, SO, SE para cada data.")
+        for images in (first_date_images, second_date_images):
+            if not (self.is_quadrant_input(images) or self.is_multiband_input(images)):
+                raise ValueError(
+                    "Input inválido: Esperado dicionário com as chaves NE, NO, SO, SE para cada data, "
+                    "ou com GeoTIFFs multibanda."
+                )
 
         for key, value in first_date_images.items():
             print("Element in firstdateimages key: ", key, ", value: ", value)
         for key, value in second_date_images.items():
             print("Element in seconddateimages key: ", key, ", value: ", value)
         
+        workspace = JobWorkspace.from_dir(job_dir) if job_dir else JobWorkspace()
+        print(f"Diretório do pedido: {workspace.path}")
+        scratch = ScratchRasters(str(workspace.tmp_dir))
+
         try:
-            os.makedirs("output", exist_ok=True)
-            
-            # Criar diretórios temporários separados para cada data
-            os.makedirs("temp_merged_first", exist_ok=True)
-            os.makedirs("temp_merged_second", exist_ok=True)
-            
-            # Extrair e mesclar as bandas para cada data com prefixos diferentes
-            print("Extraindo e mesclando bandas da primeira data...")
-            bands_1 = {
-                "B2": self.extract_and_merge_bands(first_date_images, "2", "first"),  # Azul
-                "B3": self.extract_and_merge_bands(first_date_images, "3", "first"),  # Verde
-                "B4": self.extract_and_merge_bands(first_date_images, "4", "first"),  # Vermelho
-                "B8": self.extract_and_merge_bands(first_date_images, "8", "first"),  # Infravermelho próximo
-            }
+            # Índices, diferenças e cópias das bandas em bruto numa só passagem por janelas:
+            # cada banda de cada data (B2 azul, B3 verde, B4 vermelho, B8 infravermelho próximo
+            # e as dos índices) é lida uma única vez dos zips/GeoTIFFs, sem carregar os rasters
+            # inteiros; o index_diff.tif é escrito em streaming como COG (banda 1 = NDVI)
+            engine = WindowedIndexEngine(indices)
+            print(f"Calculando índices {', '.join(engine.names)}...")
+            raster_bands = list(dict.fromkeys([*engine.bands, *DEFAULT_BANDS]))
+            first_rasters = {band: self.band_raster(first_date_images, band, "first", workspace.tmp_dir, bands)
+                             for band in raster_bands}
+            second_rasters = {band: self.band_raster(second_date_images, band, "second", workspace.tmp_dir, bands)
+                              for band in raster_bands}
+            # Rasters intermédios (só lidos de volta reduzidos): em memória dentro do orçamento
+            with rasterio.open(first_rasters["B8"]) as src:
+                shape, band_dtype = (src.height, src.width), src.dtypes[0]
+            indices_shape = (len(engine.names),) + shape
+            indices_old_tif = scratch.path("indices_antiga.tif", indices_shape, "float32")
+            indices_recent_tif = scratch.path("indices_recente.tif", indices_shape, "float32")
+            nir_old_tif = scratch.path("nir_antiga.tif", shape, band_dtype)
+            nir_recent_tif = scratch.path("nir_recente.tif", shape, band_dtype)
+            with workspace.artifact("index_diff.tif") as tmp_path, \
+                    workspace.artifact("rgb_antiga.tif") as rgb_old_tif, \
+                    workspace.artifact("rgb_recente.tif") as rgb_recent_tif:
+                index_stats = engine.compute(
+                    first_rasters,
+                    second_rasters,
+                    scratch.path("preview_diff.tif", indices_shape, "float32") if ndvi_diff_tiles else tmp_path,
+                    str(workspace.tmp_dir),
+                    first_index_path=indices_old_tif,
+                    second_index_path=indices_recent_tif,
+                    stacks=[
+                        # Bandas RGB em bruto e georreferenciadas, para a segmentação de construções
+                        ("first", rgb_old_tif, RGB_BANDS),
+                        ("second", rgb_recent_tif, RGB_BANDS),
+                        ("first", nir_old_tif, ["B8"]),
+                        ("second", nir_recent_tif, ["B8"]),
+                    ],
+                )
+                if ndvi_diff_tiles:
+                    # A diferença à resolução total substitui a das bandas reduzidas
+                    diff_vrt = build_mosaic_vrt([(path, 1) for path in ndvi_diff_tiles],
+                                                str(workspace.tmp_dir / "server_diff.vrt"))
+                    index_stats = engine.import_diff(diff_vrt, tmp_path, str(workspace.tmp_dir))
 
-            print("Extraindo e mesclando bandas da segunda data...")
-            bands_2 = {
-                "B2": self.extract_and_merge_bands(second_date_images, "2", "second"),
-                "B3": self.extract_and_merge_bands(second_date_images, "3", "second"),
-                "B4": self.extract_and_merge_bands(second_date_images, "4", "second"),
-                "B8": self.extract_and_merge_bands(second_date_images, "8", "second"),
-            }
+            # Pré-visualizações RGB e NIR, lidas reduzidas dos GeoTIFFs escritos acima
+            preview_max = int(os.getenv("GEOSYNC_PREVIEW_MAX_PX", DEFAULT_PREVIEW_MAX_PX))
+            print("Criando imagens RGB e NIR...")
+            rgb1, rgb_limits_1 = self.rgb_preview(workspace.output_path("rgb_antiga.tif"), preview_max, "first")
+            rgb2, rgb_limits_2 = self.rgb_preview(workspace.output_path("rgb_recente.tif"), preview_max, "second")
+            nir_old = self.normalize(read_preview(nir_old_tif, preview_max), "first B8")
+            nir_recent = self.normalize(read_preview(nir_recent_tif, preview_max), "second B8")
 
-            print("Criando imagens RGB...")
-            # Criar imagem RGB antiga (image 1)
-            rgb1 = np.stack([
-                self.read_normalized(bands_1["B4"]),
-                self.read_normalized(bands_1["B3"]),
-                self.read_normalized(bands_1["B2"])
-            ], axis=-1)
-            plt.imsave("output/rgb_antiga.png", rgb1)
-
-            # Criar imagem RGB recente (image 2)
-            rgb2 = np.stack([
-                self.read_normalized(bands_2["B4"]),
-                self.read_normalized(bands_2["B3"]),
-                self.read_normalized(bands_2["B2"])
-            ], axis=-1)
-            plt.imsave("output/rgb_recente.png", rgb2)
-
-            # Criar imagem NIR antiga
-            print("Criando imagens NIR...")
-            nir_old = self.read_normalized(bands_1["B8"])
-            plt.imsave("output/nir_antiga.png", nir_old, cmap="gray")
-
-            # Criar imagem NIR recente
-            nir_recent = self.read_normalized(bands_2["B8"])
-            plt.imsave("output/nir_recente.png", nir_recent, cmap="gray")
-
-            # Calcular NDVI
-            print("Calculando NDVI...")
-            ndvi_old, meta_old = self.calculate_ndvi(bands_1["B4"], bands_1["B8"])
-            ndvi_recent, meta_recent = self.calculate_ndvi(bands_2["B4"], bands_2["B8"])
+            # NDVI (-1 a 1) de cada data, reduzido para as pré-visualizações
+            ndvi_old = read_preview(indices_old_tif, preview_max)
+            ndvi_recent = read_preview(indices_recent_tif, preview_max)
             
-            # Salvar imagens NDVI individuais
-            self.save_raster_with_colormap(ndvi_old, "output/ndvi_antiga.png", cmap_name="RdYlGn")
-            self.save_raster_with_colormap(ndvi_recent, "output/ndvi_recente.png", cmap_name="RdYlGn")
+            # Pré-visualização da diferença NDVI, lida das overviews do COG
+            ndvi_diff = read_preview(workspace.output_path("index_diff.tif"), preview_max)
 
-            # Calcular a diferença
-            print("Calculando diferença NDVI...")
-            ndvi_diff = ndvi_recent - ndvi_old
+            # Verificar se existe variação significativa (estatísticas da resolução total)
+            for name, stats in index_stats.items():
+                print(f"Diferença {name}: min={stats['min']}, max={stats['max']}, std={stats['std']}")
+            diff_std = index_stats["NDVI"]["std"]
 
-            # Verificar se existe variação significativa
-            diff_std = np.std(ndvi_diff)
-            print(f"Diferença NDVI: min={ndvi_diff.min()}, max={ndvi_diff.max()}, std={diff_std}")
-
-            # Usar percentis para definir os limites com base nos dados reais
-            p_low, p_high = np.percentile(ndvi_diff[~np.isnan(ndvi_diff)], [5, 95])
-            # Garantir simetria em torno de zero para o mapa de cores
+            # Usar percentis para definir os limites com base nos dados reais (calculados em
+            # streaming sobre a resolução total, não sobre a pré-visualização)
+            p_low, p_high = index_stats["NDVI"]["p5"], index_stats["NDVI"]["p95"]
+            # Garantir simetria em torno de zero para o mapa de cores; sem píxeis válidos (ROI toda
+            # mascarada) os percentis são NaN e fica só o mínimo de contraste
             limit = max(abs(p_low), abs(p_high))
-            limit = max(limit, 0.05)  # Garantir um mínimo de contraste
-
-            # Guardar o resultado com limites adaptados aos dados
-            self.save_raster_with_colormap(
-                ndvi_diff, 
-                "output/ndvi_diff.png", 
-                cmap_name="RdBu_r",  # Mapa de cores alternativo com bom contraste
-                vmin=-limit,
-                vmax=limit
-            )
+            if not math.isfinite(limit):
+                limit = 0.1
+            # Mínimo de contraste: o dobro do antigo 0.05, que era na escala do NDVI reescalado a [0, 1]
+            limit = max(limit, 0.1)
+
+            # Imagens a gerar: nome -> (raster, mapa de cores, vmin, vmax); as RGB já vêm em uint8
+            extension = os.getenv("GEOSYNC_PREVIEW_FORMAT", DEFAULT_PREVIEW_FORMAT).lower().lstrip(".")
+            images = {
+                "rgb_antiga": (rgb1, None, None, None),
+                "rgb_recente": (rgb2, None, None, None),
+                "nir_antiga": (nir_old, "gray", 0, 1),
+                "nir_recente": (nir_recent, "gray", 0, 1),
+                "ndvi_antiga": (ndvi_old, "RdYlGn", -1, 1),
+                "ndvi_recente": (ndvi_recent, "RdYlGn", -1, 1),
+                # Limites adaptados aos dados, com um mapa de cores divergente com bom contraste
+                "ndvi_diff": (ndvi_diff, "RdBu_r", -limit, limit),
+            }
 
             # Se a diferença for muito pequena, amplificar o sinal para melhor visualização
-            if diff_std < 0.01:
+            # (limiar na escala do NDVI, -1 a 1: o dobro do antigo 0.01 na escala [0, 1])
+            if diff_std < 0.02:
                 print("AVISO: Diferença muito pequena entre as imagens NDVI!")
                 print("Amplificando diferenças pequenas para melhor visualização")
-                
+
                 # Amplificar diferenças por um fator (ex: 5x)
                 amplification_factor = 5.0
-                ndvi_diff_enhanced = ndvi_diff * amplification_factor
-                
-                self.save_raster_with_colormap(
-                    ndvi_diff_enhanced, 
-                    "output/ndvi_diff_enhanced.png", 
-                    cmap_name="RdBu_r",
-                    vmin=-limit * amplification_factor,
-                    vmax=limit * amplification_factor
-                )
-                
-                result_dict = {
-                    "image_path_1": "output/rgb_antiga.png",
-                    "image_path_2": "output/rgb_recente.png",
-                    "ndvi_antiga": "output/ndvi_antiga.png",
-                    "ndvi_recente": "output/ndvi_recente.png",
-                    "ndvi_diff": "output/ndvi_diff.png",
-                    "ndvi_diff_enhanced": "output/ndvi_diff_enhanced.png"
-                }
-            else:
-                result_dict = {
-                    "image_path_1": "output/rgb_antiga.png",
-                    "image_path_2": "output/rgb_recente.png",
-                    "ndvi_antiga": "output/ndvi_antiga.png",
-                    "ndvi_recente": "output/ndvi_recente.png",
-                    "ndvi_diff": "output/ndvi_diff.png"
-                }
-            
-            # Guardar o resultado da diferença ndvi como tif
-            print("Salvando NDVI como TIF...")
-            with rasterio.open("output/ndvi_diff.tif", "w", **meta_old) as dst:
-                dst.write(ndvi_diff.astype(rasterio.float32), 1)
+                images["ndvi_diff_enhanced"] = (ndvi_diff * amplification_factor, "RdBu_r",
+                                                -limit * amplification_factor, limit * amplification_factor)
+
+            def render(name: str, data: np.ndarray, cmap: Optional[str], vmin, vmax) -> None:
+                with workspace.artifact(f"{name}.{extension}") as tmp_path:
+                    if cmap is None:
+                        renderer.save_image(data, tmp_path)
+                    else:
+                        renderer.render_raster(data, tmp_path, cmap=cmap, vmin=vmin, vmax=vmax)
+
+            def render_legend(name: str, cmap: str, vmin, vmax) -> None:
+                with workspace.artifact(f"{name}_legend.png") as tmp_path:
+                    renderer.render_legend(tmp_path, cmap, vmin, vmax, label=name)
+
+            # Legendas opcionais, em ficheiros separados das imagens
+            legends = {}
+            if os.getenv("GEOSYNC_PREVIEW_LEGENDS", "0") == "1":
+                legends = {name: spec for name, spec in images.items() if spec[1] in ("RdYlGn", "RdBu_r")}
+
+            print(f"Gerando {len(images)} imagens...")
+            renderer.render_parallel(
+                [lambda name=name, spec=spec: render(name, *spec) for name, spec in images.items()] +
+                [lambda name=name, spec=spec: render_legend(name, *spec[1:]) for name, spec in legends.items()]
+            )
+
+            # Pirâmides de tiles XYZ opcionais, para o frontend carregar só os tiles visíveis
+            tiles = None
+            if os.getenv("GEOSYNC_TILES", "0") == "1":
+                tiles = self.build_tiles(workspace, {
+                    "rgb_antiga": (self.write_stretched_rgb(workspace.output_path("rgb_antiga.tif"), rgb_limits_1,
+                                                            str(workspace.tmp_dir / "rgb_antiga_preview.tif")),
+                                   [1, 2, 3], tiling.rgb_colorizer),
+                    "rgb_recente": (self.write_stretched_rgb(workspace.output_path("rgb_recente.tif"), rgb_limits_2,
+                                                             str(workspace.tmp_dir / "rgb_recente_preview.tif")),
+                                    [1, 2, 3], tiling.rgb_colorizer),
+                    "ndvi_antiga": (indices_old_tif, [1], tiling.colormap_colorizer("RdYlGn", -1, 1)),
+                    "ndvi_recente": (indices_recent_tif, [1], tiling.colormap_colorizer("RdYlGn", -1, 1)),
+                    "ndvi_diff": (workspace.output_path("index_diff.tif"), [1],
+                                  tiling.colormap_colorizer("RdBu_r", -limit, limit)),
+                }, extension)
+
+            result_dict = {
+                "image_path_1": workspace.output_path(f"rgb_antiga.{extension}"),
+                "image_path_2": workspace.output_path(f"rgb_recente.{extension}"),
+                "rgb_tif_1": workspace.output_path("rgb_antiga.tif"),
+                "rgb_tif_2": workspace.output_path("rgb_recente.tif"),
+                "ndvi_antiga": workspace.output_path(f"ndvi_antiga.{extension}"),
+                "ndvi_recente": workspace.output_path(f"ndvi_recente.{extension}"),
+                "ndvi_diff": workspace.output_path(f"ndvi_diff.{extension}"),
+                "index_diff_tif": workspace.output_path("index_diff.tif"),
+                "indices": engine.names,
+                "index_stats": index_stats,
+                # Diferenças na escala natural dos índices (ver index_engine.DIFF_SCALE)
+                "index_diff_scale": DIFF_SCALE,
+                "job_dir": str(workspace.path)
+            }
+            if "ndvi_diff_enhanced" in images:
+                result_dict["ndvi_diff_enhanced"] = workspace.output_path(f"ndvi_diff_enhanced.{extension}")
+            if tiles:
+                result_dict["tiles"] = tiles
+            if legends:
+                result_dict["legends"] = {name: workspace.output_path(f"{name}_legend.png") for name in legends}
             
             return result_dict
             
@@ -359,12 +405,12 @@ class ImageDifferenceAnalyzerTool(BaseTool):
             traceback.print_exc()
             raise Exception(f"Erro ao analisar diferenças entre as imagens: {str(e)}")
         finally:
-            self.cleanup_temp_extracted()
-            # Limpar diretórios temporários
-            for temp_dir in ["temp_merged_first", "temp_merged_second"]:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
+            scratch.close()
+            workspace.cleanup_tmp()
 
-    def _run(self, first_date_images: Dict[str, str], second_date_images: Dict[str, str]) -> str:
+    def _run(self, first_date_images: Dict[str, str], second_date_images: Dict[str, str],
+             bands: Optional[List[str]] = None, job_dir: Optional[str] = None,
+             indices: Optional[List[str]] = None, ndvi_diff_tiles: Optional[List[str]] = None) -> str:
         """Executa a análise de diferença entre imagens de múltiplos quadrantes"""
-        return self.analyze_difference(first_date_images, second_date_images)
\ No newline at end of file
+        return self.analyze_difference(first_date_images, second_date_images, bands, job_dir, indices,
+                                       ndvi_diff_tiles)
\ No newline at end of file
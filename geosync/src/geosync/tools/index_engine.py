@@ -0,0 +1,345 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from geosync.tools.raster_stats import DEFAULT_PERCENTILES, RasterStats
+from geosync.tools.spectral_indices import IndexSet, resolve_indices
+
+DEFAULT_BLOCK_SIZE = 512
+
+# Valor dos píxeis sem dados numa diferença calculada fora (ex.: no Earth Engine, ver import_diff)
+DIFF_NODATA = -9999.0
+
+# Escala das diferenças no index_diff.tif (tag DIFF_SCALE): "raw" = diferença dos índices na
+# sua escala natural (NDVI em [-1, 1], diferença em [-2, 2]). Até à versão com o motor por
+# janelas, o ndvi_diff.tif guardava a diferença do NDVI reescalado para [0, 1], isto é,
+# metade destes valores; o intervalo de cada banda vai na tag DIFF_RANGE
+DIFF_SCALE = "raw"
+
+GDAL_TYPES = {
+    "uint8": "Byte",
+    "int8": "Int8",
+    "uint16": "UInt16",
+    "int16": "Int16",
+    "uint32": "UInt32",
+    "int32": "Int32",
+    "float32": "Float32",
+    "float64": "Float64",
+}
+
+# Fonte de uma banda: (caminho GDAL, índice 1-based da banda)
+BandSource = Tuple[str, int]
+
+# Bandas em bruto copiadas para um GeoTIFF na mesma passagem: (data "first"/"second", caminho, bandas)
+BandStack = Tuple[str, str, Sequence[str]]
+
+
+def iter_windows(width: int, height: int, block_size: int) -> Iterator[Window]:
+    """Percorre a grelha em janelas de block_size x block_size (as das bordas são menores)."""
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def build_mosaic_vrt(sources: Sequence[BandSource], vrt_path: str) -> str:
+    """
+    Escreve um VRT que mosaica as fontes de uma banda sem as carregar em memória.
+
+    Com uma única fonte devolve o próprio caminho. Em zonas sobrepostas prevalece a
+    primeira fonte, como no rasterio.merge usado anteriormente.
+    """
+    if len(sources) == 1 and sources[0][1] == 1:
+        return sources[0][0]
+
+    infos = []
+    for path, index in sources:
+        with rasterio.open(path) as src:
+            infos.append((path, index, src.transform, src.width, src.height, src.crs,
+                          src.dtypes[index - 1], src.nodatavals[index - 1]))
+
+    ref_transform, ref_crs = infos[0][2], infos[0][5]
+    res_x, res_y = ref_transform.a, -ref_transform.e
+    left = min(t.c for _, _, t, _, _, _, _, _ in infos)
+    top = max(t.f for _, _, t, _, _, _, _, _ in infos)
+    right = max(t.c + w * t.a for _, _, t, w, _, _, _, _ in infos)
+    bottom = min(t.f + h * t.e for _, _, t, _, h, _, _, _ in infos)
+    width = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+
+    dtype, nodata = infos[0][6], infos[0][7]
+    sources_xml = []
+    # O VRT desenha as fontes por ordem, logo a primeira tem de ficar em último
+    for path, index, transform, w, h, _, _, _ in reversed(infos):
+        x_off = int(round((transform.c - left) / res_x))
+        y_off = int(round((top - transform.f) / res_y))
+        sources_xml.append(
+            "    <SimpleSource>\n"
+            f'      <SourceFilename relativeToVRT="0">{escape(path)}</SourceFilename>\n'
+            f"      <SourceBand>{index}</SourceBand>\n"
+            f'      <SrcRect xOff="0" yOff="0" xSize="{w}" ySize="{h}"/>\n'
+            f'      <DstRect xOff="{x_off}" yOff="{y_off}" xSize="{w}" ySize="{h}"/>\n'
+            "    </SimpleSource>\n"
+        )
+
+    nodata_xml = f"    <NoDataValue>{nodata}</NoDataValue>\n" if nodata is not None else ""
+    srs_xml = f"  <SRS>{escape(ref_crs.to_wkt())}</SRS>\n" if ref_crs else ""
+    with open(vrt_path, "w") as f:
+        f.write(
+            f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">\n'
+            f"{srs_xml}"
+            f"  <GeoTransform>{left!r}, {res_x!r}, 0.0, {top!r}, 0.0, {-res_y!r}</GeoTransform>\n"
+            f'  <VRTRasterBand dataType="{GDAL_TYPES.get(dtype, "Float32")}" band="1">\n'
+            f"{nodata_xml}"
+            f"{''.join(sources_xml)}"
+            "  </VRTRasterBand>\n"
+            "</VRTDataset>\n"
+        )
+    return vrt_path
+
+
+# Estado de cada processo do modo process-pool: datasets abertos por (data, banda) e os
+# índices compilados, reutilizados entre janelas
+_worker_datasets: Dict[Tuple[str, str], rasterio.io.DatasetReader] = {}
+_worker_index_set: Optional[IndexSet] = None
+_worker_bands: Sequence[str] = ()
+
+
+def _open_datasets(first: Dict[str, str], second: Dict[str, str]) -> Dict[Tuple[str, str], rasterio.io.DatasetReader]:
+    datasets = {}
+    for date, rasters in (("first", first), ("second", second)):
+        for band, path in rasters.items():
+            datasets[(date, band)] = rasterio.open(path)
+    return datasets
+
+
+def _init_worker(first: Dict[str, str], second: Dict[str, str], formulas: Sequence[Tuple[str, str]],
+                 bands: Sequence[str]) -> None:
+    global _worker_datasets, _worker_index_set, _worker_bands
+    _worker_datasets = _open_datasets(first, second)
+    _worker_index_set = IndexSet.from_formulas(formulas)
+    _worker_bands = bands
+
+
+WindowResult = Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Dict[str, np.ndarray]]]
+
+
+def _compute_window(datasets: Dict[Tuple[str, str], rasterio.io.DatasetReader], index_set: IndexSet,
+                    bands: Sequence[str], window: Window) -> WindowResult:
+    """
+    Lê cada banda de cada data uma única vez e calcula todos os índices do bloco; devolve
+    também os blocos em bruto (por data e banda), para as cópias das bandas (BandStack).
+    """
+    raw = {date: {band: datasets[(date, band)].read(1, window=window) for band in bands}
+           for date in ("first", "second")}
+    first = index_set.evaluate(raw["first"])
+    second = index_set.evaluate(raw["second"])
+    return first, second, second - first, raw
+
+
+def _worker_window(window: Window) -> Tuple[Window, np.ndarray, np.ndarray, np.ndarray, Dict]:
+    return (window, *_compute_window(_worker_datasets, _worker_index_set, _worker_bands, window))
+
+
+class WindowedIndexEngine:
+    """
+    Calcula índices espectrais (NDVI, NDBI, EVI, ...) das duas datas e a sua diferença
+    bloco a bloco, com memória limitada.
+
+    As bandas são lidas por janelas rasterio (block_size x block_size) a partir de
+    mosaicos VRT; em cada janela cada banda é lida uma única vez e partilhada por todos
+    os índices. A diferença é escrita incrementalmente num único GeoTIFF multibanda (uma
+    banda por índice, com o nome na descrição), convertido num COG tiled e comprimido
+    (DEFLATE) com overviews. Com workers > 0 as janelas são distribuídas por um pool de
+    processos (GEOSYNC_NDVI_WORKERS).
+    """
+
+    def __init__(self, indices: Optional[Sequence[str]] = None, block_size: Optional[int] = None,
+                 workers: Optional[int] = None):
+        self.index_set = IndexSet(resolve_indices(indices))
+        self.block_size = block_size or int(os.getenv("GEOSYNC_NDVI_BLOCK_SIZE", DEFAULT_BLOCK_SIZE))
+        self.workers = workers if workers is not None else int(os.getenv("GEOSYNC_NDVI_WORKERS", 0))
+
+    @property
+    def bands(self) -> List[str]:
+        return self.index_set.bands
+
+    @property
+    def names(self) -> List[str]:
+        return self.index_set.names
+
+    def _windows(self, first: Dict[str, str], second: Dict[str, str], bands: Sequence[str], width: int,
+                 height: int) -> Iterator[Tuple[Window, np.ndarray, np.ndarray, np.ndarray, Dict]]:
+        windows = list(iter_windows(width, height, self.block_size))
+        first = {band: first[band] for band in bands}
+        second = {band: second[band] for band in bands}
+
+        if self.workers > 0 and len(windows) > 1:
+            # spawn: o fork herdaria o estado das threads do GDAL e do numba do processo pai
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker,
+                                     initargs=(first, second, self.index_set.formulas(), bands)) as pool:
+                # Lotes limitados para não acumular em memória resultados ainda por escrever
+                batch = self.workers * 4
+                for start in range(0, len(windows), batch):
+                    yield from pool.map(_worker_window, windows[start:start + batch])
+            return
+
+        datasets = _open_datasets(first, second)
+        try:
+            for window in windows:
+                yield (window, *_compute_window(datasets, self.index_set, bands, window))
+        finally:
+            for dataset in datasets.values():
+                dataset.close()
+
+    def compute(self, first: Dict[str, str], second: Dict[str, str], output_path: str, tmp_dir: str,
+                first_index_path: Optional[str] = None, second_index_path: Optional[str] = None,
+                stacks: Sequence[BandStack] = ()) -> Dict[str, Dict[str, float]]:
+        """
+        Escreve a diferença (recente - antiga) de todos os índices como COG multibanda em output_path.
+
+        Args:
+            first, second: raster (ficheiro ou VRT) de cada banda necessária, por data
+            first_index_path, second_index_path: se indicados, guarda também os índices de
+                cada data (GeoTIFF tiled multibanda), por exemplo para pré-visualizações
+            stacks: bandas em bruto a copiar, na mesma passagem, para GeoTIFFs multibanda
+                (com o nome de cada banda na descrição), sem voltar a ler as fontes
+
+        Returns:
+            Estatísticas da diferença de cada índice, calculadas em streaming (min, max, mean,
+            std, count e percentis p2/p5/p95/p98 por histograma, ver raster_stats)
+        """
+        bands = list(dict.fromkeys([*self.bands, *(band for _, _, stack in stacks for band in stack)]))
+        missing = [band for band in bands if band not in first or band not in second]
+        if missing:
+            raise ValueError(f"Bandas em falta para {', '.join(self.names)}: {', '.join(missing)}")
+
+        reference = first[self.bands[0]]
+        with rasterio.open(reference) as ref:
+            profile = ref.profile.copy()
+            for path in [first[band] for band in bands] + [second[band] for band in bands]:
+                with rasterio.open(path) as other:
+                    if (other.width, other.height) != (ref.width, ref.height):
+                        raise ValueError(
+                            f"Grelhas diferentes: {reference} {ref.width}x{ref.height}, "
+                            f"{path} {other.width}x{other.height}"
+                        )
+
+        profile, block = self._stream_profile(profile, len(self.names))
+
+        diff_tmp = os.path.join(tmp_dir, "index_diff.stream.tif")
+        paths = [diff_tmp]
+        if first_index_path and second_index_path:
+            paths += [first_index_path, second_index_path]
+        outputs = []
+        stack_outputs = []
+        stats = [RasterStats(value_range=index.diff_range) for index in self.index_set.indices]
+        try:
+            for path in paths:
+                dst = rasterio.open(path, "w", **profile)
+                outputs.append(dst)
+                dst.descriptions = tuple(self.names)
+            self._tag_diff(outputs[0])
+            for date, path, stack in stacks:
+                dst = rasterio.open(path, "w", **self._stack_profile(profile, (first, second)[date == "second"],
+                                                                     stack))
+                stack_outputs.append((date, stack, dst))
+                dst.descriptions = tuple(stack)
+
+            for window, first_block, second_block, diff, raw in self._windows(first, second, bands, profile["width"],
+                                                                              profile["height"]):
+                outputs[0].write(diff, window=window)
+                if len(outputs) == 3:
+                    outputs[1].write(first_block, window=window)
+                    outputs[2].write(second_block, window=window)
+                for date, stack, dst in stack_outputs:
+                    dst.write(np.stack([raw[date][band] for band in stack]), window=window)
+                for band_stats, band_diff in zip(stats, diff):
+                    band_stats.update(band_diff)
+        finally:
+            for dst in outputs + [dst for _, _, dst in stack_outputs]:
+                dst.close()
+
+        self._to_cog(diff_tmp, output_path, block)
+        return {name: band_stats.result(DEFAULT_PERCENTILES) for name, band_stats in zip(self.names, stats)}
+
+    def import_diff(self, source: str, output_path: str, tmp_dir: str,
+                    nodata: Optional[float] = DIFF_NODATA) -> Dict[str, Dict[str, float]]:
+        """
+        Converte uma diferença NDVI já calculada (ex.: no Earth Engine, modo "server" do fetcher)
+        num COG igual ao do compute, com as estatísticas calculadas em streaming.
+
+        Args:
+            source: raster (ficheiro ou VRT) de uma banda com a diferença em [-2, 2]
+            nodata: valor dos píxeis sem dados, escritos como NaN e fora das estatísticas
+        """
+        if self.names != ["NDVI"]:
+            raise ValueError(f"Diferença importada só tem NDVI, pedidos: {', '.join(self.names)}")
+
+        diff_tmp = os.path.join(tmp_dir, "index_diff.stream.tif")
+        stats = RasterStats(value_range=self.index_set.indices[0].diff_range)
+        with rasterio.open(source) as src:
+            profile, block = self._stream_profile(src.profile.copy(), 1)
+            with rasterio.open(diff_tmp, "w", **profile) as dst:
+                dst.descriptions = tuple(self.names)
+                self._tag_diff(dst)
+                for window in iter_windows(src.width, src.height, self.block_size):
+                    diff = src.read(1, window=window).astype(np.float32)
+                    if nodata is not None:
+                        diff[diff == nodata] = np.nan
+                    dst.write(diff, 1, window=window)
+                    stats.update(diff)
+
+        self._to_cog(diff_tmp, output_path, block)
+        return {"NDVI": stats.result(DEFAULT_PERCENTILES)}
+
+    def _tag_diff(self, dst: rasterio.io.DatasetWriter) -> None:
+        """Escala (DIFF_SCALE) e intervalo de cada banda (DIFF_RANGE) da diferença."""
+        dst.update_tags(DIFF_SCALE=DIFF_SCALE)
+        for i, index in enumerate(self.index_set.indices, start=1):
+            low, high = index.diff_range
+            dst.update_tags(i, DIFF_RANGE=f"{low:g},{high:g}")
+
+    @staticmethod
+    def _stack_profile(profile: dict, rasters: Dict[str, str], stack: Sequence[str]) -> dict:
+        """Perfil de uma cópia de bandas em bruto: o tipo das fontes, comprimido sem perdas."""
+        with rasterio.open(rasters[stack[0]]) as src:
+            dtype = src.dtypes[0]
+        profile = profile.copy()
+        profile.update(count=len(stack), dtype=dtype, compress="deflate",
+                       predictor=2 if np.dtype(dtype).kind in "ui" else 3)
+        return profile
+
+    def _stream_profile(self, profile: dict, count: int) -> Tuple[dict, int]:
+        """Perfil do GeoTIFF float32 tiled escrito em streaming, e o lado dos seus blocos."""
+        block = min(self.block_size, max(profile["width"], profile["height"]))
+        block = max(16, block - block % 16)
+        profile.update(driver="GTiff", count=count, dtype="float32", nodata=None,
+                       tiled=True, blockxsize=block, blockysize=block, interleave="band")
+        profile.pop("photometric", None)
+        return profile, block
+
+    @staticmethod
+    def _to_cog(stream_path: str, output_path: str, block: int) -> None:
+        # O driver COG só suporta CreateCopy: converte o GeoTIFF escrito em streaming
+        rasterio.shutil.copy(stream_path, output_path, driver="COG", compress="DEFLATE",
+                             predictor=3, blocksize=block, overview_resampling="AVERAGE")
+        os.remove(stream_path)
+
+
+def read_preview(path: str, max_size: int, band: int = 1) -> np.ndarray:
+    """Lê uma banda reduzida para no máximo max_size píxeis de lado (usa as overviews, se existirem)."""
+    with rasterio.open(path) as src:
+        scale = max(src.width, src.height) / max_size
+        if scale <= 1:
+            return src.read(band)
+        shape = (max(1, int(src.height / scale)), max(1, int(src.width / scale)))
+        return src.read(band, out_shape=shape, resampling=Resampling.average)
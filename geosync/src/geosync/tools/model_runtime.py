@@ -0,0 +1,140 @@
+import hashlib
+import os
+import platform
+import sys
+import uuid
+from pathlib import Path
+from typing import List, Literal, Optional
+
+import onnxruntime as ort
+import yaml
+from pydantic import BaseModel
+
+DEFAULT_CONFIG_PATH = Path(__file__).resolve().parent.parent / "config" / "model_runtime.yaml"
+
+ENV_PREFIX = "GEOSYNC_ORT_"
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+# Variantes do modelo geradas por fine-tuning/quantize_model.py, ao lado do modelo FP32
+MODEL_VARIANTS = ("fp32", "int8_dynamic", "int8_static")
+
+
+class ModelRuntimeConfig(BaseModel):
+    """Opções da sessão ONNX Runtime (config/model_runtime.yaml + variáveis GEOSYNC_ORT_*)."""
+    model_variant: Literal["fp32", "int8_dynamic", "int8_static"] = "fp32"
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    execution_mode: Literal["sequential", "parallel"] = "sequential"
+    graph_optimization_level: Literal["disable", "basic", "extended", "all"] = "all"
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    optimized_model_cache: bool = True
+    optimized_model_dir: str = os.path.join("models", "optimized")
+    providers: List[str] = ["CPUExecutionProvider"]
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "ModelRuntimeConfig":
+        """
+        Lê a configuração do YAML (path, GEOSYNC_MODEL_RUNTIME_CONFIG ou o ficheiro por omissão)
+        e aplica as variáveis de ambiente GEOSYNC_ORT_<OPÇÃO>, que têm prioridade.
+        """
+        path = Path(path or os.getenv("GEOSYNC_MODEL_RUNTIME_CONFIG", DEFAULT_CONFIG_PATH))
+        values = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                values = yaml.safe_load(f) or {}
+
+        for field in cls.model_fields:
+            env_value = os.getenv(ENV_PREFIX + field.upper())
+            if env_value is not None:
+                values[field] = [item.strip() for item in env_value.split(",")] if field == "providers" else env_value
+        return cls(**values)
+
+    def session_options(self) -> ort.SessionOptions:
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_num_threads
+        options.inter_op_num_threads = self.inter_op_num_threads
+        options.execution_mode = EXECUTION_MODES[self.execution_mode]
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization_level]
+        options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        options.enable_mem_pattern = self.enable_mem_pattern
+        return options
+
+
+def resolve_model_path(model_path: str, variant: str = "fp32") -> str:
+    """
+    Caminho da variante pedida (segformer_dynamic.onnx -> segformer_dynamic.int8_static.onnx).
+
+    Se a variante quantizada não existir, usa o modelo FP32, com um aviso.
+    """
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Variante de modelo desconhecida: {variant}. Opções: {', '.join(MODEL_VARIANTS)}")
+    if variant == "fp32":
+        return model_path
+    path = Path(model_path)
+    variant_path = path.with_name(f"{path.stem}.{variant}{path.suffix}")
+    if not variant_path.exists():
+        print(f"[MODEL] Variante {variant} não encontrada ({variant_path}), a usar o modelo FP32", file=sys.stderr)
+        return model_path
+    return str(variant_path)
+
+
+def optimized_model_path(model_path: str, config: ModelRuntimeConfig) -> Path:
+    """
+    Caminho do grafo otimizado de um modelo na cache.
+
+    A chave inclui o conteúdo do modelo, a versão do ONNX Runtime, o nível de otimização,
+    os providers e a arquitetura (os grafos "extended"/"all" dependem do hardware), para que
+    um modelo ou runtime novo nunca reutilize um grafo antigo.
+    """
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(f"{ort.__version__}|{config.graph_optimization_level}|{','.join(config.providers)}|"
+                  f"{platform.machine()}".encode())
+    return Path(config.optimized_model_dir) / f"{Path(model_path).stem}.{digest.hexdigest()[:16]}.onnx"
+
+
+def create_session(model_path: str, config: Optional[ModelRuntimeConfig] = None) -> ort.InferenceSession:
+    """
+    Cria a sessão ONNX Runtime com as opções configuradas.
+
+    Com optimized_model_cache, a primeira sessão guarda o grafo otimizado em disco e as
+    seguintes carregam-no diretamente, sem voltar a aplicar as otimizações.
+    """
+    config = config or ModelRuntimeConfig.load()
+    options = config.session_options()
+
+    use_cache = (config.optimized_model_cache and config.graph_optimization_level != "disable"
+                 and os.path.exists(model_path))
+    if not use_cache:
+        return ort.InferenceSession(model_path, sess_options=options, providers=config.providers)
+
+    cached_path = optimized_model_path(model_path, config)
+    if cached_path.exists():
+        print(f"[MODEL] A usar o grafo otimizado em cache: {cached_path}", file=sys.stderr)
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return ort.InferenceSession(str(cached_path), sess_options=options, providers=config.providers)
+
+    # Escrito com um nome temporário e renomeado: sessões em paralelo nunca leem um ficheiro a meio
+    cached_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cached_path.with_name(f".{cached_path.stem}.{uuid.uuid4().hex[:8]}.onnx")
+    options.optimized_model_filepath = str(tmp_path)
+    session = ort.InferenceSession(model_path, sess_options=options, providers=config.providers)
+    if tmp_path.exists():
+        os.replace(tmp_path, cached_path)
+        print(f"[MODEL] Grafo otimizado guardado em {cached_path}", file=sys.stderr)
+    return session
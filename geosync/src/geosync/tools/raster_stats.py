@@ -0,0 +1,174 @@
+import math
+import os
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Erro máximo (nas unidades dos valores) dos percentis calculados por histograma de floats
+DEFAULT_ACCURACY = 1e-3
+
+DEFAULT_PERCENTILES = (2, 5, 95, 98)
+
+# Número máximo de bins do histograma de floats (limita a memória quando o intervalo é grande)
+MAX_BINS = 1 << 20
+
+CHUNK_SIZE = 1 << 20
+
+
+def default_accuracy() -> float:
+    return float(os.getenv("GEOSYNC_STATS_ACCURACY", DEFAULT_ACCURACY))
+
+
+class RasterStats:
+    """
+    Estatísticas de um raster numa única passagem, acumuláveis janela a janela.
+
+    Mínimo, máximo, média e desvio padrão são exatos. Os percentis vêm de um histograma:
+    - inteiros de 8/16 bits (bandas Sentinel-2): histograma com um bin por valor (np.bincount),
+      pelo que os percentis são exatos;
+    - floats: bins de largura `accuracy` em `value_range`, com erro máximo `accuracy`
+      (GEOSYNC_STATS_ACCURACY, no máximo MAX_BINS bins). Valores fora do intervalo contam
+      no primeiro/último bin.
+
+    Valores NaN/inf são ignorados. Nunca copia nem ordena o raster, ao contrário de np.percentile.
+    """
+
+    def __init__(self, value_range: Optional[Tuple[float, float]] = None, accuracy: Optional[float] = None,
+                 dtype=None):
+        self.count, self.total, self.total_sq = 0, 0.0, 0.0
+        self.minimum, self.maximum = math.inf, -math.inf
+        self.accuracy = accuracy or default_accuracy()
+        self.value_range = value_range
+        self._offset = 0
+        self._histogram: Optional[np.ndarray] = None
+        self._integer = dtype is not None and np.dtype(dtype).kind in "ui" and np.dtype(dtype).itemsize <= 2
+        if self._integer:
+            info = np.iinfo(dtype)
+            self._offset = -int(info.min)
+            self._histogram = np.zeros(int(info.max) - int(info.min) + 1, dtype=np.int64)
+        elif value_range is not None:
+            low, high = value_range
+            self._bins = min(max(1, math.ceil((high - low) / self.accuracy)), MAX_BINS)
+            # Largura efetiva dos bins (maior que a pedida só se o limite MAX_BINS for atingido)
+            self.accuracy = max(self.accuracy, (high - low) / self._bins)
+            self._histogram = np.zeros(self._bins, dtype=np.int64)
+
+    @classmethod
+    def for_array(cls, array: np.ndarray, accuracy: Optional[float] = None) -> "RasterStats":
+        """Estatísticas de um array completo (o intervalo dos floats é o do próprio array)."""
+        if array.dtype.kind in "ui" and array.dtype.itemsize <= 2:
+            stats = cls(dtype=array.dtype)
+        else:
+            # Intervalo só dos valores finitos, sem copiar o array
+            where = np.isfinite(array) if array.dtype.kind == "f" else True
+            low = float(np.min(array, where=where, initial=np.inf))
+            high = float(np.max(array, where=where, initial=-np.inf))
+            value_range = (low, high) if low <= high else (0.0, 1.0)
+            if value_range[0] == value_range[1]:
+                value_range = (value_range[0], value_range[0] + 1.0)
+            stats = cls(value_range=value_range, accuracy=accuracy)
+        stats.update(array)
+        return stats
+
+    def update(self, block: np.ndarray) -> "RasterStats":
+        # Por fatias, para que as cópias temporárias (float64, índices dos bins) fiquem limitadas
+        values = block.ravel()
+        for start in range(0, values.size, CHUNK_SIZE):
+            self._update_chunk(values[start:start + CHUNK_SIZE])
+        return self
+
+    def _update_chunk(self, values: np.ndarray) -> None:
+        if values.dtype.kind == "f":
+            finite = np.isfinite(values)
+            if not finite.all():
+                values = values[finite]
+        if values.size == 0:
+            return
+
+        as_float = values.astype(np.float64)
+        self.count += values.size
+        self.total += float(as_float.sum())
+        self.total_sq += float(np.dot(as_float, as_float))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+        if self._integer:
+            self._histogram += np.bincount(values.astype(np.int64) + self._offset, minlength=self._histogram.size)
+        elif self._histogram is not None:
+            low, _ = self.value_range
+            as_float -= low
+            as_float /= self.accuracy
+            bins = as_float.astype(np.int64)
+            np.clip(bins, 0, self._bins - 1, out=bins)
+            self._histogram += np.bincount(bins, minlength=self._bins)
+
+    def merge(self, other: "RasterStats") -> "RasterStats":
+        """Junta as estatísticas de outra janela/processo (mesmo tipo de histograma)."""
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        if self._histogram is not None and other._histogram is not None:
+            self._histogram += other._histogram
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        if not self.count:
+            return 0.0
+        return math.sqrt(max(self.total_sq / self.count - self.mean ** 2, 0.0))
+
+    def percentiles(self, qs: Iterable[float]) -> Dict[float, float]:
+        """Percentis (0-100) a partir do histograma, com interpolação linear como o np.percentile."""
+        qs = list(qs)
+        if self._histogram is None:
+            raise ValueError("Percentis indisponíveis: value_range não definido para dados float")
+        if not self.count:
+            return {q: math.nan for q in qs}
+
+        cumulative = np.cumsum(self._histogram)
+        result = {}
+        for q in qs:
+            rank = q / 100 * (self.count - 1)
+            lower, upper = math.floor(rank), math.ceil(rank)
+            value = self._value_at(cumulative, lower)
+            if upper != lower:
+                value += (rank - lower) * (self._value_at(cumulative, upper) - value)
+            result[q] = min(max(value, self.minimum), self.maximum)
+        return result
+
+    def percentile(self, q: float) -> float:
+        return self.percentiles([q])[q]
+
+    def _value_at(self, cumulative: np.ndarray, rank: int) -> float:
+        """Valor do elemento de ordem `rank` (0-based) na distribuição do histograma."""
+        index = int(np.searchsorted(cumulative, rank, side="right"))
+        if self._integer:
+            return float(index - self._offset)
+        # Centro do bin: o erro fica abaixo de metade da largura do bin
+        low, _ = self.value_range
+        return low + (index + 0.5) * self.accuracy
+
+    def result(self, percentiles: Sequence[float] = ()) -> Dict[str, float]:
+        output = {
+            "min": self.minimum if self.count else math.nan,
+            "max": self.maximum if self.count else math.nan,
+            "mean": self.mean,
+            "std": self.std,
+            "count": self.count,
+        }
+        if percentiles and self._histogram is not None:
+            for q, value in self.percentiles(percentiles).items():
+                output[f"p{q:g}"] = value
+        return output
+
+
+def describe(array: np.ndarray, percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+             accuracy: Optional[float] = None) -> Dict[str, float]:
+    """Mínimo, máximo, média, desvio padrão e percentis de um array, numa só passagem de histograma."""
+    return RasterStats.for_array(array, accuracy).result(percentiles)
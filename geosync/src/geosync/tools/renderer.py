@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+DEFAULT_WEBP_QUALITY = 90
+
+# Cores de referência ColorBrewer (11 classes), interpoladas para LUTs de 256 entradas
+_ANCHORS = {
+    "RdYlGn": ["#a50026", "#d73027", "#f46d43", "#fdae61", "#fee08b", "#ffffbf",
+               "#d9ef8b", "#a6d96a", "#66bd63", "#1a9850", "#006837"],
+    "RdBu": ["#67001f", "#b2182b", "#d6604d", "#f4a582", "#fddbc7", "#f7f7f7",
+             "#d1e5f0", "#92c5de", "#4393c3", "#2166ac", "#053061"],
+    "gray": ["#000000", "#ffffff"],
+}
+
+
+def _build_lut(anchors: Sequence[str]) -> np.ndarray:
+    colors = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in anchors], dtype=np.float64)
+    positions = np.linspace(0, 1, len(colors))
+    x = np.linspace(0, 1, 256)
+    lut = np.stack([np.interp(x, positions, colors[:, channel]) for channel in range(3)], axis=-1)
+    return np.round(lut).astype(np.uint8)
+
+
+LUTS: Dict[str, np.ndarray] = {name: _build_lut(anchors) for name, anchors in _ANCHORS.items()}
+LUTS.update({f"{name}_r": lut[::-1].copy() for name, lut in list(LUTS.items())})
+
+
+def get_lut(name: str) -> np.ndarray:
+    try:
+        return LUTS[name]
+    except KeyError:
+        raise ValueError(f"Mapa de cores desconhecido: {name}. Disponíveis: {', '.join(sorted(LUTS))}")
+
+
+def colormap_indices(data: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+    """Índices (0-255) da LUT para cada píxel, como o matplotlib: [vmin, vmax] dividido em 256 bins."""
+    scaled = data.astype(np.float32)
+    scaled -= vmin
+    scaled *= 256.0 / (vmax - vmin if vmax != vmin else 1.0)
+    np.nan_to_num(scaled, copy=False, nan=0.0)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def apply_colormap(data: np.ndarray, cmap: str = "RdYlGn", vmin: float = 0.0, vmax: float = 1.0) -> np.ndarray:
+    """
+    Aplica uma LUT de 256 cores a um raster 2D e devolve uma imagem uint8 (H, W, 3).
+
+    Píxeis NaN ficam transparentes (a imagem passa a RGBA).
+    """
+    image = get_lut(cmap)[colormap_indices(data, vmin, vmax)]
+    nan_mask = np.isnan(data) if data.dtype.kind == "f" else None
+    if nan_mask is not None and nan_mask.any():
+        alpha = np.where(nan_mask, 0, 255).astype(np.uint8)
+        image = np.dstack([image, alpha])
+    return image
+
+
+def to_uint8(image: np.ndarray) -> np.ndarray:
+    """Converte uma imagem float em [0, 1] (ex.: RGB normalizado) para uint8."""
+    scaled = np.clip(image, 0, 1) * 255 + 0.5
+    return np.nan_to_num(scaled, copy=False).astype(np.uint8)
+
+
+def save_image(image: np.ndarray, path: str, compress_level: Optional[int] = None,
+               quality: Optional[int] = None) -> str:
+    """
+    Codifica uma imagem uint8 (H, W), (H, W, 3) ou (H, W, 4) com o Pillow; o formato vem da
+    extensão (.png ou .webp). Compressão: GEOSYNC_PNG_COMPRESS_LEVEL (0-9) e
+    GEOSYNC_WEBP_QUALITY (0-100, 100 = sem perdas).
+    """
+    extension = Path(path).suffix.lower()
+    pil_image = Image.fromarray(image)
+    if extension == ".webp":
+        quality = quality if quality is not None else int(os.getenv("GEOSYNC_WEBP_QUALITY", DEFAULT_WEBP_QUALITY))
+        pil_image.save(path, format="WEBP", quality=quality, lossless=quality >= 100)
+    elif extension == ".png":
+        if compress_level is None:
+            compress_level = int(os.getenv("GEOSYNC_PNG_COMPRESS_LEVEL", DEFAULT_PNG_COMPRESS_LEVEL))
+        pil_image.save(path, format="PNG", compress_level=compress_level)
+    else:
+        raise ValueError(f"Formato de imagem não suportado: {path}")
+    return path
+
+
+def render_raster(data: np.ndarray, path: str, cmap: str = "RdYlGn", vmin: float = 0.0, vmax: float = 1.0) -> str:
+    """Guarda um raster com um mapa de cores, à resolução nativa (um píxel por píxel do raster)."""
+    return save_image(apply_colormap(data, cmap, vmin, vmax), path)
+
+
+def render_legend(path: str, cmap: str, vmin: float, vmax: float, label: str = "",
+                  width: int = 320, bar_height: int = 16) -> str:
+    """Legenda separada: barra de cores horizontal com os valores mínimo, central e máximo."""
+    font = ImageFont.load_default()
+    margin, text_height = 8, 14
+    height = bar_height + 2 * text_height + 2 * margin
+    legend = Image.new("RGB", (width, height), "white")
+
+    bar = np.repeat(get_lut(cmap)[np.linspace(0, 255, width - 2 * margin).astype(np.uint8)][None], bar_height, axis=0)
+    top = margin + (text_height if label else 0)
+    legend.paste(Image.fromarray(bar), (margin, top))
+
+    draw = ImageDraw.Draw(legend)
+    if label:
+        draw.text((margin, margin // 2), label, fill="black", font=font)
+    ticks = [(vmin, margin), ((vmin + vmax) / 2, width // 2), (vmax, width - margin)]
+    for value, x in ticks:
+        text = f"{value:.2f}"
+        text_width = draw.textlength(text, font=font)
+        x = min(max(x - text_width / 2, 0), width - text_width)
+        draw.text((x, top + bar_height + 2), text, fill="black", font=font)
+    return save_image(np.asarray(legend), path)
+
+
+def render_parallel(jobs: Sequence[Callable[[], object]], workers: Optional[int] = None) -> list:
+    """
+    Executa as renderizações em paralelo (threads: o NumPy e a compressão do Pillow libertam o GIL).
+    Workers em GEOSYNC_RENDER_WORKERS; a primeira exceção é propagada.
+    """
+    if workers is None:
+        workers = int(os.getenv("GEOSYNC_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+    if workers <= 1 or len(jobs) <= 1:
+        return [job() for job in jobs]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(job) for job in jobs]
+        return [future.result() for future in futures]
@@ -0,0 +1,53 @@
+import os
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import rasterio.shutil
+from rasterio.errors import RasterioIOError
+
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+
+class ScratchRasters:
+    """
+    Rasters intermédios de uma análise (índices de cada data, cópias NIR, ...), que só são
+    lidos de volta reduzidos para as pré-visualizações.
+
+    Enquanto o total couber no orçamento de memória (GEOSYNC_MEMORY_BUDGET_MB) são escritos
+    no sistema de ficheiros em memória do GDAL (/vsimem/), sem passar pelo disco; acima disso
+    vão para o tmp/ do pedido. O orçamento é verificado antes de escrever, pelo tamanho
+    descomprimido do raster, pelo que limita o pico de memória.
+    """
+
+    def __init__(self, tmp_dir: str, budget_bytes: Optional[int] = None):
+        if budget_bytes is None:
+            budget_bytes = int(os.getenv("GEOSYNC_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB)) * 1024 ** 2
+        self.tmp_dir = Path(tmp_dir)
+        self.budget_bytes = budget_bytes
+        self.memory_bytes = 0
+        self._prefix = f"/vsimem/geosync_{uuid.uuid4().hex}"
+        self._memory_paths: List[str] = []
+
+    def path(self, name: str, shape: Tuple[int, ...], dtype) -> str:
+        """Caminho onde escrever o raster `name` com shape (bandas, altura, largura) e dtype."""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.memory_bytes + nbytes <= self.budget_bytes:
+            self.memory_bytes += nbytes
+            path = f"{self._prefix}/{name}"
+            self._memory_paths.append(path)
+            return path
+        print(f"ScratchRasters: orçamento de memória excedido, {name} em {self.tmp_dir}")
+        return str(self.tmp_dir / name)
+
+    def close(self) -> None:
+        """Liberta os rasters em memória (os do tmp/ saem com o cleanup_tmp do pedido)."""
+        for path in self._memory_paths:
+            try:
+                rasterio.shutil.delete(path)
+            except RasterioIOError:
+                # Nunca chegou a ser escrito (ex.: a análise falhou antes)
+                pass
+        self._memory_paths.clear()
+        self.memory_bytes = 0
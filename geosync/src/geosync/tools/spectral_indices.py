@@ -0,0 +1,163 @@
+import ast
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from geosync.tools import spectral_kernels
+
+# As bandas Sentinel-2 vêm em números digitais (reflectância x 10000)
+REFLECTANCE_SCALE = 1 / 10000.0
+
+Evaluator = Callable[[Dict[str, np.ndarray]], np.ndarray]
+
+
+class SpectralIndex(NamedTuple):
+    """
+    Índice espectral declarado por uma fórmula sobre nomes de bandas Sentinel-2.
+
+    A fórmula aceita + - * /, constantes, bandas (B2, B8, B11, ...) e nd(a, b), a diferença
+    normalizada (a - b) / (a + b) calculada pelo kernel fundido de spectral_kernels.
+    As bandas entram como reflectância (0-1), para que constantes como as do EVI façam sentido.
+    `value_range` é o intervalo típico do índice, usado nos histogramas das estatísticas.
+    """
+    name: str
+    formula: str
+    description: str = ""
+    value_range: Tuple[float, float] = (-1.0, 1.0)
+
+    @property
+    def diff_range(self) -> Tuple[float, float]:
+        low, high = self.value_range
+        return (low - high, high - low)
+
+
+INDICES: Dict[str, SpectralIndex] = {}
+
+
+def band_sort_key(band: str) -> Tuple[int, str]:
+    """Ordem numérica das bandas Sentinel-2 (B2 < B8 < B8A < B11)."""
+    match = re.match(r"B(\d+)", band)
+    return (int(match.group(1)) if match else 0, band)
+
+
+def register_index(name: str, formula: str, description: str = "",
+                   value_range: Tuple[float, float] = (-1.0, 1.0)) -> SpectralIndex:
+    index = SpectralIndex(name.upper(), formula, description, value_range)
+    compile_formula(formula)  # valida a fórmula já no registo
+    INDICES[index.name] = index
+    return index
+
+
+def safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Divisão elemento a elemento; denominadores nulos ou não finitos dão 0."""
+    out = np.zeros(np.broadcast(numerator, denominator).shape, dtype=np.float32)
+    valid = np.isfinite(denominator) & (np.abs(denominator) > spectral_kernels.EPSILON)
+    np.divide(numerator, denominator, out=out, where=valid)
+    return out
+
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: safe_divide,
+}
+
+
+def _compile(node: ast.AST, bands: set) -> Evaluator:
+    if isinstance(node, ast.Expression):
+        return _compile(node.body, bands)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        value = np.float32(node.value)
+        return lambda values: value
+    if isinstance(node, ast.Name):
+        name = node.id.upper()
+        bands.add(name)
+        return lambda values: values[name]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _compile(node.operand, bands)
+        if isinstance(node.op, ast.USub):
+            return lambda values: np.negative(operand(values))
+        return operand
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        op = _BINARY_OPS[type(node.op)]
+        left, right = _compile(node.left, bands), _compile(node.right, bands)
+        return lambda values: op(left(values), right(values))
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "nd"
+            and len(node.args) == 2 and not node.keywords):
+        a, b = (_compile(arg, bands) for arg in node.args)
+        return lambda values: spectral_kernels.normalized_difference(a(values), b(values))
+    raise ValueError(f"Expressão não suportada na fórmula: {ast.dump(node)}")
+
+
+def compile_formula(formula: str) -> Tuple[List[str], Evaluator]:
+    """Compila uma fórmula para (bandas necessárias, função bandas -> índice float32)."""
+    try:
+        tree = ast.parse(formula, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Fórmula inválida '{formula}': {e}") from e
+    bands: set = set()
+    evaluator = _compile(tree, bands)
+    return sorted(bands, key=band_sort_key), evaluator
+
+
+register_index("NDVI", "nd(B8, B4)", "Vegetação")
+register_index("NDBI", "nd(B11, B8)", "Áreas construídas")
+register_index("NDWI", "nd(B3, B8)", "Água (McFeeters)")
+register_index("MNDWI", "nd(B3, B11)", "Água, modificado (Xu)")
+register_index("EVI", "2.5 * (B8 - B4) / (B8 + 6 * B4 - 7.5 * B2 + 1)", "Vegetação, realçado")
+register_index("SAVI", "1.5 * (B8 - B4) / (B8 + B4 + 0.5)", "Vegetação, ajustado ao solo", (-1.5, 1.5))
+
+DEFAULT_INDICES = ["NDVI"]
+
+
+def resolve_indices(names: Optional[Sequence[str]] = None) -> List[SpectralIndex]:
+    """Índices pedidos (por nome), com o NDVI sempre em primeiro lugar."""
+    ordered = ["NDVI"] + [name.upper() for name in (names or DEFAULT_INDICES) if name.upper() != "NDVI"]
+    unknown = [name for name in ordered if name not in INDICES]
+    if unknown:
+        raise ValueError(f"Índices desconhecidos: {', '.join(unknown)}. Disponíveis: {', '.join(INDICES)}")
+    return [INDICES[name] for name in dict.fromkeys(ordered)]
+
+
+def required_bands(indices: Sequence[SpectralIndex]) -> List[str]:
+    """União das bandas necessárias a um conjunto de índices, por ordem numérica."""
+    bands = {band for index in indices for band in compile_formula(index.formula)[0]}
+    return sorted(bands, key=band_sort_key)
+
+
+class IndexSet:
+    """
+    Conjunto de índices compilados, avaliados em conjunto sobre um bloco de bandas.
+
+    Cada banda é convertida para reflectância uma única vez por bloco e partilhada por
+    todos os índices que a usam.
+    """
+
+    def __init__(self, indices: Sequence[SpectralIndex]):
+        self.indices = list(indices)
+        self.names = [index.name for index in self.indices]
+        self._evaluators = [compile_formula(index.formula)[1] for index in self.indices]
+        self.bands = required_bands(self.indices)
+
+    @classmethod
+    def from_formulas(cls, formulas: Sequence[Tuple[str, str]]) -> "IndexSet":
+        return cls([SpectralIndex(name, formula) for name, formula in formulas])
+
+    def formulas(self) -> List[Tuple[str, str]]:
+        return [(index.name, index.formula) for index in self.indices]
+
+    def evaluate(self, raw_bands: Dict[str, np.ndarray]) -> np.ndarray:
+        """Devolve um array (n_índices, altura, largura) float32 a partir das bandas em bruto."""
+        reflectance = {}
+        for band in self.bands:
+            values = raw_bands[band].astype(np.float32)
+            values *= REFLECTANCE_SCALE
+            reflectance[band] = values
+
+        first = reflectance[self.bands[0]]
+        out = np.empty((len(self._evaluators),) + first.shape, dtype=np.float32)
+        for i, evaluator in enumerate(self._evaluators):
+            out[i] = evaluator(reflectance)
+        return out
@@ -0,0 +1,146 @@
+import os
+import sys
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Um píxel só é válido se a soma das bandas for positiva e finita (exclui NaN/inf)
+EPSILON = 1e-6
+FLOAT32_MAX = float(np.finfo(np.float32).max)
+
+DEFAULT_BACKEND = "auto"
+
+Kernel = Callable[[np.ndarray, np.ndarray, np.ndarray, float, float], np.ndarray]
+
+
+def _numpy_kernel(a: np.ndarray, b: np.ndarray, out: np.ndarray, offset: float, scale: float) -> np.ndarray:
+    """Implementação NumPy com out=/where=: um buffer float32 (denominador) e uma máscara booleana."""
+    denominator = np.add(a, b, dtype=np.float32)
+    np.subtract(a, b, out=out, dtype=np.float32)
+    valid = np.greater(denominator, EPSILON)
+    np.logical_and(valid, np.less(denominator, FLOAT32_MAX), out=valid)
+    np.divide(out, denominator, out=out, where=valid)
+    np.logical_not(valid, out=valid)
+    np.copyto(out, 0.0, where=valid)
+    if offset:
+        out += offset
+    if scale != 1.0:
+        out *= scale
+    return out
+
+
+def _numexpr_kernel(a: np.ndarray, b: np.ndarray, out: np.ndarray, offset: float, scale: float) -> np.ndarray:
+    import numexpr as ne
+
+    ne.evaluate(
+        "(where((a + b > epsilon) & (a + b < fmax), (a - b) / (a + b), 0) + offset) * scale",
+        local_dict={
+            "a": a.astype(np.float32, copy=False),
+            "b": b.astype(np.float32, copy=False),
+            "epsilon": np.float32(EPSILON),
+            "fmax": np.float32(FLOAT32_MAX),
+            "offset": np.float32(offset),
+            "scale": np.float32(scale),
+        },
+        out=out,
+        casting="same_kind",
+    )
+    return out
+
+
+_numba_compiled: Optional[Callable] = None
+
+
+def _numba_kernel(a: np.ndarray, b: np.ndarray, out: np.ndarray, offset: float, scale: float) -> np.ndarray:
+    global _numba_compiled
+    if _numba_compiled is None:
+        from numba import njit, prange
+
+        @njit(parallel=True, cache=True)
+        def kernel(a, b, out, offset, scale, epsilon, fmax):
+            for i in prange(a.size):
+                x = np.float32(a[i])
+                y = np.float32(b[i])
+                denominator = x + y
+                if denominator > epsilon and denominator < fmax:
+                    out[i] = ((x - y) / denominator + offset) * scale
+                else:
+                    out[i] = offset * scale
+
+        _numba_compiled = kernel
+
+    # O kernel escreve num vetor 1D: com um `out` não contíguo (ex. uma fatia) o reshape seria
+    # uma cópia e o resultado perdia-se, por isso escreve-se num buffer contíguo e copia-se
+    target = out if out.flags.c_contiguous else np.empty(out.shape, dtype=np.float32)
+    _numba_compiled(np.ascontiguousarray(a).ravel(), np.ascontiguousarray(b).ravel(), target.reshape(-1),
+                    np.float32(offset), np.float32(scale), np.float32(EPSILON), np.float32(FLOAT32_MAX))
+    if target is not out:
+        out[...] = target
+    return out
+
+
+BACKENDS: Dict[str, Kernel] = {
+    "numpy": _numpy_kernel,
+    "numexpr": _numexpr_kernel,
+    "numba": _numba_kernel,
+}
+
+# Ordem de preferência do modo "auto". O numexpr não suporta uint16 (obriga a converter as
+# bandas para float32 antes), e em bench_spectral_kernels.py fica atrás do próprio NumPy;
+# só é usado se for pedido explicitamente
+AUTO_ORDER = ["numba", "numpy"]
+
+
+def is_available(backend: str) -> bool:
+    if backend == "numpy":
+        return True
+    try:
+        __import__(backend)
+    except ImportError:
+        return False
+    return True
+
+
+def available_backends() -> List[str]:
+    return [name for name in BACKENDS if is_available(name)]
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    """
+    Escolhe o backend a usar: o pedido, GEOSYNC_KERNEL_BACKEND ou "auto".
+
+    Se o backend pedido não estiver instalado é usado o NumPy, com um aviso.
+    """
+    backend = (backend or os.getenv("GEOSYNC_KERNEL_BACKEND", DEFAULT_BACKEND)).lower()
+    if backend == "auto":
+        return next(name for name in AUTO_ORDER if is_available(name))
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconhecido: {backend}. Opções: auto, {', '.join(BACKENDS)}")
+    if not is_available(backend):
+        print(f"[KERNELS] Backend {backend} não instalado, a usar numpy", file=sys.stderr)
+        return "numpy"
+    return backend
+
+
+def normalized_difference(a: np.ndarray, b: np.ndarray, out: Optional[np.ndarray] = None,
+                          offset: float = 0.0, scale: float = 1.0,
+                          backend: Optional[str] = None) -> np.ndarray:
+    """
+    Índice de diferença normalizada ((a - b) / (a + b) + offset) * scale, em float32.
+
+    Píxeis com a + b <= 0 ou não finito (NaN/inf) ficam com índice 0, isto é, offset * scale.
+    O resultado é escrito em `out` quando fornecido (sem alocar um novo array).
+    """
+    if a.shape != b.shape:
+        raise ValueError(f"Bandas com dimensões diferentes: {a.shape} e {b.shape}")
+    if out is None:
+        out = np.empty(a.shape, dtype=np.float32)
+    return BACKENDS[resolve_backend(backend)](a, b, out, offset, scale)
+
+
+def ndvi(red: np.ndarray, nir: np.ndarray, out: Optional[np.ndarray] = None,
+         normalized: bool = True, backend: Optional[str] = None) -> np.ndarray:
+    """NDVI = (NIR - RED) / (NIR + RED); com normalized=True é reescalado de [-1, 1] para [0, 1]."""
+    if normalized:
+        return normalized_difference(nir, red, out=out, offset=1.0, scale=0.5, backend=backend)
+    return normalized_difference(nir, red, out=out, backend=backend)
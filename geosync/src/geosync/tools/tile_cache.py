@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Sequence, Tuple
+
+DEFAULT_CACHE_DIR = os.path.join("raw_images", "tiles")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+
+# Entradas devolvidas (get/put) há menos do que isto não são removidas: o chamador abre o
+# ficheiro mais tarde (ex. na análise), já fora do lock do índice
+DEFAULT_GRACE_SECONDS = 3600
+
+# Aproximação: 1 grau de latitude ~ 111.32 km (a mesma usada para criar as ROIs)
+METERS_PER_DEGREE = 111320.0
+
+
+def snap_to_grid(lat: float, lon: float, cell_meters: float) -> Tuple[float, float, str]:
+    """
+    Alinha as coordenadas ao centro de uma célula de uma grelha regular.
+
+    Moradas próximas (na mesma célula) passam a gerar exatamente a mesma ROI, e as
+    coordenadas deixam de depender da formatação dos floats devolvidos pelo geocoder.
+
+    Returns:
+        (lat, lon, cell_id) alinhados à grelha
+    """
+    cell_deg = cell_meters / METERS_PER_DEGREE
+    row = round(lat / cell_deg)
+    col = round(lon / cell_deg)
+    return round(row * cell_deg, 6), round(col * cell_deg, 6), f"{cell_meters:g}m:{row}:{col}"
+
+
+class TileCache:
+    """
+    Cache em disco dos downloads do Earth Engine, com índice SQLite.
+
+    As entradas são endereçadas pelo que foi efetivamente pedido ao Earth Engine
+    (imagem Sentinel-2 resolvida, célula da grelha, região, escala e bandas) e não
+    pela data pedida pelo utilizador. Inclui escrita atómica (ficheiro temporário +
+    rename), eviction LRU por tamanho total e contadores de hits/misses.
+
+    A eviction poupa as entradas acedidas nos últimos grace_seconds
+    (GEOSYNC_TILE_CACHE_GRACE_SECONDS), que um pedido em curso ainda pode estar a ler;
+    enquanto houver só entradas recentes a cache pode passar temporariamente do limite.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 grace_seconds: Optional[float] = None):
+        self.root = Path(root or os.getenv("GEOSYNC_TILE_CACHE_DIR", DEFAULT_CACHE_DIR))
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv("GEOSYNC_TILE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        )
+        self.grace_seconds = grace_seconds if grace_seconds is not None else float(
+            os.getenv("GEOSYNC_TILE_CACHE_GRACE_SECONDS", DEFAULT_GRACE_SECONDS)
+        )
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.root / "index.sqlite"
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS tiles (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    image_id TEXT,
+                    cell TEXT,
+                    region TEXT,
+                    scale REAL,
+                    bands TEXT,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(image_id: str, cell: str, region: str, scale: float, bands: Optional[Sequence[str]] = None) -> str:
+        payload = json.dumps({
+            "image_id": image_id,
+            "cell": cell,
+            "region": region,
+            "scale": scale,
+            "bands": sorted(bands) if bands else "ALL",
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key: str, suffix: str) -> Path:
+        return self.root / key[:2] / f"{key}{suffix}"
+
+    def _incr(self, conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Devolve o caminho da entrada em cache, ou None (miss)."""
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT path FROM tiles WHERE key = ?", (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                conn.execute("UPDATE tiles SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._incr(conn, "hits")
+                return row[0]
+            if row:
+                # O ficheiro desapareceu do disco: a entrada do índice já não é válida
+                conn.execute("DELETE FROM tiles WHERE key = ?", (key,))
+            self._incr(conn, "misses")
+            return None
+
+    def put(self, key: str, writer: Callable[[BinaryIO], None], suffix: str = ".zip",
+            image_id: str = None, cell: str = None, region: str = None,
+            scale: float = None, bands: Optional[Sequence[str]] = None) -> str:
+        """
+        Escreve uma nova entrada através de `writer(ficheiro)`.
+
+        O conteúdo é escrito num ficheiro temporário e só é movido para o caminho final
+        (os.replace, atómico) depois de completo, pelo que um download interrompido
+        nunca deixa um zip a meio na cache.
+        """
+        final_path = self._path_for(key, suffix)
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = final_path.with_name(f"{final_path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        try:
+            with open(tmp_path, "wb") as f:
+                writer(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles "
+                "(key, path, size, image_id, cell, region, scale, bands, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, str(final_path), final_path.stat().st_size, image_id, cell, region, scale,
+                 ",".join(bands) if bands else None, now, now),
+            )
+            self._evict(conn, keep=key)
+        return str(final_path)
+
+    def _evict(self, conn: sqlite3.Connection, keep: Optional[str] = None) -> None:
+        """
+        Remove as entradas menos usadas recentemente até caber no limite de tamanho, sem
+        tocar nas acedidas dentro da janela de graça.
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cutoff = time.time() - self.grace_seconds
+        rows = conn.execute("SELECT key, path, size FROM tiles WHERE last_access < ? ORDER BY last_access ASC",
+                            (cutoff,)).fetchall()
+        for key, path, size in rows:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM tiles WHERE key = ?", (key,))
+            self._incr(conn, "evictions")
+            total -= size
+            logging.debug(f"TileCache: evicted {path} ({size} bytes)")
+        if total > self.max_bytes:
+            logging.debug(f"TileCache: {total} bytes acima do limite, só restam entradas em uso recente")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock, self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tiles").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": size,
+        }
@@ -0,0 +1,207 @@
+import math
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+
+DEFAULT_TILE_SIZE = 512
+DEFAULT_OVERLAP = 128
+
+# Peso mínimo da rampa de mistura: os píxeis da borda da imagem (cobertos por um só tile)
+# continuam a contar
+MIN_BLEND_WEIGHT = 1e-3
+
+# Converte um batch de tiles (N, altura, largura, 3) uint8 em pontuações (N, altura, largura)
+Predictor = Callable[[np.ndarray], np.ndarray]
+
+# Converte um tile lido do raster (altura, largura, 3), ex. bandas uint16, em RGB uint8
+TileTransform = Callable[[np.ndarray], np.ndarray]
+
+
+def tile_starts(length: int, tile_size: int, stride: int) -> List[int]:
+    """Inícios dos tiles ao longo de um eixo; o último encosta ao fim da imagem."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    return starts + [length - tile_size]
+
+
+def blend_weights(tile_size: int, overlap: int) -> np.ndarray:
+    """Pesos 2D (rampa linear nas zonas de sobreposição) para misturar tiles vizinhos."""
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    np.maximum(ramp, MIN_BLEND_WEIGHT, out=ramp)
+    return np.outer(ramp, ramp)
+
+
+def open_raster(path: str) -> rasterio.io.DatasetReader:
+    """Abre um raster (GeoTIFF ou PNG); PNG sem georreferência não gera avisos."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        return rasterio.open(path)
+
+
+class SlidingWindowSegmenter:
+    """
+    Segmentação por janelas deslizantes à resolução nativa da imagem.
+
+    A imagem é dividida em tiles de tile_size com `overlap` píxeis de sobreposição, lidos por
+    janelas (nunca a imagem inteira) e inferidos em batches de até max_batch. As pontuações
+    dos tiles são misturadas com pesos em rampa nas sobreposições, acumuladas numa faixa de
+    linhas e escritas no GeoTIFF de saída assim que nenhum tile pendente as cobre. A memória
+    fica limitada a uma faixa (tile_size + alguns passos) x largura, qualquer que seja a altura.
+    """
+
+    def __init__(self, predict: Predictor, tile_size: int = DEFAULT_TILE_SIZE, overlap: int = DEFAULT_OVERLAP,
+                 max_batch: int = 8, threshold: float = 0.5, tile_transform: Optional[TileTransform] = None):
+        if not 0 <= overlap < tile_size // 2:
+            raise ValueError(f"Sobreposição inválida: {overlap} (tem de ser menor que {tile_size // 2})")
+        self.predict = predict
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.stride = tile_size - overlap
+        self.max_batch = max(1, max_batch)
+        self.threshold = threshold
+        self.tile_transform = tile_transform
+        self.weights = blend_weights(tile_size, overlap)
+
+    def windows(self, width: int, height: int) -> List[Tuple[int, int]]:
+        """Posições (linha, coluna) dos tiles, linha a linha."""
+        return [(row, col)
+                for row in tile_starts(height, self.tile_size, self.stride)
+                for col in tile_starts(width, self.tile_size, self.stride)]
+
+    def read_tile(self, src: rasterio.io.DatasetReader, row: int, col: int) -> np.ndarray:
+        """Tile RGB uint8 (tile_size, tile_size, 3); nas imagens menores que o tile, com reflexão."""
+        height = min(self.tile_size, src.height - row)
+        width = min(self.tile_size, src.width - col)
+        tile = np.moveaxis(src.read([1, 2, 3], window=Window(col, row, width, height)), 0, -1)
+        if self.tile_transform is not None:
+            tile = self.tile_transform(tile)
+        if tile.shape[:2] != (self.tile_size, self.tile_size):
+            pad = ((0, self.tile_size - height), (0, self.tile_size - width), (0, 0))
+            tile = np.pad(tile, pad, mode="reflect" if min(height, width) > 1 else "edge")
+        return tile
+
+    def iter_batches(self, src: rasterio.io.DatasetReader, windows: Sequence[Tuple[int, int]]
+                     ) -> Iterator[Tuple[List[Tuple[int, int]], np.ndarray]]:
+        """Batches de tiles; o batch seguinte é lido numa thread enquanto o atual é inferido."""
+        batches = [windows[i:i + self.max_batch] for i in range(0, len(windows), self.max_batch)]
+        if not batches:
+            return
+
+        # As leituras do mesmo dataset são serializadas numa única thread (o GDAL não permite
+        # leituras concorrentes no mesmo handle)
+        def read(batch):
+            return np.stack([self.read_tile(src, row, col) for row, col in batch])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(read, batches[0])
+            for i, batch in enumerate(batches):
+                tiles = pending.result()
+                if i + 1 < len(batches):
+                    pending = executor.submit(read, batches[i + 1])
+                yield batch, tiles
+
+    def segment(self, src_path: str, output_path: str) -> Dict:
+        """
+        Escreve a máscara binária (uint8, 1 = construção) com a georreferência da imagem de
+        entrada, em GeoTIFF tiled e comprimido.
+        """
+        tile = self.tile_size
+        with open_raster(src_path) as src:
+            width, height = src.width, src.height
+            windows = self.windows(width, height)
+            n_cols = len(tile_starts(width, tile, self.stride))
+
+            profile = {
+                "driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": "uint8",
+                "compress": "deflate", "tiled": True, "blockxsize": 256, "blockysize": 256,
+            }
+            if src.crs is not None:
+                profile.update(crs=src.crs, transform=src.transform)
+
+            # Faixa de acumulação: cobre as linhas de todos os tiles de um batch
+            rows_per_batch = math.ceil(self.max_batch / n_cols) + 1
+            buffer_height = min(height, tile + self.stride * rows_per_batch)
+            scores = np.zeros((buffer_height, width), dtype=np.float32)
+            weights = np.zeros((buffer_height, width), dtype=np.float32)
+            buffer_start = 0
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", NotGeoreferencedWarning)
+                dst = rasterio.open(output_path, "w", **profile)
+
+            def flush(until: int) -> None:
+                """Escreve as linhas [buffer_start, until) e desloca a faixa."""
+                nonlocal buffer_start
+                rows = until - buffer_start
+                if rows <= 0:
+                    return
+                mask = np.zeros((rows, width), dtype=np.uint8)
+                covered = weights[:rows] > 0
+                mask[covered] = scores[:rows][covered] / weights[:rows][covered] > self.threshold
+                dst.write(mask, 1, window=Window(0, buffer_start, width, rows))
+                scores[:-rows] = scores[rows:].copy()
+                weights[:-rows] = weights[rows:].copy()
+                scores[-rows:] = 0
+                weights[-rows:] = 0
+                buffer_start = until
+
+            try:
+                position = 0
+                for batch, tiles in self.iter_batches(src, windows):
+                    predictions = self.predict(tiles)
+                    for (row, col), prediction in zip(batch, predictions):
+                        rows = min(tile, height - row)
+                        cols = min(tile, width - col)
+                        offset = row - buffer_start
+                        weight = self.weights[:rows, :cols]
+                        scores[offset:offset + rows, col:col + cols] += prediction[:rows, :cols] * weight
+                        weights[offset:offset + rows, col:col + cols] += weight
+                    position += len(batch)
+                    # Linhas acima do próximo tile pendente já não recebem mais contribuições
+                    flush(windows[position][0] if position < len(windows) else height)
+            finally:
+                dst.close()
+
+        return {"width": width, "height": height, "tiles": len(windows)}
+
+
+def iter_mask_strips(path: str, strip_rows: int = 1024) -> Iterator[Tuple[int, np.ndarray]]:
+    """Percorre uma máscara em faixas de linhas: (linha inicial, faixa)."""
+    with open_raster(path) as src:
+        for row in range(0, src.height, strip_rows):
+            rows = min(strip_rows, src.height - row)
+            yield row, src.read(1, window=Window(0, row, src.width, rows))
+
+
+def write_new_mask(first_path: str, second_path: str, output_path: str, strip_rows: int = 1024) -> str:
+    """Máscara das construções novas (presentes na segunda máscara e não na primeira), faixa a faixa."""
+    with open_raster(first_path) as src:
+        profile = src.profile.copy()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for (row, first), (_, second) in zip(iter_mask_strips(first_path, strip_rows),
+                                                  iter_mask_strips(second_path, strip_rows)):
+                new = ((second > 0) & (first == 0)).astype(np.uint8)
+                dst.write(new, 1, window=Window(0, row, new.shape[1], new.shape[0]))
+    return output_path
+
+
+def read_decimated(path: str, max_size: int, indexes=None) -> np.ndarray:
+    """Lê um raster reduzido para no máximo max_size píxeis de lado (para pré-visualizações)."""
+    with open_raster(path) as src:
+        scale = min(1.0, max_size / max(src.width, src.height))
+        shape = (max(1, round(src.height * scale)), max(1, round(src.width * scale)))
+        if indexes is None:
+            return src.read(1, out_shape=shape)
+        return np.moveaxis(src.read(indexes, out_shape=(len(indexes),) + shape), 0, -1)
@@ -0,0 +1,191 @@
+import math
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+from rasterio.warp import Resampling, calculate_default_transform, reproject, transform_bounds
+
+from geosync.tools import renderer
+
+WEB_MERCATOR = "EPSG:3857"
+
+# Metade do perímetro do equador em Web Mercator (metros)
+ORIGIN_SHIFT = 20037508.342789244
+
+TILE_SIZE = 256
+
+# Zoom máximo suportado (~0.04 m/píxel); o Sentinel-2 (10 m) fica no zoom 14
+MAX_SUPPORTED_ZOOM = 22
+
+Bounds = Tuple[float, float, float, float]
+
+# Converte um bloco de valores (bandas, altura, largura), NaN fora dos dados, numa imagem uint8
+Colorizer = Callable[[np.ndarray], np.ndarray]
+
+
+def tile_bounds(z: int, x: int, y: int) -> Bounds:
+    """Limites (esquerda, baixo, direita, cima) de um tile XYZ, em metros Web Mercator."""
+    span = 2 * ORIGIN_SHIFT / 2 ** z
+    left = -ORIGIN_SHIFT + x * span
+    top = ORIGIN_SHIFT - y * span
+    return left, top - span, left + span, top
+
+
+def resolution(z: int, tile_size: int = TILE_SIZE) -> float:
+    """Metros por píxel (no equador) dos tiles de um nível de zoom."""
+    return 2 * ORIGIN_SHIFT / (tile_size * 2 ** z)
+
+
+def zoom_for_resolution(meters_per_pixel: float, tile_size: int = TILE_SIZE) -> int:
+    """Menor zoom cujos tiles têm pelo menos a resolução pedida (sem perder detalhe do raster)."""
+    zoom = math.ceil(math.log2(2 * ORIGIN_SHIFT / (tile_size * meters_per_pixel)) - 1e-9)
+    return min(max(zoom, 0), MAX_SUPPORTED_ZOOM)
+
+
+def tiles_for_bounds(bounds: Bounds, z: int) -> Iterator[Tuple[int, int]]:
+    """Tiles (x, y) do nível z que intersetam os limites dados (metros Web Mercator)."""
+    left, bottom, right, top = bounds
+    span = 2 * ORIGIN_SHIFT / 2 ** z
+    last = 2 ** z - 1
+    x_min = min(max(int((left + ORIGIN_SHIFT) // span), 0), last)
+    x_max = min(max(int(math.ceil((right + ORIGIN_SHIFT) / span)) - 1, 0), last)
+    y_min = min(max(int((ORIGIN_SHIFT - top) // span), 0), last)
+    y_max = min(max(int(math.ceil((ORIGIN_SHIFT - bottom) / span)) - 1, 0), last)
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            yield x, y
+
+
+def _intersects(a: Bounds, b: Bounds) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _downsample(children: Sequence[Optional[np.ndarray]], bands: int, tile_size: int) -> np.ndarray:
+    """
+    Junta os 4 tiles filhos (ordem: NO, NE, SO, SE) num tile do nível anterior, com a média
+    de cada bloco 2x2 de píxeis válidos (NaN só onde os 4 píxeis são NaN).
+    """
+    mosaic = np.full((bands, 2 * tile_size, 2 * tile_size), np.nan, dtype=np.float32)
+    for i, child in enumerate(children):
+        if child is not None:
+            row, col = divmod(i, 2)
+            mosaic[:, row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size] = child
+
+    blocks = mosaic.reshape(bands, tile_size, 2, tile_size, 2)
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=(2, 4))
+    total = np.where(valid, blocks, 0).sum(axis=(2, 4), dtype=np.float32)
+    out = np.full((bands, tile_size, tile_size), np.nan, dtype=np.float32)
+    np.divide(total, count, out=out, where=count > 0)
+    return out
+
+
+def colormap_colorizer(cmap: str, vmin: float, vmax: float) -> Colorizer:
+    """Tiles de uma banda de valores (ex.: NDVI), coloridos com uma LUT do renderer."""
+    return lambda data: renderer.apply_colormap(data[0], cmap, vmin, vmax)
+
+
+def rgb_colorizer(data: np.ndarray) -> np.ndarray:
+    """Tiles de 3 bandas uint8 (RGB); os píxeis sem dados ficam transparentes."""
+    alpha = np.where(np.isnan(data[0]), 0, 255).astype(np.uint8)
+    rgb = np.nan_to_num(data[:3], nan=0.0)
+    np.clip(rgb, 0, 255, out=rgb)
+    return np.dstack([*(rgb + 0.5).astype(np.uint8), alpha])
+
+
+class TilePyramid:
+    """
+    Pirâmide de tiles XYZ (Web Mercator, 256 píxeis) de um raster georreferenciado.
+
+    Só os tiles do zoom máximo são reprojetados a partir do raster; cada nível abaixo é
+    obtido pela média 2x2 dos seus 4 filhos. A pirâmide é percorrida em profundidade, pelo
+    que só ficam em memória os tiles do ramo atual (4 por nível), qualquer que seja a ROI.
+    Tiles fora dos dados não são escritos.
+
+    Zoom máximo: o primeiro com resolução igual ou melhor que a do raster; zoom mínimo: o
+    primeiro em que o raster cabe em 2x2 tiles. Ambos podem ser fixados com
+    GEOSYNC_TILE_MAX_ZOOM e GEOSYNC_TILE_MIN_ZOOM.
+    """
+
+    def __init__(self, src_path: str, indexes: Optional[Sequence[int]] = None,
+                 min_zoom: Optional[int] = None, max_zoom: Optional[int] = None,
+                 tile_size: int = TILE_SIZE):
+        self.src_path = src_path
+        self.tile_size = tile_size
+        with rasterio.open(src_path) as src:
+            self.indexes = list(indexes or range(1, src.count + 1))
+            self.bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+            self.lonlat_bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+            transform, _, _ = calculate_default_transform(src.crs, WEB_MERCATOR, src.width, src.height, *src.bounds)
+            native_zoom = zoom_for_resolution(transform.a, tile_size)
+
+        extent = max(self.bounds[2] - self.bounds[0], self.bounds[3] - self.bounds[1], 1e-6)
+        overview_zoom = int(math.floor(math.log2(2 * ORIGIN_SHIFT / extent)))
+        if max_zoom is None:
+            max_zoom = int(os.getenv("GEOSYNC_TILE_MAX_ZOOM", native_zoom))
+        if min_zoom is None:
+            min_zoom = int(os.getenv("GEOSYNC_TILE_MIN_ZOOM", min(max(overview_zoom, 0), max_zoom)))
+        self.max_zoom = min(max(max_zoom, 0), MAX_SUPPORTED_ZOOM)
+        self.min_zoom = min(max(min_zoom, 0), self.max_zoom)
+
+    def read_tile(self, src: rasterio.io.DatasetReader, z: int, x: int, y: int) -> np.ndarray:
+        """Reprojeta o raster para um tile, em float32 com NaN fora dos dados."""
+        data = np.full((len(self.indexes), self.tile_size, self.tile_size), np.nan, dtype=np.float32)
+        reproject(
+            source=rasterio.band(src, self.indexes),
+            destination=data,
+            dst_transform=from_bounds(*tile_bounds(z, x, y), self.tile_size, self.tile_size),
+            dst_crs=WEB_MERCATOR,
+            dst_nodata=np.nan,
+            resampling=Resampling.bilinear,
+        )
+        return data
+
+    def write(self, out_dir: str, colorize: Colorizer, extension: str = "png") -> Dict:
+        """
+        Escreve os tiles em out_dir/{z}/{x}/{y}.<extension> e devolve os metadados da
+        pirâmide (estilo TileJSON: bounds em lon/lat, minzoom, maxzoom, número de tiles).
+        """
+        out = Path(out_dir)
+        written = 0
+
+        def render(src, z: int, x: int, y: int) -> Optional[np.ndarray]:
+            nonlocal written
+            if not _intersects(tile_bounds(z, x, y), self.bounds):
+                return None
+            if z == self.max_zoom:
+                data = self.read_tile(src, z, x, y)
+            else:
+                children = [render(src, z + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1)]
+                if all(child is None for child in children):
+                    return None
+                data = _downsample(children, len(self.indexes), self.tile_size)
+            if not np.isfinite(data).any():
+                return None
+
+            tile_dir = out / str(z) / str(x)
+            tile_dir.mkdir(parents=True, exist_ok=True)
+            renderer.save_image(colorize(data), str(tile_dir / f"{y}.{extension}"))
+            written += 1
+            return data
+
+        with rasterio.open(self.src_path) as src:
+            for x, y in tiles_for_bounds(self.bounds, self.min_zoom):
+                render(src, self.min_zoom, x, y)
+
+        return {
+            "bounds": list(self.lonlat_bounds),
+            "minzoom": self.min_zoom,
+            "maxzoom": self.max_zoom,
+            "tiles": written,
+        }
+
+
+def build_tiles(src_path: str, out_dir: str, colorize: Colorizer, indexes: Optional[Sequence[int]] = None,
+                extension: str = "png", min_zoom: Optional[int] = None, max_zoom: Optional[int] = None) -> Dict:
+    """Gera a pirâmide XYZ de um raster; ver TilePyramid."""
+    pyramid = TilePyramid(src_path, indexes, min_zoom=min_zoom, max_zoom=max_zoom)
+    return pyramid.write(out_dir, colorize, extension)
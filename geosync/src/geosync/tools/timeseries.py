@@ -0,0 +1,250 @@
+import contextlib
+import datetime
+import fcntl
+import os
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import h5py
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from geosync.tools import spectral_kernels
+
+DEFAULT_CADENCE_DAYS = 30
+DEFAULT_CHUNK = 256
+
+EPOCH = datetime.date(1970, 1, 1)
+DAYS_PER_YEAR = 365.25
+
+# Somas da regressão linear por píxel (NDVI em função do tempo, em anos desde a primeira data)
+# e estado do máximo de queda; atualizados a cada data acrescentada, sem reler o cubo
+STATS = ("count", "sum_t", "sum_tt", "sum_v", "sum_tv", "peak", "max_drop")
+
+
+def step_windows(start_date: str, end_date: str, cadence_days: int = DEFAULT_CADENCE_DAYS,
+                 anchor: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Janelas [início, fim) de cadence_days dias entre start_date e end_date (a última pode ser mais curta).
+
+    Com `anchor`, as janelas seguem a grelha anchor + k * cadence_days (a de um cubo já
+    existente) e começam no primeiro ponto da grelha a partir de start_date.
+    """
+    start = datetime.date.fromisoformat(start_date)
+    end = datetime.date.fromisoformat(end_date)
+    step = datetime.timedelta(days=cadence_days)
+    if anchor is not None:
+        origin = datetime.date.fromisoformat(anchor)
+        start = origin + step * -((origin - start).days // cadence_days)
+    windows = []
+    while start < end:
+        windows.append((start.isoformat(), min(start + step, end).isoformat()))
+        start += step
+    return windows
+
+
+@contextlib.contextmanager
+def cube_lock(path: str) -> Iterator[None]:
+    """
+    Lock exclusivo (flock num ficheiro <cubo>.lock) entre processos que leem e acrescentam ao
+    mesmo cubo, ex. dois pedidos do mesmo local no pool de workers.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def ndvi_from_composite(path: str, bands: Sequence[str]) -> Tuple[np.ndarray, dict]:
+    """
+    NDVI em [-1, 1] de um composite multibanda (B4 e B8); píxeis sem dados (0 nas duas bandas,
+    ou seja, mascarados no Earth Engine) ficam NaN.
+    """
+    with rasterio.open(path) as src:
+        red = src.read(bands.index("B4") + 1).astype(np.float32)
+        nir = src.read(bands.index("B8") + 1).astype(np.float32)
+        profile = src.profile.copy()
+    ndvi = spectral_kernels.ndvi(red, nir, normalized=False)
+    ndvi[(red <= 0) & (nir <= 0)] = np.nan
+    return ndvi, profile
+
+
+class NDVICube:
+    """
+    Cubo NDVI (tempo, y, x) de um local, em HDF5 com chunks de uma data por DEFAULT_CHUNK
+    píxeis de lado e dimensões no formato do NetCDF4 (lido também pelo xarray/netCDF4).
+
+    Só se acrescentam datas posteriores à última: cada nova data escreve a sua fatia e
+    atualiza as somas por píxel, de onde saem o declive (NDVI/ano) e a maior queda desde
+    um máximo anterior, sem recalcular as datas anteriores. A dimensão `time` é escrita por
+    último; se um processo morrer a meio, a fatia incompleta é descartada ao reabrir.
+    """
+
+    def __init__(self, path: str, profile: Optional[dict] = None, chunk: int = DEFAULT_CHUNK,
+                 anchor: Optional[str] = None):
+        if not os.path.exists(path) and profile is None:
+            raise FileNotFoundError(f"Cubo NDVI não encontrado: {path}")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.file = h5py.File(path, "a")
+        if "ndvi" not in self.file:
+            self._create(profile, chunk, anchor)
+        self.ndvi = self.file["ndvi"]
+        self.time = self.file["time"]
+        self.height, self.width = self.ndvi.shape[1:]
+        self.block_rows = self.ndvi.chunks[1]
+
+        if self.ndvi.shape[0] != self.time.shape[0]:
+            self.ndvi.resize(self.time.shape[0], axis=0)
+            self.rebuild_stats()
+
+    def _create(self, profile: dict, chunk: int, anchor: Optional[str]) -> None:
+        height, width = profile["height"], profile["width"]
+        transform = profile["transform"]
+        f = self.file
+        if anchor is not None:
+            f.attrs["anchor"] = anchor
+        f.attrs["crs_wkt"] = CRS.from_user_input(profile["crs"]).to_wkt() if profile.get("crs") else ""
+        f.attrs["transform"] = list(transform)[:6]
+        f.attrs["Conventions"] = "CF-1.8"
+
+        time = f.create_dataset("time", shape=(0,), maxshape=(None,), dtype="int64", chunks=(1024,))
+        time.attrs["units"] = "days since 1970-01-01"
+        # Centros dos píxeis nas coordenadas do CRS (grelha sem rotação, como a do Earth Engine)
+        x = f.create_dataset("x", data=transform.c + transform.a * (np.arange(width) + 0.5))
+        y = f.create_dataset("y", data=transform.f + transform.e * (np.arange(height) + 0.5))
+        for scale in (time, y, x):
+            scale.make_scale(scale.name.lstrip("/"))
+
+        chunks = (min(chunk, height), min(chunk, width))
+        ndvi = f.create_dataset("ndvi", shape=(0, height, width), maxshape=(None, height, width),
+                                dtype="float32", chunks=(1,) + chunks, compression="gzip",
+                                compression_opts=4, shuffle=True, fillvalue=np.nan)
+        for i, scale in enumerate((time, y, x)):
+            ndvi.dims[i].attach_scale(scale)
+
+        stats = f.create_group("stats")
+        for name in STATS:
+            dtype = "uint32" if name == "count" else "float64"
+            fill = np.nan if name == "peak" else 0
+            dataset = stats.create_dataset(name, shape=(height, width), dtype=dtype, chunks=chunks,
+                                           compression="gzip", fillvalue=fill)
+            dataset.dims[0].attach_scale(y)
+            dataset.dims[1].attach_scale(x)
+
+    def __enter__(self) -> "NDVICube":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.time.shape[0]
+
+    @property
+    def dates(self) -> List[datetime.date]:
+        return [EPOCH + datetime.timedelta(days=int(days)) for days in self.time[:]]
+
+    @property
+    def anchor(self) -> Optional[str]:
+        """Início da grelha de janelas do cubo (cubos sem o atributo: a primeira data)."""
+        if "anchor" in self.file.attrs:
+            return str(self.file.attrs["anchor"])
+        return self.dates[0].isoformat() if len(self) else None
+
+    @property
+    def profile(self) -> dict:
+        crs_wkt = self.file.attrs["crs_wkt"]
+        return {
+            "driver": "GTiff", "width": self.width, "height": self.height, "count": 1, "dtype": "float32",
+            "crs": CRS.from_wkt(crs_wkt) if crs_wkt else None, "transform": Affine(*self.file.attrs["transform"]),
+            "nodata": np.nan, "compress": "deflate", "tiled": True, "blockxsize": 256, "blockysize": 256,
+        }
+
+    def _years(self, days: int) -> float:
+        return (days - int(self.file.attrs["t0"])) / DAYS_PER_YEAR
+
+    def _row_blocks(self) -> Iterator[slice]:
+        for row in range(0, self.height, self.block_rows):
+            yield slice(row, min(row + self.block_rows, self.height))
+
+    def _update_stats(self, rows: slice, t: float, values: np.ndarray) -> None:
+        stats = self.file["stats"]
+        valid = np.isfinite(values)
+        v = np.where(valid, values, 0).astype(np.float64)
+        stats["count"][rows] += valid.astype(np.uint32)
+        stats["sum_t"][rows] += valid * t
+        stats["sum_tt"][rows] += valid * t * t
+        stats["sum_v"][rows] += v
+        stats["sum_tv"][rows] += v * t
+        # Queda desde o máximo das datas anteriores (NaN -> ignorado pelo fmax)
+        peak = stats["peak"][rows]
+        stats["max_drop"][rows] = np.fmax(stats["max_drop"][rows], peak - values)
+        stats["peak"][rows] = np.fmax(peak, values)
+
+    def append(self, date: str, ndvi: np.ndarray) -> None:
+        """Acrescenta a fatia de uma data (posterior à última do cubo) e atualiza as estatísticas."""
+        days = (datetime.date.fromisoformat(date) - EPOCH).days
+        if len(self) and days <= self.time[-1]:
+            raise ValueError(f"Data {date} não é posterior à última do cubo ({self.dates[-1]})")
+        if ndvi.shape != (self.height, self.width):
+            raise ValueError(f"Dimensões {ndvi.shape} diferentes das do cubo {(self.height, self.width)}")
+
+        n = len(self)
+        if n == 0:
+            self.file.attrs["t0"] = days
+        self.ndvi.resize(n + 1, axis=0)
+        self.ndvi[n] = ndvi
+        t = self._years(days)
+        for rows in self._row_blocks():
+            self._update_stats(rows, t, ndvi[rows])
+
+        self.time.resize(n + 1, axis=0)
+        self.time[n] = days
+        self.file.flush()
+
+    def rebuild_stats(self) -> None:
+        """Recalcula as estatísticas a partir de todas as fatias (só para recuperar de uma interrupção)."""
+        stats = self.file["stats"]
+        for name in STATS:
+            stats[name][...] = np.nan if name == "peak" else 0
+        for i, days in enumerate(self.time[:]):
+            t = self._years(int(days))
+            for rows in self._row_blocks():
+                self._update_stats(rows, t, self.ndvi[i, rows])
+
+    def slope(self, rows: slice = slice(None)) -> np.ndarray:
+        """Declive da regressão linear do NDVI (por ano); NaN com menos de duas observações."""
+        stats = self.file["stats"]
+        n = stats["count"][rows].astype(np.float64)
+        sum_t, sum_v = stats["sum_t"][rows], stats["sum_v"][rows]
+        denominator = n * stats["sum_tt"][rows] - sum_t ** 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = (n * stats["sum_tv"][rows] - sum_t * sum_v) / denominator
+        slope[(n < 2) | (np.abs(denominator) < 1e-12)] = np.nan
+        return slope.astype(np.float32)
+
+    def max_drop(self, rows: slice = slice(None)) -> np.ndarray:
+        """Maior queda do NDVI face a um máximo anterior; NaN sem observações."""
+        stats = self.file["stats"]
+        drop = stats["max_drop"][rows].astype(np.float32)
+        drop[stats["count"][rows] == 0] = np.nan
+        return drop
+
+    def write_trends(self, slope_path: str, max_drop_path: str) -> Dict[str, str]:
+        """GeoTIFFs do declive e da maior queda, escritos por faixas de linhas."""
+        with rasterio.open(slope_path, "w", **self.profile) as slope_dst, \
+                rasterio.open(max_drop_path, "w", **self.profile) as drop_dst:
+            for rows in self._row_blocks():
+                window = Window(0, rows.start, self.width, rows.stop - rows.start)
+                slope_dst.write(self.slope(rows), 1, window=window)
+                drop_dst.write(self.max_drop(rows), 1, window=window)
+        return {"slope": slope_path, "max_drop": max_drop_path}
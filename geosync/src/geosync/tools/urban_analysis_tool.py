@@ -1,112 +1,419 @@
 import numpy as np
 import cv2
 import os
-import onnxruntime as ort
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.transform import Affine
 from PIL import Image
 from pydantic import BaseModel, PrivateAttr
 from crewai.tools import BaseTool
+from geosync.jobs import JobWorkspace
+from geosync.tools import footprints, model_runtime
+from geosync.tools.raster_stats import RasterStats, describe
+from geosync.tools.tiled_segmentation import (DEFAULT_OVERLAP, SlidingWindowSegmenter, open_raster,
+                                              read_decimated, write_new_mask)
+
+# Número máximo de imagens por chamada ao modelo (o SegFormer é exportado com batch dinâmico)
+DEFAULT_MAX_BATCH = 8
+
+INPUT_SIZE = 512
+MASK_SIZE = 256
+
+# Normalização ImageNet usada no treino do SegFormer
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# "resize": imagem inteira reduzida a 512x512 e máscara de 256x256 (comportamento original);
+# "tiled": janelas deslizantes de 512 à resolução nativa, com máscara georreferenciada
+DEFAULT_SEGMENTATION_MODE = "resize"
+
+# Lado máximo (píxeis) das pré-visualizações do modo "tiled"
+DEFAULT_PREVIEW_MAX_PX = 2048
+
+BUILDING_CLASS_INDEX = 0
+
+# Percentis do estiramento das bandas em bruto para RGB uint8 (os das pré-visualizações do analisador)
+STRETCH_PERCENTILES = (2, 98)
+
+GEOTIFF_EXTENSIONS = (".tif", ".tiff")
+
+# Imagem de entrada: caminho (GeoTIFF com as bandas B4/B3/B2 ou PNG/JPEG) ou array (altura, largura, 3)
+ImageInput = Union[str, np.ndarray]
 
 class UrbanGrowthInput(BaseModel):
     image_path_1: str
     image_path_2: str
+    job_dir: Optional[str] = None
 
 class UrbanGrowthAnalyzerTool(BaseTool):
     name: str = "Urban Growth Analyzer"
-    description: str = "Detects and counts new buildings between two satellite images using a SegFormer model."
+    description: str = ("Detects and counts new buildings between two satellite images using a SegFormer model. "
+                        "Accepts the georeferenced RGB GeoTIFFs (B4/B3/B2) of the difference analyzer or PNG images.")
     args_schema: type = UrbanGrowthInput
     
     _model: any = PrivateAttr()
     _input_name: str = PrivateAttr()
     _output_name: str = PrivateAttr()
+    _max_batch: int = PrivateAttr()
+    _preprocess_workers: int = PrivateAttr()
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # Carregar o modelo ONNX
+        # Carregar o modelo ONNX (FP32 ou uma variante INT8), com as opções de
+        # config/model_runtime.yaml (threads, otimizações do grafo, cache do grafo otimizado)
+        config = model_runtime.ModelRuntimeConfig.load()
         model_path = os.path.join(os.path.dirname(__file__), "../models/segformer_dynamic.onnx")
-        self._model = ort.InferenceSession(model_path)
+        model_path = model_runtime.resolve_model_path(model_path, config.model_variant)
+        print(f"[URBAN] Modelo: {model_path}")
+        self._model = model_runtime.create_session(model_path, config)
         self._input_name = self._model.get_inputs()[0].name
         self._output_name = self._model.get_outputs()[0].name
 
-    def preprocess_image(self, image_path):
-        # Carregar a imagem
-        img = Image.open(image_path).convert("RGB")
-        img = img.resize((512, 512))  # Ajuste para o tamanho esperado pelo SegFormer
-        
-        img_np = np.array(img, dtype=np.float32) / 255.0
+        # Batch máximo: GEOSYNC_SEGMENTATION_BATCH, limitado pelo modelo se o eixo do batch for fixo
+        self._max_batch = max(1, int(os.getenv("GEOSYNC_SEGMENTATION_BATCH", DEFAULT_MAX_BATCH)))
+        batch_dim = self._model.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim > 0:
+            self._max_batch = min(self._max_batch, batch_dim)
+        self._preprocess_workers = max(1, int(os.getenv("GEOSYNC_PREPROCESS_WORKERS", min(4, os.cpu_count() or 1))))
 
-        mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
-        std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
-        img_np = (img_np - mean) / std
+    def stretch(self, rgb: np.ndarray, limits: Sequence[Tuple[float, float]]) -> np.ndarray:
+        """Bandas (altura, largura, 3) em bruto -> RGB uint8, com os limites (mín., máx.) de cada banda."""
+        out = np.empty(rgb.shape, dtype=np.uint8)
+        for i, (low, high) in enumerate(limits):
+            scaled = rgb[..., i].astype(np.float32)
+            scaled -= low
+            scaled *= 255.0 / max(high - low, 1e-6)
+            np.clip(scaled, 0, 255, out=scaled)
+            out[..., i] = scaled + 0.5
+        return out
 
-        img_np = np.transpose(img_np, (2, 0, 1))
-        img_np = np.expand_dims(img_np, axis=0)
+    def array_limits(self, rgb: np.ndarray) -> List[Tuple[float, float]]:
+        low, high = STRETCH_PERCENTILES
+        limits = []
+        for i in range(3):
+            stats = describe(rgb[..., i], STRETCH_PERCENTILES)
+            limits.append((stats[f"p{low}"], stats[f"p{high}"]))
+        return limits
 
-        img_np = img_np.astype(np.float32)
+    def raster_limits(self, src: rasterio.io.DatasetReader) -> Optional[List[Tuple[float, float]]]:
+        """
+        Limites do estiramento de um GeoTIFF, calculados bloco a bloco (histograma exato para
+        bandas de 8/16 bits), sem carregar o raster. None se as bandas já forem RGB uint8.
+        """
+        if all(dtype == "uint8" for dtype in src.dtypes[:3]):
+            return None
+        limits = []
+        for band in (1, 2, 3):
+            dtype = np.dtype(src.dtypes[band - 1])
+            if dtype.kind not in "ui" or dtype.itemsize > 2:
+                stats = describe(src.read(band), STRETCH_PERCENTILES)
+                limits.append((stats[f"p{STRETCH_PERCENTILES[0]}"], stats[f"p{STRETCH_PERCENTILES[1]}"]))
+                continue
+            stats = RasterStats(dtype=dtype)
+            for _, window in src.block_windows(band):
+                stats.update(src.read(band, window=window))
+            percentiles = stats.percentiles(STRETCH_PERCENTILES)
+            limits.append((percentiles[STRETCH_PERCENTILES[0]], percentiles[STRETCH_PERCENTILES[1]]))
+        return limits
 
-        return img_np, img.size     
+    def load_rgb(self, image: ImageInput) -> Tuple[np.ndarray, Optional[dict]]:
+        """
+        Descodifica uma imagem uma única vez: (RGB uint8 (altura, largura, 3), georreferência).
 
-    def segment_buildings(self, image_path):
-        # Pré-processar a imagem
-        input_data, original_size = self.preprocess_image(image_path)
-        
-        # Executar inferência com o modelo ONNX
-        outputs = self._model.run([self._output_name], {self._input_name: input_data})
-        
-        # Processar a saída para obter a máscara binária de construções
-        logits = outputs[0]
+        Aceita as bandas B4/B3/B2 do analisador em memória ou em GeoTIFF (em bruto, estiradas
+        aqui; o GeoTIFF mantém o crs e o transform), ou uma imagem PNG/JPEG (sem georreferência).
+        """
+        georef = None
+        if isinstance(image, np.ndarray):
+            rgb = image
+        elif image.lower().endswith(GEOTIFF_EXTENSIONS):
+            with open_raster(image) as src:
+                rgb = np.moveaxis(src.read([1, 2, 3]), 0, -1)
+                if src.crs is not None:
+                    georef = {"crs": src.crs, "transform": src.transform}
+        else:
+            return np.asarray(Image.open(image).convert("RGB")), None
+
+        if rgb.dtype != np.uint8:
+            rgb = self.stretch(rgb, self.array_limits(rgb))
+        return rgb, georef
+
+    def preprocess_image(self, image: ImageInput):
+        # Carregar a imagem (caminho ou RGB uint8 já descodificado)
+        rgb = image if isinstance(image, np.ndarray) and image.dtype == np.uint8 else self.load_rgb(image)[0]
+        img = Image.fromarray(np.ascontiguousarray(rgb))
+        original_size = img.size
+        img = img.resize((INPUT_SIZE, INPUT_SIZE))  # Ajuste para o tamanho esperado pelo SegFormer
         
-        if len(logits.shape) == 4:  # [batch, num_classes, height, width]
-            building_class_index = 0 
-            pred_mask = logits[0, building_class_index]
+        img_np = self.normalize(np.array(img)[np.newaxis])
+
+        return img_np, original_size     
+
+    def normalize(self, images: np.ndarray) -> np.ndarray:
+        """Batch (N, altura, largura, 3) uint8 -> tensor (N, 3, altura, largura) normalizado."""
+        batch = images.astype(np.float32) / 255.0
+        batch -= MEAN
+        batch /= STD
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+    def postprocess_mask(self, logits: np.ndarray) -> np.ndarray:
+        """Máscara binária de construções (256x256) a partir da saída do modelo para uma imagem."""
+        if logits.ndim == 3:  # [num_classes, height, width]
+            pred_mask = logits[BUILDING_CLASS_INDEX]
         else:  # Se já for uma máscara binária
-            pred_mask = logits[0, 0]
-        
+            pred_mask = logits
+
         # Converter para máscara binária e redimensionar para 256x256
         pred_mask = (pred_mask > 0.5).astype(np.uint8)
-        pred_mask = cv2.resize(pred_mask, (256, 256), interpolation=cv2.INTER_NEAREST)
-        
-        return pred_mask
+        return cv2.resize(pred_mask, (MASK_SIZE, MASK_SIZE), interpolation=cv2.INTER_NEAREST)
 
-    def _run(self, image_path_1: str, image_path_2: str) -> str:
-        mask1 = self.segment_buildings(image_path_1)
-        mask2 = self.segment_buildings(image_path_2)
+    def iter_batches(self, image_paths: Sequence[ImageInput], max_batch: int) -> Iterator[np.ndarray]:
+        """
+        Devolve as imagens pré-processadas em batches (N, 3, 512, 512).
 
-        # Conta polígonos (construções) usando OpenCV
-        mask1_uint8 = (mask1 * 255).astype(np.uint8)
-        mask2_uint8 = (mask2 * 255).astype(np.uint8)
-        
-        contours1, _ = cv2.findContours(mask1_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours2, _ = cv2.findContours(mask2_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        n_buildings_1 = len(contours1)
-        n_buildings_2 = len(contours2)
-        new_buildings = n_buildings_2 - n_buildings_1
+        O pré-processamento corre num pool de threads (GEOSYNC_PREPROCESS_WORKERS) com, no
+        máximo, dois batches de avanço: enquanto o modelo processa um batch, o seguinte já
+        está a ser preparado, sem carregar todas as imagens em memória.
+        """
+        with ThreadPoolExecutor(max_workers=self._preprocess_workers) as executor:
+            paths = iter(image_paths)
+            pending = deque()
+            batch = []
+            while True:
+                while len(pending) < 2 * max_batch:
+                    path = next(paths, None)
+                    if path is None:
+                        break
+                    pending.append(executor.submit(self.preprocess_image, path))
+                if not pending:
+                    break
+                batch.append(pending.popleft().result()[0])
+                if len(batch) == max_batch:
+                    yield np.concatenate(batch)
+                    batch = []
+            if batch:
+                yield np.concatenate(batch)
+
+    def segment_images(self, image_paths: Sequence[ImageInput], max_batch: Optional[int] = None
+                       ) -> Tuple[List[np.ndarray], float]:
+        """
+        Segmenta várias imagens (as duas datas ou, em modo multi-local, muitas) com
+        inferência em batch: uma única chamada ao modelo por cada `max_batch` imagens.
+        As imagens podem ser caminhos ou arrays RGB já descodificados.
+
+        Returns:
+            (máscaras na ordem das imagens, débito total em imagens/s)
+        """
+        max_batch = min(max_batch or self._max_batch, self._max_batch)
+        masks = []
+        inference_time = 0.0
+        start = time.perf_counter()
+        for batch in self.iter_batches(image_paths, max_batch):
+            batch_start = time.perf_counter()
+            logits = self._model.run([self._output_name], {self._input_name: batch})[0]
+            inference_time += time.perf_counter() - batch_start
+            masks.extend(self.postprocess_mask(item) for item in logits)
+        elapsed = time.perf_counter() - start
+
+        images_per_second = len(masks) / elapsed if elapsed > 0 else 0.0
+        inference_rate = len(masks) / inference_time if inference_time > 0 else 0.0
+        print(f"[URBAN] {len(masks)} imagens segmentadas (batch máximo {max_batch}): "
+              f"{images_per_second:.2f} imagens/s no total, {inference_rate:.2f} imagens/s na inferência")
+        return masks, images_per_second
+
+    def predict_scores(self, tiles: np.ndarray) -> np.ndarray:
+        """
+        Pontuações da classe construção (N, altura, largura) para um batch de tiles uint8,
+        com as saídas do modelo (1/4 da resolução no SegFormer) reamostradas para o tile.
+        """
+        logits = self._model.run([self._output_name], {self._input_name: self.normalize(tiles)})[0]
+        if logits.ndim == 4:  # [batch, num_classes, height, width]
+            logits = logits[:, BUILDING_CLASS_INDEX]
+        height, width = tiles.shape[1:3]
+        return np.stack([cv2.resize(item, (width, height), interpolation=cv2.INTER_LINEAR) for item in logits])
+
+    def write_mask(self, mask: np.ndarray, georef: Optional[dict], source_shape: Tuple[int, int],
+                   output_path: str) -> None:
+        """Guarda uma máscara como GeoTIFF nas coordenadas da imagem de origem (escalada para a máscara)."""
+        profile = {"driver": "GTiff", "width": mask.shape[1], "height": mask.shape[0], "count": 1,
+                   "dtype": "uint8", "compress": "deflate"}
+        if georef is not None:
+            scale = Affine.scale(source_shape[1] / mask.shape[1], source_shape[0] / mask.shape[0])
+            profile.update(crs=georef["crs"], transform=georef["transform"] * scale)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(output_path, "w", **profile) as dst:
+                dst.write(mask.astype(np.uint8), 1)
+
+    def segment_tiled(self, image_path: str, output_path: str) -> float:
+        """
+        Segmenta uma imagem à resolução nativa por janelas deslizantes (tiles de 512 com
+        sobreposição GEOSYNC_SEGMENTATION_OVERLAP) e escreve a máscara georreferenciada.
+
+        Returns:
+            Débito em tiles/s
+        """
+        with open_raster(image_path) as src:
+            limits = self.raster_limits(src)
+        segmenter = SlidingWindowSegmenter(
+            self.predict_scores,
+            tile_size=INPUT_SIZE,
+            overlap=int(os.getenv("GEOSYNC_SEGMENTATION_OVERLAP", DEFAULT_OVERLAP)),
+            max_batch=self._max_batch,
+            tile_transform=(lambda tile: self.stretch(tile, limits)) if limits else None,
+        )
+        start = time.perf_counter()
+        info = segmenter.segment(image_path, output_path)
+        elapsed = time.perf_counter() - start
+        tiles_per_second = info["tiles"] / elapsed if elapsed > 0 else 0.0
+        print(f"[URBAN] {image_path}: {info['width']}x{info['height']} em {info['tiles']} tiles, "
+              f"{tiles_per_second:.2f} tiles/s")
+        return tiles_per_second
+
+    def draw_buildings(self, image_path: str, mask_path: str, output_path: str, max_size: int) -> None:
+        """Pré-visualização (reduzida) da imagem com os contornos das construções a vermelho."""
+        rgb = read_decimated(image_path, max_size, [1, 2, 3])
+        if rgb.dtype != np.uint8:
+            with open_raster(image_path) as src:
+                rgb = self.stretch(rgb, self.raster_limits(src))
+        image = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2BGR)
+        mask = read_decimated(mask_path, max_size)
+        contours, _ = cv2.findContours((mask > 0).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(image, contours, -1, (0, 0, 255), 2)
+        cv2.imwrite(output_path, image)
+
+    def extract_footprints(self, mask_path_1: str, mask_path_2: str, workspace: JobWorkspace) -> dict:
+        """
+        Vetoriza as máscaras das duas datas e emparelha as construções (novas, demolidas e
+        inalteradas); os footprints ficam em buildings_footprints.parquet (e .fgb).
+        """
+        comparison = footprints.compare_masks(mask_path_1, mask_path_2)
+        paths = {}
+        for fmt in footprints.output_formats():
+            name = f"buildings_footprints.{fmt}"
+            with workspace.artifact(name) as tmp_path:
+                comparison.write(tmp_path, fmt)
+            paths[fmt] = os.path.abspath(workspace.output_path(name))
+
+        counts = comparison.counts
+        return {
+            "Edifícios na data 1": counts["first"],
+            "Edifícios na data 2": counts["second"],
+            "Novas construções": counts[footprints.NEW],
+            "Construções demolidas": counts[footprints.DEMOLISHED],
+            "Construções inalteradas": counts[footprints.UNCHANGED],
+            "Footprints das construções": paths,
+        }
+
+    def analyze_tiled(self, image_path_1: str, image_path_2: str, workspace: JobWorkspace) -> dict:
+        """
+        Modo "tiled": máscaras à resolução nativa (GeoTIFF com a georreferência das imagens),
+        contagem de construções faixa a faixa e pré-visualizações reduzidas.
+        """
+        rates = []
+        for name, image_path in (("buildings_mask_first.tif", image_path_1), ("buildings_mask_second.tif", image_path_2)):
+            with workspace.artifact(name) as tmp_path:
+                rates.append(self.segment_tiled(image_path, tmp_path))
+        mask1 = workspace.output_path("buildings_mask_first.tif")
+        mask2 = workspace.output_path("buildings_mask_second.tif")
+        buildings = self.extract_footprints(mask1, mask2, workspace)
+
+        with workspace.artifact("new_buildings_diff.tif") as tmp_path:
+            write_new_mask(mask1, mask2, tmp_path)
+
+        max_size = int(os.getenv("GEOSYNC_PREVIEW_MAX_PX", DEFAULT_PREVIEW_MAX_PX))
+        with workspace.artifact("new_buildings_diff.png") as tmp_path:
+            diff_preview = read_decimated(workspace.output_path("new_buildings_diff.tif"), max_size)
+            Image.fromarray((diff_preview > 0).astype(np.uint8) * 255).save(tmp_path)
+        with workspace.artifact("buildings_detected_first_image.png") as tmp_path:
+            self.draw_buildings(image_path_1, mask1, tmp_path, max_size)
+        with workspace.artifact("buildings_detected_second_image.png") as tmp_path:
+            self.draw_buildings(image_path_2, mask2, tmp_path, max_size)
+        workspace.cleanup_tmp()
+
+        return {
+            **buildings,
+            "Imagem de diferença guardada em": os.path.abspath(workspace.output_path("new_buildings_diff.png")),
+            "Edifícios identificados na primeira imagem": os.path.abspath(workspace.output_path("buildings_detected_first_image.png")),
+            "Edifícios identificados na segunda imagem": os.path.abspath(workspace.output_path("buildings_detected_second_image.png")),
+            "Máscara de construções na data 1": os.path.abspath(mask1),
+            "Máscara de construções na data 2": os.path.abspath(mask2),
+            "Máscara de novas construções": os.path.abspath(workspace.output_path("new_buildings_diff.tif")),
+            # No modo "tiled", cada imagem do modelo é um tile
+            "Imagens por segundo": round(sum(rates) / len(rates), 2)
+        }
+
+    def segment_buildings(self, image_path):
+        """Segmenta uma única imagem (ver segment_images para várias)."""
+        return self.segment_images([image_path])[0][0]
+
+    def _run(self, image_path_1: str, image_path_2: str, job_dir: Optional[str] = None) -> str:
+        # Os resultados ficam no diretório do pedido que produziu as imagens (ou num novo)
+        if job_dir:
+            workspace = JobWorkspace.from_dir(job_dir)
+        else:
+            workspace = JobWorkspace.for_artifact(image_path_1) or JobWorkspace()
+
+        if os.getenv("GEOSYNC_SEGMENTATION_MODE", DEFAULT_SEGMENTATION_MODE).lower() == "tiled":
+            return self.analyze_tiled(image_path_1, image_path_2, workspace)
+
+        # Cada imagem é descodificada uma única vez e reutilizada na segmentação e nos contornos
+        (rgb1, georef1), (rgb2, georef2) = self.load_rgb(image_path_1), self.load_rgb(image_path_2)
+
+        # As duas datas seguem num único batch
+        (mask1, mask2), images_per_second = self.segment_images([rgb1, rgb2])
+
+        # Contornos para as imagens de pré-visualização
+        contours1, _ = cv2.findContours(mask1.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours2, _ = cv2.findContours(mask2.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
         # Imagem de diferença
         diff_mask = (mask2.astype(int) - mask1.astype(int)) > 0
-        os.makedirs("output", exist_ok=True)
-        diff_img_path = os.path.join(os.getcwd(), "output", "new_buildings_diff.png")
-        Image.fromarray((diff_mask * 255).astype(np.uint8)).save(diff_img_path)
+
+        with workspace.artifact("new_buildings_diff.png") as tmp_path:
+            Image.fromarray((diff_mask * 255).astype(np.uint8)).save(tmp_path)
+
+        # Máscaras georreferenciadas (nas coordenadas do GeoTIFF de entrada, se o houver)
+        with workspace.artifact("buildings_mask_first.tif") as tmp_path:
+            self.write_mask(mask1, georef1, rgb1.shape[:2], tmp_path)
+        with workspace.artifact("buildings_mask_second.tif") as tmp_path:
+            self.write_mask(mask2, georef2, rgb2.shape[:2], tmp_path)
+        with workspace.artifact("new_buildings_diff.tif") as tmp_path:
+            self.write_mask(diff_mask, georef2, rgb2.shape[:2], tmp_path)
+
+        # Construções contadas e emparelhadas pelos footprints (não pela diferença de contagens)
+        buildings = self.extract_footprints(workspace.output_path("buildings_mask_first.tif"),
+                                            workspace.output_path("buildings_mask_second.tif"), workspace)
 
         # Guardar imagens originais com contornos desenhados
-        orig1 = cv2.imread(image_path_1)
-        orig2 = cv2.imread(image_path_2)
-        # Redimensionar para 256x256 para coincidir com a máscara
-        orig1 = cv2.resize(orig1, (256, 256))
-        orig2 = cv2.resize(orig2, (256, 256))
+        # Redimensionar para 256x256 para coincidir com a máscara (o OpenCV usa BGR)
+        orig1 = cv2.cvtColor(cv2.resize(rgb1, (MASK_SIZE, MASK_SIZE)), cv2.COLOR_RGB2BGR)
+        orig2 = cv2.cvtColor(cv2.resize(rgb2, (MASK_SIZE, MASK_SIZE)), cv2.COLOR_RGB2BGR)
         # Desenhar contornos a vermelho
         cv2.drawContours(orig1, contours1, -1, (0, 0, 255), 2)
         cv2.drawContours(orig2, contours2, -1, (0, 0, 255), 2)
-        buildings_img1_path = os.path.join(os.getcwd(), "output", "buildings_detected_first_image.png")
-        buildings_img2_path = os.path.join(os.getcwd(), "output", "buildings_detected_second_image.png")
-        cv2.imwrite(buildings_img1_path, orig1)
-        cv2.imwrite(buildings_img2_path, orig2)
+        with workspace.artifact("buildings_detected_first_image.png") as tmp_path:
+            cv2.imwrite(tmp_path, orig1)
+        with workspace.artifact("buildings_detected_second_image.png") as tmp_path:
+            cv2.imwrite(tmp_path, orig2)
+        workspace.cleanup_tmp()
+
+        diff_img_path = os.path.abspath(workspace.output_path("new_buildings_diff.png"))
+        buildings_img1_path = os.path.abspath(workspace.output_path("buildings_detected_first_image.png"))
+        buildings_img2_path = os.path.abspath(workspace.output_path("buildings_detected_second_image.png"))
 
         return {
-            "Edifícios na data 1": n_buildings_1,
-            "Edifícios na data 2": n_buildings_2,
-            "Novas construções": new_buildings,
+            **buildings,
             "Imagem de diferença guardada em": diff_img_path,
             "Edifícios identificados na primeira imagem": buildings_img1_path,
-            "Edifícios identificados na segunda imagem": buildings_img2_path
+            "Edifícios identificados na segunda imagem": buildings_img2_path,
+            "Máscara de construções na data 1": os.path.abspath(workspace.output_path("buildings_mask_first.tif")),
+            "Máscara de construções na data 2": os.path.abspath(workspace.output_path("buildings_mask_second.tif")),
+            "Máscara de novas construções": os.path.abspath(workspace.output_path("new_buildings_diff.tif")),
+            "Imagens por segundo": round(images_per_second, 2)
         }
\ No newline at end of file
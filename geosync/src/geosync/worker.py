@@ -0,0 +1,238 @@
+"""
+Long-lived worker service for the Rust API.
+
+Instead of spawning a new interpreter per request, the API connects to a local Unix
+socket and sends one JSON line per request. Requests are executed by a pool of worker
+processes that keep the tools (ONNX model, Earth Engine session) warm between calls.
+
+Protocol (one JSON object per line, in both directions):
+    request:  the same payload accepted by main.run, e.g. {"address": ..., "mode": "pipeline"}
+              or {"op": "ping"} for a health check
+    response: {"ok": true, "result": {...}}
+              {"ok": false, "error": "...", "busy": true}   when the queue is full
+              {"ok": false, "error": "..."}                 when the request failed
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+DEFAULT_SOCKET = "/tmp/geosync.sock"
+
+# Estado de cada processo worker, criado uma única vez pelo initializer do pool
+_pipeline = None
+
+
+def _init_worker(warm_urban_growth: bool = True) -> None:
+    """Loads the tools once per worker process so requests don't pay the start-up cost."""
+    global _pipeline
+    from geosync.pipeline import GeosyncPipeline
+    from geosync.tools.earthengine_tool import initialize_earth_engine
+
+    _pipeline = GeosyncPipeline()
+    if warm_urban_growth:
+        try:
+            _pipeline.urban_analyzer
+        except Exception as e:
+            print(f"[WORKER] Não foi possível carregar o modelo ONNX: {e}", file=sys.stderr)
+    try:
+        initialize_earth_engine()
+    except Exception as e:
+        print(f"[WORKER] Earth Engine não inicializado: {e}", file=sys.stderr)
+    print(f"[WORKER] Processo {os.getpid()} pronto", file=sys.stderr)
+
+
+def _worker_pid(hold: float = 1.0) -> int:
+    # Mantém o processo ocupado para que cada tarefa de aquecimento caia num worker diferente
+    time.sleep(hold)
+    return os.getpid()
+
+
+def _collect_crew_output(crew_output) -> Dict[str, Any]:
+    """Merges the JSON outputs of every crew task, as the API used to read them from stdout."""
+    result: Dict[str, Any] = {"raw": crew_output.raw}
+    for task_output in crew_output.tasks_output:
+        try:
+            data = json.loads(task_output.raw)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(data, dict):
+            result.update(data)
+    return result
+
+
+def _handle(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs a single request inside a worker process."""
+    if inputs.get("mode", "crew") == "pipeline":
+        from geosync.pipeline import run_report
+
+        result = _pipeline.run(
+            address=inputs["address"],
+            first_date=inputs["first_date"],
+            second_date=inputs["second_date"],
+            indices=inputs.get("indices"),
+        )
+        if inputs.get("report"):
+            result.report = run_report(result)
+        return result.to_output()
+
+    if inputs.get("mode") == "timeseries":
+        from geosync.tools.timeseries import DEFAULT_CADENCE_DAYS
+
+        return _pipeline.timeseries(
+            address=inputs["address"],
+            start_date=inputs["first_date"],
+            end_date=inputs["second_date"],
+            cadence_days=int(inputs.get("cadence_days", DEFAULT_CADENCE_DAYS)),
+        ).model_dump()
+
+    from geosync.crew import Geosync
+
+    return _collect_crew_output(Geosync().crew().kickoff(inputs=inputs))
+
+
+class WorkerPool:
+    """
+    Pool of warm worker processes with a bounded queue. When `workers + queue_size`
+    requests are already in flight, new requests are rejected immediately (backpressure)
+    instead of piling up.
+    """
+
+    def __init__(self, workers: int = 1, queue_size: int = 4, warm_urban_growth: bool = True):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.warm_urban_growth = warm_urban_growth
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._restart_lock = threading.Lock()
+        # Pool partido cuja substituição já está a ser preparada (ver _restart)
+        self._replacing: Optional[ProcessPoolExecutor] = None
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.warm_urban_growth,),
+        )
+
+    def warm_up(self, executor: Optional[ProcessPoolExecutor] = None) -> None:
+        """Starts every worker process up front so the first requests don't load the models."""
+        executor = executor or self._executor
+        futures = [executor.submit(_worker_pid) for _ in range(self.workers)]
+        pids = {future.result() for future in futures}
+        print(f"[WORKER] {len(pids)} processos iniciados", file=sys.stderr)
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Replaces a pool left broken by a dead worker (OOM kill, native crash in GDAL/ORT):
+        a ProcessPoolExecutor never recovers, so every later request would fail otherwise.
+
+        The replacement is built and warmed outside the lock, so the other requests that hit
+        the dead pool return straight away instead of waiting for the models to load.
+        """
+        with self._restart_lock:
+            # Vários pedidos podem falhar com o mesmo pool; só o primeiro o substitui
+            if self._executor is not broken or self._replacing is broken:
+                return
+            self._replacing = broken
+        print("[WORKER] Um processo worker morreu; a recriar o pool", file=sys.stderr)
+        broken.shutdown(wait=False, cancel_futures=True)
+        executor = self._new_executor()
+        try:
+            self.warm_up(executor)
+        except Exception as e:
+            print(f"[WORKER] Falha ao aquecer o novo pool: {e}", file=sys.stderr)
+        with self._restart_lock:
+            self._executor = executor
+            self._replacing = None
+
+    def submit(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if inputs.get("op") == "ping":
+            return {"ok": True, "result": {"pong": True, "workers": self.workers}}
+
+        if not self._slots.acquire(blocking=False):
+            return {"ok": False, "busy": True, "error": "Worker queue is full, try again later."}
+        executor = self._executor
+        try:
+            result = executor.submit(_handle, inputs).result()
+            return {"ok": True, "result": result}
+        except BrokenProcessPool as e:
+            # O pedido em curso perde-se, mas os seguintes já vão para um pool novo
+            self._restart(executor)
+            return {"ok": False, "error": f"Worker process died: {e}"}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Uma ligação pode enviar vários pedidos, um por linha
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                inputs = json.loads(line)
+            except ValueError as e:
+                response = {"ok": False, "error": f"Invalid JSON request: {e}"}
+            else:
+                response = self.server.pool.submit(inputs)
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, pool: WorkerPool):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        self.socket_path = socket_path
+        self.pool = pool
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def serve(argv: Optional[list] = None) -> None:
+    """Start the worker service (configurable through flags or GEOSYNC_WORKER_* env vars)."""
+    parser = argparse.ArgumentParser(description="Geosync worker service")
+    parser.add_argument("--socket", default=os.getenv("GEOSYNC_WORKER_SOCKET", DEFAULT_SOCKET))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("GEOSYNC_WORKERS", "1")))
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv("GEOSYNC_WORKER_QUEUE", "4")))
+    parser.add_argument("--no-urban-growth", action="store_true",
+                        help="Do not preload the ONNX segmentation model")
+    args = parser.parse_args(argv)
+
+    pool = WorkerPool(args.workers, args.queue_size, warm_urban_growth=not args.no_urban_growth)
+    pool.warm_up()
+    server = WorkerServer(args.socket, pool)
+    print(f"[WORKER] A escutar em {args.socket} com {args.workers} workers "
+          f"(fila: {args.queue_size})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,147 @@
+# tests/test_batch.py
+import csv
+import json
+from collections import Counter
+
+import pytest
+
+from geosync.batch import BatchRunner, Site, load_sites
+from geosync.pipeline import GeocodeResult, GeosyncPipeline
+from geosync.tools.earthengine_tool import DEFAULT_SCALE, DEFAULT_SNAP_PIXELS
+from geosync.tools.tile_cache import snap_to_grid
+
+COORDINATES = {
+    "Largo dos Colegiais, Évora": (38.5731, -7.9063),
+    "Praça do Giraldo, Évora": (38.5714, -7.9093),
+    # A poucos metros do Largo dos Colegiais: mesma célula da ROI
+    "Colégio do Espírito Santo, Évora": (38.5732, -7.9062),
+}
+
+calls = Counter()
+
+
+class FakeGeocoder:
+    def _run(self, address):
+        calls["geocode"] += 1
+        if address not in COORDINATES:
+            return json.dumps({"error": "Address not found."})
+        lat, lon = COORDINATES[address]
+        return {"lat": lat, "lon": lon}
+
+
+class FakeFetcher:
+    def _run(self, lat, lon, first_date, second_date, fetch_mode, indices=None):
+        calls["fetch"] += 1
+        return {
+            "first_date_images": {"FULL": f"raw_images/{lat}_{lon}_{first_date}.tif"},
+            "second_date_images": {"FULL": f"raw_images/{lat}_{lon}_{second_date}.tif"},
+        }
+
+
+class FakeAnalyzer:
+    def _run(self, first_date_images, second_date_images, bands=None, job_dir=None, indices=None):
+        calls["difference"] += 1
+        return {
+            "image_path_1": f"{job_dir}/output/rgb_antiga.png",
+            "image_path_2": f"{job_dir}/output/rgb_recente.png",
+            "ndvi_antiga": f"{job_dir}/output/ndvi_antiga.png",
+            "ndvi_recente": f"{job_dir}/output/ndvi_recente.png",
+            "ndvi_diff": f"{job_dir}/output/ndvi_diff.png",
+        }
+
+
+class FakeUrbanAnalyzer:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def _run(self, image_path_1, image_path_2, job_dir=None):
+        calls["urban_growth"] += 1
+        if self.fail:
+            raise RuntimeError("modelo indisponível")
+        return {
+            "Edifícios na data 1": 3,
+            "Edifícios na data 2": 5,
+            "Novas construções": 2,
+            "Construções demolidas": 0,
+            "Construções inalteradas": 3,
+            "Imagem de diferença guardada em": "output/new_buildings_diff.png",
+            "Edifícios identificados na primeira imagem": "output/buildings_detected_first_image.png",
+            "Edifícios identificados na segunda imagem": "output/buildings_detected_second_image.png",
+        }
+
+
+def make_pipeline(urban_analyzer=None):
+    return GeosyncPipeline(geocoder=FakeGeocoder(), fetcher=FakeFetcher(), analyzer=FakeAnalyzer(),
+                           urban_analyzer=urban_analyzer or FakeUrbanAnalyzer())
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+
+
+SITES = [
+    Site(site_id="a", address="Largo dos Colegiais, Évora", first_date="2024-04-06", second_date="2024-04-13"),
+    Site(site_id="b", address="largo dos colegiais evora", first_date="2024-04-06", second_date="2024-04-13"),
+    Site(site_id="c", address="Colégio do Espírito Santo, Évora", first_date="2024-04-06", second_date="2024-04-13"),
+    Site(site_id="d", address="Praça do Giraldo, Évora", first_date="2024-04-06", second_date="2024-04-13"),
+    Site(site_id="e", address="Praça do Giraldo, Évora", first_date="2023-04-06", second_date="2024-04-13"),
+    Site(site_id="f", address="Nowhere", first_date="2024-04-06", second_date="2024-04-13"),
+]
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as f:
+        return {row["site_id"]: row for row in csv.DictReader(f)}
+
+
+def test_batch_dedupes_geocodes_and_rois(tmp_path):
+    status = BatchRunner(str(tmp_path), make_pipeline()).run(SITES)
+
+    # 4 moradas normalizadas distintas; 3 ROIs (a/b/c partilham a célula e as datas)
+    assert calls == {"geocode": 4, "fetch": 3, "difference": 3, "urban_growth": 3}
+    assert status["total"] == 6 and status["failed"] == 1 and status["finished"]
+
+    rows = read_results(status["results"])
+    assert list(rows) == ["a", "b", "c", "d", "e", "f"]
+    assert rows["a"]["job_id"] == rows["b"]["job_id"] == rows["c"]["job_id"] != rows["d"]["job_id"]
+    assert rows["d"]["new_buildings"] == "2"
+    assert rows["f"]["status"] == "error" and rows["f"]["failed_stage"] == "geocode"
+
+
+def test_batch_resumes_from_checkpoint(tmp_path):
+    status = BatchRunner(str(tmp_path), make_pipeline(FakeUrbanAnalyzer(fail=True))).run(SITES[:4])
+    assert status["failed"] == 4
+    assert read_results(status["results"])["a"]["failed_stage"] == "urban_growth"
+
+    # Nova execução no mesmo diretório: só a segmentação (que falhou) volta a correr
+    calls.clear()
+    status = BatchRunner(str(tmp_path), make_pipeline()).run(SITES[:4])
+    assert calls == {"urban_growth": 2}
+    assert status["failed"] == 0
+    assert json.loads((tmp_path / "status.json").read_text())["done"] == 4
+
+
+def test_roi_key_uses_the_fetcher_grid(tmp_path):
+    runner = BatchRunner(str(tmp_path), make_pipeline())
+    lat, lon = COORDINATES["Praça do Giraldo, Évora"]
+    cell, key = runner.roi_key(SITES[3], GeocodeResult(lat=lat, lon=lon))
+
+    # A célula com que o fetcher indexa os downloads da mesma morada
+    assert cell == snap_to_grid(lat, lon, DEFAULT_SCALE * DEFAULT_SNAP_PIXELS)[2]
+    assert key == f"{cell}|2024-04-06|2024-04-13|"
+
+
+def test_load_sites_from_csv_and_jsonl(tmp_path):
+    (tmp_path / "sites.csv").write_text(
+        "address,first_date,second_date,indices\n"
+        "\"Largo dos Colegiais, Évora\",2024-04-06,2024-04-13,NDBI;EVI\n"
+        "Praça do Giraldo,2024-04-06,2024-04-13,\n", encoding="utf-8")
+    sites = load_sites(str(tmp_path / "sites.csv"))
+    assert [site.site_id for site in sites] == ["site-1", "site-2"]
+    assert sites[0].indices == ["NDBI", "EVI"] and sites[1].indices is None
+
+    (tmp_path / "sites.jsonl").write_text(
+        json.dumps({"site_id": "evora", "address": "Évora", "first_date": "2024-04-06",
+                    "second_date": "2024-04-13"}) + "\n", encoding="utf-8")
+    assert load_sites(str(tmp_path / "sites.jsonl"))[0].site_id == "evora"
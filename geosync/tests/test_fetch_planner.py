@@ -0,0 +1,35 @@
+# tests/test_fetch_planner.py
+import pytest
+
+from geosync.tools.fetch_planner import plan_fetch
+
+BANDS = ["B2", "B3", "B4", "B8"]
+
+
+def test_small_roi_stays_local_and_large_roi_goes_to_server():
+    """
+    Testa que a latência dos pedidos domina nas ROIs pequenas e a transferência das bandas nas grandes
+    """
+    small = plan_fetch(512, BANDS)
+    assert small.mode == "local"
+    assert small.server_bytes < small.local_bytes
+
+    large = plan_fetch(16384, BANDS, local_tiles=8, server_tiles=8)
+    assert large.mode == "server"
+    assert large.server_seconds < large.local_seconds
+    # Diferença float32 + pré-visualizações 4x reduzidas: menos de metade dos bytes das bandas
+    assert large.server_bytes < large.local_bytes / 2
+
+
+def test_bandwidth_moves_the_break_even(monkeypatch):
+    monkeypatch.setenv("GEOSYNC_FETCH_BANDWIDTH_MBPS", "5")
+    assert plan_fetch(2048, BANDS).mode == "server"
+    monkeypatch.setenv("GEOSYNC_FETCH_BANDWIDTH_MBPS", "1000")
+    assert plan_fetch(2048, BANDS).mode == "local"
+
+
+@pytest.mark.parametrize("kwargs", [{"indices": ["NDVI", "NDBI"]}, {"full_res_rgb": True}])
+def test_server_mode_needs_ndvi_only_and_no_full_res_rgb(kwargs):
+    plan = plan_fetch(16384, BANDS + ["B11"], local_tiles=8, server_tiles=8, **kwargs)
+    assert plan.mode == "local"
+    assert plan.reason
@@ -0,0 +1,98 @@
+# tests/test_footprints.py
+import json
+
+import cv2
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+
+from geosync.tools import footprints
+
+
+def write_mask(path, mask):
+    profile = {"driver": "GTiff", "width": mask.shape[1], "height": mask.shape[0], "count": 1, "dtype": "uint8",
+               "crs": "EPSG:32629", "transform": from_origin(580000, 4270000, 10, 10)}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(mask.astype(np.uint8), 1)
+    return str(path)
+
+
+def test_polygonize_uses_map_coordinates(tmp_path):
+    mask = np.zeros((20, 20), dtype=np.uint8)
+    mask[2:6, 3:8] = 1
+    mask[15, 15] = 1  # ruído, abaixo da área mínima
+
+    result = footprints.polygonize(write_mask(tmp_path / "mask.tif", mask), min_pixels=4)
+
+    assert len(result.polygons) == 1
+    assert result.polygons[0].bounds == pytest.approx((580030, 4269940, 580080, 4269980))
+    assert result.polygons[0].area == pytest.approx(20 * 100)
+    assert result.crs.to_epsg() == 32629
+
+
+def test_polygonize_joins_buildings_across_strips(tmp_path):
+    rng = np.random.default_rng(1)
+    mask = (cv2.GaussianBlur(rng.random((120, 80)).astype(np.float32), (0, 0), 3) > 0.52).astype(np.uint8)
+    path = write_mask(tmp_path / "mask.tif", mask)
+
+    whole = footprints.polygonize(path, min_pixels=1, simplify_pixels=0, strip_rows=mask.shape[0])
+    strips = footprints.polygonize(path, min_pixels=1, simplify_pixels=0, strip_rows=7)
+
+    assert len(whole.polygons) > 5
+    assert shapely.union_all(strips.polygons).equals(shapely.union_all(whole.polygons))
+    assert sorted(round(p.area) for p in strips.polygons) == sorted(round(p.area) for p in whole.polygons)
+
+
+def test_match_footprints_classifies_buildings():
+    kept = shapely.box(0, 0, 10, 10)
+    demolished = shapely.box(50, 50, 60, 60)
+    first = [kept, demolished]
+    # A mesma construção ligeiramente deslocada, uma nova e uma que só toca na antiga
+    second = [shapely.box(1, 0, 11, 10), shapely.box(100, 100, 110, 110), shapely.box(59, 59, 70, 70)]
+
+    first_status, second_status = footprints.match_footprints(first, second, min_iou=0.3)
+
+    assert first_status == [footprints.UNCHANGED, footprints.DEMOLISHED]
+    assert second_status == [footprints.UNCHANGED, footprints.NEW, footprints.NEW]
+
+
+def test_compare_masks_writes_geoparquet(tmp_path):
+    first = np.zeros((40, 40), dtype=np.uint8)
+    first[2:8, 2:8] = 1
+    first[20:26, 20:26] = 1
+    second = first.copy()
+    second[20:26, 20:26] = 0
+    second[30:36, 2:10] = 1
+
+    comparison = footprints.compare_masks(write_mask(tmp_path / "first.tif", first),
+                                          write_mask(tmp_path / "second.tif", second))
+    assert comparison.counts == {"first": 2, "second": 2, "new": 1, "demolished": 1, "unchanged": 1}
+
+    path = comparison.write(str(tmp_path / "footprints.parquet"), "parquet")
+    table = pq.read_table(path)
+    geo = json.loads(table.schema.metadata[b"geo"])
+    assert geo["primary_column"] == "geometry"
+    assert geo["columns"]["geometry"]["encoding"] == "WKB"
+    assert geo["columns"]["geometry"]["crs"]["id"]["code"] == 32629
+
+    rows = table.to_pylist()
+    assert [(row["date"], row["status"]) for row in rows].count(("second", "new")) == 1
+    new = next(row for row in rows if row["status"] == "new")
+    assert new["area_m2"] == pytest.approx(48 * 100)
+    assert shapely.from_wkb(new["geometry"]).bounds == pytest.approx((580020, 4269640, 580100, 4269700))
+
+
+def test_geoparquet_metadata_without_crs_is_explicit_null():
+    metadata = footprints.geoparquet_metadata([shapely.box(0, 0, 1, 1)], None)
+    assert "crs" in metadata["columns"]["geometry"]
+    assert metadata["columns"]["geometry"]["crs"] is None
+
+
+def test_output_formats_skips_flatgeobuf_without_fiona(monkeypatch):
+    monkeypatch.setattr(footprints, "fiona_available", lambda: False)
+    assert footprints.output_formats("parquet,fgb") == ["parquet"]
+    with pytest.raises(ValueError):
+        footprints.output_formats("shp")
@@ -0,0 +1,90 @@
+# tests/test_geocode_cache.py
+import json
+from types import SimpleNamespace
+
+from geosync.tools import geocode_cache
+from geosync.tools.geocode_cache import GeocodeCache, normalize_address
+from geosync.tools.geocoding_tool import GeoapifyTool
+
+
+class FakeSession:
+    """Responde como o Geoapify e regista os pedidos feitos."""
+
+    def __init__(self, known):
+        self.known = known
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(("GET", url, params))
+        if "id" in params:
+            return SimpleNamespace(status_code=200, json=lambda: self.batch)
+        result = self.known.get(params["text"])
+        return SimpleNamespace(status_code=200, json=lambda: {"results": [result] if result else []})
+
+    def post(self, url, params=None, json=None, timeout=None):
+        self.calls.append(("POST", url, json))
+        self.batch = [{"query": {"text": text}, **self.known.get(text, {})} for text in json]
+        return SimpleNamespace(status_code=202, json=lambda: {"id": "job-1"})
+
+
+def make_tool(tmp_path, monkeypatch, known):
+    monkeypatch.setenv("GEOAPIFY_KEY", "test")
+    tool = GeoapifyTool()
+    tool._cache = GeocodeCache(path=str(tmp_path / "geocode.sqlite"))
+    tool._session = FakeSession(known)
+    return tool
+
+
+def test_normalize_address_ignores_case_accents_and_punctuation():
+    assert normalize_address("Praça do Giraldo, Évora") == normalize_address("  praca do   giraldo evora. ")
+
+
+def test_repeated_addresses_hit_the_cache(tmp_path, monkeypatch):
+    tool = make_tool(tmp_path, monkeypatch, {"Praça do Giraldo, Évora": {"lat": 38.57, "lon": -7.91}})
+
+    assert tool._run("Praça do Giraldo, Évora") == {"lat": 38.57, "lon": -7.91}
+    assert tool._run("praca do giraldo evora") == {"lat": 38.57, "lon": -7.91}
+    assert json.loads(tool._run("Nowhere 123"))["error"] == "Address not found."
+    assert json.loads(tool._run("nowhere, 123"))["error"] == "Address not found."
+
+    assert len(tool._session.calls) == 2
+    stats = tool.cache.stats()
+    assert stats["hits"] == 1 and stats["negative_hits"] == 1 and stats["negative_entries"] == 1
+
+
+def test_result_without_coordinates_is_not_found(tmp_path, monkeypatch):
+    tool = make_tool(tmp_path, monkeypatch, {"Rua Sem Sítio": {"formatted": "Rua Sem Sítio"}})
+
+    first = tool._run("Rua Sem Sítio")
+    assert json.loads(first) == {"error": "Address not found."}
+    assert tool._run("Rua Sem Sítio") == first
+    assert len(tool._session.calls) == 1
+
+
+def test_expired_entries_are_fetched_again(tmp_path, monkeypatch):
+    cache = GeocodeCache(path=str(tmp_path / "geocode.sqlite"), ttl=60, negative_ttl=10)
+    cache.put("Évora", {"lat": 38.57, "lon": -7.91})
+    cache.put("Nowhere", None)
+
+    now = geocode_cache.time.time()
+    monkeypatch.setattr(geocode_cache.time, "time", lambda: now + 30)
+    assert cache.get("evora") == {"lat": 38.57, "lon": -7.91}
+    assert cache.get("nowhere") is None  # a cache negativa expira antes
+
+    monkeypatch.setattr(geocode_cache.time, "time", lambda: now + 120)
+    assert cache.get("evora") is None
+
+
+def test_batch_sends_only_unique_uncached_addresses(tmp_path, monkeypatch):
+    known = {"Évora": {"lat": 38.57, "lon": -7.91}, "Lisboa": {"lat": 38.72, "lon": -9.14}}
+    tool = make_tool(tmp_path, monkeypatch, known)
+    tool._run("Évora")
+
+    results = tool.geocode_batch(["evora", "Lisboa", "LISBOA!", "Nowhere"], poll_interval=0)
+
+    posts = [call for call in tool._session.calls if call[0] == "POST"]
+    assert posts == [("POST", "https://api.geoapify.com/v1/batch/geocode/search", ["Lisboa", "Nowhere"])]
+    assert results["evora"] == {"lat": 38.57, "lon": -7.91}
+    assert results["Lisboa"] == results["LISBOA!"] == {"lat": 38.72, "lon": -9.14}
+    assert results["Nowhere"] == {"error": "Address not found."}
+    assert tool.cache.get("lisboa") == {"lat": 38.72, "lon": -9.14}
@@ -1,8 +1,207 @@
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from geosync.tools import renderer
 from geosync.tools.image_difference_analyzer_tool import ImageDifferenceAnalyzerTool
 
+
+def write_multiband(path, bands, seed):
+    """Escreve um GeoTIFF B2/B3/B4/B8 sintético, como o devolvido pelo fetch_mode="geotiff"."""
+    rng = np.random.default_rng(seed)
+    data = rng.integers(200, 4000, size=(len(bands), 64, 64), dtype=np.uint16)
+    with rasterio.open(
+        path, "w", driver="GTiff", width=64, height=64, count=len(bands), dtype="uint16",
+        crs="EPSG:4326", transform=from_origin(-7.92, 38.58, 0.0001, 0.0001),
+    ) as dst:
+        dst.write(data)
+        dst.descriptions = tuple(bands)
+    return str(path)
+
+
+def test_analyze_multiband_geotiff(tmp_path, monkeypatch):
+    """
+    Testa a análise com um GeoTIFF multibanda por data, sem zips nem mesclagem de quadrantes
+    """
+    monkeypatch.chdir(tmp_path)
+    bands = ["B2", "B3", "B4", "B8"]
+    first = write_multiband(tmp_path / "first.tif", bands, seed=1)
+    second = write_multiband(tmp_path / "second.tif", bands, seed=2)
+
+    result = ImageDifferenceAnalyzerTool()._run(
+        first_date_images={"FULL": first},
+        second_date_images={"FULL": second},
+        bands=bands,
+    )
+
+    for key in ("image_path_1", "image_path_2", "ndvi_antiga", "ndvi_recente", "ndvi_diff"):
+        assert os.path.exists(result[key])
+    with rasterio.open(result["index_diff_tif"]) as src:
+        assert src.shape == (64, 64)
+        assert src.descriptions == ("NDVI",)
+    # Bandas RGB em bruto e georreferenciadas, para a segmentação de construções
+    with rasterio.open(result["rgb_tif_1"]) as src, rasterio.open(first) as original:
+        assert src.descriptions == ("B4", "B3", "B2")
+        assert src.transform == original.transform and src.crs == original.crs
+        np.testing.assert_array_equal(src.read(1), original.read(3))
+
+
+def test_extra_indices_in_one_multiband_diff(tmp_path, monkeypatch):
+    """
+    Testa que os índices pedidos (e a banda B11 que exigem) acabam num único GeoTIFF de diferenças
+    """
+    monkeypatch.chdir(tmp_path)
+    bands = ["B2", "B3", "B4", "B8", "B11"]
+    first = write_multiband(tmp_path / "first.tif", bands, seed=1)
+    second = write_multiband(tmp_path / "second.tif", bands, seed=2)
+
+    result = ImageDifferenceAnalyzerTool()._run(
+        first_date_images={"FULL": first},
+        second_date_images={"FULL": second},
+        bands=bands,
+        indices=["NDBI", "EVI"],
+    )
+
+    assert result["indices"] == ["NDVI", "NDBI", "EVI"]
+    with rasterio.open(result["index_diff_tif"]) as src:
+        assert src.count == 3
+        assert src.descriptions == ("NDVI", "NDBI", "EVI")
+    assert set(result["index_stats"]) == {"NDVI", "NDBI", "EVI"}
+    assert result["index_diff_scale"] == "raw"
+
+
+def test_concurrent_analyses_use_separate_job_dirs(tmp_path, monkeypatch):
+    """
+    Testa que duas análises em simultâneo escrevem em diretórios de pedido diferentes
+    """
+    monkeypatch.chdir(tmp_path)
+    bands = ["B2", "B3", "B4", "B8"]
+    first = write_multiband(tmp_path / "first.tif", bands, seed=1)
+    second = write_multiband(tmp_path / "second.tif", bands, seed=2)
+
+    def analyze(_):
+        return ImageDifferenceAnalyzerTool()._run(
+            first_date_images={"FULL": first},
+            second_date_images={"FULL": second},
+            bands=bands,
+        )
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(analyze, range(2)))
+
+    assert results[0]["job_dir"] != results[1]["job_dir"]
+    for result in results:
+        assert os.path.exists(result["index_diff_tif"])
+        assert not os.path.exists(os.path.join(result["job_dir"], "tmp"))
+
+
+def test_tile_pyramids_for_result_layers(tmp_path, monkeypatch):
+    """
+    Testa que, com GEOSYNC_TILES=1, cada camada tem a sua pirâmide XYZ no diretório do pedido
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GEOSYNC_TILES", "1")
+    bands = ["B2", "B3", "B4", "B8"]
+    first = write_multiband(tmp_path / "first.tif", bands, seed=1)
+    second = write_multiband(tmp_path / "second.tif", bands, seed=2)
+
+    result = ImageDifferenceAnalyzerTool()._run(
+        first_date_images={"FULL": first},
+        second_date_images={"FULL": second},
+        bands=bands,
+    )
+
+    job_id = os.path.basename(result["job_dir"])
+    assert result["tiles"]["url"] == f"/tiles/{job_id}/{{layer}}/{{z}}/{{x}}/{{y}}.png"
+    layers = result["tiles"]["layers"]
+    assert set(layers) == {"rgb_antiga", "rgb_recente", "ndvi_antiga", "ndvi_recente", "ndvi_diff"}
+    for layer, metadata in layers.items():
+        tiles_dir = os.path.join(result["job_dir"], "output", "tiles", layer, str(metadata["maxzoom"]))
+        assert metadata["tiles"] > 0 and os.listdir(tiles_dir)
+
+def test_server_diff_replaces_the_preview_diff(tmp_path, monkeypatch):
+    """
+    Testa o modo "server": a diferença NDVI vem em tiles à resolução total e as bandas de
+    cada data vêm reduzidas, só para as pré-visualizações
+    """
+    monkeypatch.chdir(tmp_path)
+    bands = ["B2", "B3", "B4", "B8"]
+    previews = {}
+    for date, seed in (("first", 1), ("second", 2)):
+        data = np.random.default_rng(seed).integers(200, 4000, size=(4, 16, 16), dtype=np.uint16)
+        with rasterio.open(tmp_path / f"{date}.tif", "w", driver="GTiff", width=16, height=16, count=4,
+                           dtype="uint16", crs="EPSG:4326",
+                           transform=from_origin(-7.92, 38.58, 0.0004, 0.0004)) as dst:
+            dst.write(data)
+        previews[date] = {"FULL": str(tmp_path / f"{date}.tif")}
+
+    diff = np.random.default_rng(3).uniform(-0.5, 0.5, size=(64, 64)).astype(np.float32)
+    diff[:4, :4] = -9999.0  # sem dados nas duas composites
+    tiles = []
+    for i, top in enumerate((38.58, 38.58 - 32 * 0.0001)):
+        with rasterio.open(tmp_path / f"diff_{i}.tif", "w", driver="GTiff", width=64, height=32, count=1,
+                           dtype="float32", crs="EPSG:4326",
+                           transform=from_origin(-7.92, top, 0.0001, 0.0001)) as dst:
+            dst.write(diff[32 * i:32 * (i + 1)], 1)
+        tiles.append(str(tmp_path / f"diff_{i}.tif"))
+
+    result = ImageDifferenceAnalyzerTool()._run(
+        first_date_images=previews["first"],
+        second_date_images=previews["second"],
+        bands=bands,
+        ndvi_diff_tiles=tiles,
+    )
+
+    with rasterio.open(result["index_diff_tif"]) as src:
+        assert src.shape == (64, 64)
+        assert src.descriptions == ("NDVI",)
+        written = src.read(1)
+    assert np.isnan(written[:4, :4]).all()
+    valid = diff != -9999.0
+    np.testing.assert_allclose(written[valid], diff[valid])
+    assert result["index_stats"]["NDVI"]["count"] == valid.sum()
+    with rasterio.open(result["rgb_tif_1"]) as src:
+        assert src.shape == (16, 16)
+    for key in ("ndvi_antiga", "ndvi_recente", "ndvi_diff"):
+        assert os.path.exists(result[key])
+
+def test_all_nan_diff_falls_back_to_the_minimum_contrast(tmp_path, monkeypatch):
+    """
+    Testa que uma diferença sem píxeis válidos (ROI toda mascarada) não leva limites NaN ao renderer
+    """
+    monkeypatch.chdir(tmp_path)
+    bands = ["B2", "B3", "B4", "B8"]
+    first = write_multiband(tmp_path / "first.tif", bands, seed=1)
+    second = write_multiband(tmp_path / "second.tif", bands, seed=2)
+    with rasterio.open(tmp_path / "diff.tif", "w", driver="GTiff", width=64, height=64, count=1,
+                       dtype="float32", crs="EPSG:4326", transform=from_origin(-7.92, 38.58, 0.0001, 0.0001)) as dst:
+        dst.write(np.full((64, 64), -9999.0, dtype=np.float32), 1)
+
+    rendered = {}
+    original = renderer.render_raster
+
+    def render_raster(data, path, cmap="RdYlGn", vmin=0.0, vmax=1.0):
+        rendered[os.path.basename(path)] = (vmin, vmax)
+        return original(data, path, cmap=cmap, vmin=vmin, vmax=vmax)
+
+    monkeypatch.setattr(renderer, "render_raster", render_raster)
+    result = ImageDifferenceAnalyzerTool()._run(
+        first_date_images={"FULL": first},
+        second_date_images={"FULL": second},
+        bands=bands,
+        ndvi_diff_tiles=[str(tmp_path / "diff.tif")],
+    )
+
+    assert result["index_stats"]["NDVI"]["count"] == 0
+    assert rendered["ndvi_diff.png"] == (-0.1, 0.1)
+    assert os.path.exists(result["ndvi_diff"])
+
+
 if __name__ == "__main__":
     print("--- Iniciando teste isolado da Tool ---")
     
@@ -38,4 +237,4 @@ if __name__ == "__main__":
         print(f"Erro durante a execução da tool: {e}")
         logging.error("Erro durante a execução da tool:", exc_info=True)
 
-    print("--- Fim do teste isolado da Tool ---")
\ No newline at end of file
+    print("--- Fim do teste isolado da Tool ---")
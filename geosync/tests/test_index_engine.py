@@ -0,0 +1,81 @@
+# tests/test_index_engine.py
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from geosync.tools.index_engine import WindowedIndexEngine, build_mosaic_vrt
+
+
+def write_band(path, data, left=500000.0, top=4270000.0):
+    profile = {
+        "driver": "GTiff", "width": data.shape[1], "height": data.shape[0], "count": 1,
+        "dtype": data.dtype, "crs": "EPSG:32629", "transform": from_origin(left, top, 10, 10),
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+def random_band(seed, shape=(70, 90)):
+    return np.random.default_rng(seed).integers(0, 4000, size=shape, dtype=np.uint16)
+
+
+def reference_nd(a, b):
+    a, b = a.astype(np.float64), b.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(a + b > 0, (a - b) / (a + b), 0)
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_windowed_diff_matches_full_raster(tmp_path, workers):
+    """
+    Testa que o cálculo por janelas (incluindo as janelas incompletas das bordas)
+    dá o mesmo resultado que o cálculo sobre o raster inteiro, para todos os índices
+    """
+    bands = ["B3", "B4", "B8", "B11"]
+    arrays = {date: {band: random_band(seed) for seed, band in enumerate(bands, start=10 * i)}
+              for i, date in enumerate(("first", "second"))}
+    paths = {date: {band: write_band(tmp_path / f"{date}_{band}.tif", a) for band, a in values.items()}
+             for date, values in arrays.items()}
+    output = tmp_path / "index_diff.tif"
+
+    engine = WindowedIndexEngine(["NDBI", "MNDWI"], block_size=32, workers=workers)
+    stats = engine.compute(paths["first"], paths["second"], str(output), str(tmp_path))
+
+    first, second = arrays["first"], arrays["second"]
+    expected = {
+        "NDVI": reference_nd(second["B8"], second["B4"]) - reference_nd(first["B8"], first["B4"]),
+        "NDBI": reference_nd(second["B11"], second["B8"]) - reference_nd(first["B11"], first["B8"]),
+        "MNDWI": reference_nd(second["B3"], second["B11"]) - reference_nd(first["B3"], first["B11"]),
+    }
+    with rasterio.open(output) as src:
+        assert src.profile["tiled"]
+        assert src.compression is not None
+        assert src.descriptions == ("NDVI", "NDBI", "MNDWI")
+        # Diferenças na escala natural dos índices, marcadas no ficheiro
+        assert src.tags()["DIFF_SCALE"] == "raw"
+        assert src.tags(1)["DIFF_RANGE"] == "-2,2"
+        for i, name in enumerate(src.descriptions, start=1):
+            np.testing.assert_allclose(src.read(i), expected[name], atol=1e-5)
+            assert stats[name]["count"] == expected[name].size
+            assert stats[name]["std"] == pytest.approx(float(expected[name].std()), rel=1e-4)
+
+
+def test_missing_band_is_reported(tmp_path):
+    path = write_band(tmp_path / "b4.tif", random_band(1))
+    rasters = {"B4": path, "B8": path}
+    with pytest.raises(ValueError, match="B11"):
+        WindowedIndexEngine(["NDBI"]).compute(rasters, rasters, str(tmp_path / "out.tif"), str(tmp_path))
+
+
+def test_mosaic_vrt_joins_quadrants(tmp_path):
+    full = random_band(7, shape=(40, 60))
+    left = write_band(tmp_path / "left.tif", full[:, :30])
+    right = write_band(tmp_path / "right.tif", full[:, 30:], left=500300.0)
+
+    vrt = build_mosaic_vrt([(left, 1), (right, 1)], str(tmp_path / "mosaic.vrt"))
+
+    with rasterio.open(vrt) as src:
+        assert (src.width, src.height) == (60, 40)
+        np.testing.assert_array_equal(src.read(1), full)
@@ -0,0 +1,74 @@
+# tests/test_model_runtime.py
+import numpy as np
+import pytest
+
+from geosync.tools.model_runtime import ModelRuntimeConfig, create_session, optimized_model_path, resolve_model_path
+
+
+def write_model(path):
+    """Modelo ONNX mínimo com batch dinâmico: conv 1x1 (3 -> 2 canais) + Relu."""
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper, numpy_helper
+
+    weights = np.arange(6, dtype=np.float32).reshape(2, 3, 1, 1) / 6
+    graph = helper.make_graph(
+        [helper.make_node("Conv", ["input", "weights"], ["conv"]), helper.make_node("Relu", ["conv"], ["output"])],
+        "tiny",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["batch_size", 3, "height", "width"])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch_size", 2, "height", "width"])],
+        initializer=[numpy_helper.from_array(weights, "weights")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def test_env_overrides_yaml(tmp_path, monkeypatch):
+    config_path = tmp_path / "model_runtime.yaml"
+    config_path.write_text("intra_op_num_threads: 2\ngraph_optimization_level: basic\n")
+    monkeypatch.setenv("GEOSYNC_MODEL_RUNTIME_CONFIG", str(config_path))
+    monkeypatch.setenv("GEOSYNC_ORT_INTRA_OP_NUM_THREADS", "3")
+    monkeypatch.setenv("GEOSYNC_ORT_ENABLE_CPU_MEM_ARENA", "false")
+
+    config = ModelRuntimeConfig.load()
+
+    assert config.intra_op_num_threads == 3
+    assert config.graph_optimization_level == "basic"
+    assert config.enable_cpu_mem_arena is False
+    options = config.session_options()
+    assert options.intra_op_num_threads == 3
+
+
+def test_optimized_graph_is_cached(tmp_path):
+    """
+    Testa que a primeira sessão guarda o grafo otimizado e a seguinte o reutiliza, com o mesmo resultado
+    """
+    model_path = write_model(tmp_path / "tiny.onnx")
+    config = ModelRuntimeConfig(intra_op_num_threads=1, optimized_model_dir=str(tmp_path / "optimized"))
+    batch = np.random.default_rng(0).random((4, 3, 8, 8), dtype=np.float32)
+
+    first = create_session(model_path, config)
+    cached = optimized_model_path(model_path, config)
+    assert cached.exists()
+    second = create_session(model_path, config)
+
+    expected = first.run(None, {"input": batch})[0]
+    np.testing.assert_allclose(second.run(None, {"input": batch})[0], expected, rtol=1e-6)
+    assert expected.shape == (4, 2, 8, 8)
+    assert list((tmp_path / "optimized").iterdir()) == [cached]
+
+
+def test_quantized_variant_selection(tmp_path, monkeypatch):
+    """
+    Testa que a variante INT8 é usada quando existe e que, caso contrário, se volta ao FP32
+    """
+    model_path = str(tmp_path / "segformer_dynamic.onnx")
+    monkeypatch.setenv("GEOSYNC_ORT_MODEL_VARIANT", "int8_static")
+    variant = ModelRuntimeConfig.load().model_variant
+
+    assert resolve_model_path(model_path, variant) == model_path
+    (tmp_path / "segformer_dynamic.int8_static.onnx").write_bytes(b"")
+    assert resolve_model_path(model_path, variant) == str(tmp_path / "segformer_dynamic.int8_static.onnx")
+    with pytest.raises(ValueError):
+        resolve_model_path(model_path, "int4")
@@ -0,0 +1,170 @@
+# tests/test_pipeline.py
+import json
+
+import pytest
+
+from geosync.pipeline import GeosyncPipeline, PipelineError
+
+
+class FakeGeocoder:
+    def _run(self, address):
+        return {"lat": 38.57, "lon": -7.91}
+
+
+class FakeFetcher:
+    def _run(self, lat, lon, first_date, second_date, fetch_mode, indices=None):
+        return json.dumps({
+            "first_date_images": {"NE": f"raw_images/{lat}_{lon}_{first_date}_NE.zip"},
+            "second_date_images": {"NE": f"raw_images/{lat}_{lon}_{second_date}_NE.zip"},
+        })
+
+
+class FakeAnalyzer:
+    def _run(self, first_date_images, second_date_images, bands=None, job_dir=None, indices=None):
+        return {
+            "image_path_1": "output/rgb_antiga.png",
+            "image_path_2": "output/rgb_recente.png",
+            "ndvi_antiga": "output/ndvi_antiga.png",
+            "ndvi_recente": "output/ndvi_recente.png",
+            "ndvi_diff": "output/ndvi_diff.png",
+        }
+
+
+class FakeUrbanAnalyzer:
+    def _run(self, image_path_1, image_path_2, job_dir=None):
+        return {
+            "Edifícios na data 1": 3,
+            "Edifícios na data 2": 5,
+            "Novas construções": 2,
+            "Imagem de diferença guardada em": "output/new_buildings_diff.png",
+            "Edifícios identificados na primeira imagem": "output/buildings_detected_first_image.png",
+            "Edifícios identificados na segunda imagem": "output/buildings_detected_second_image.png",
+        }
+
+
+def make_pipeline(**overrides):
+    tools = {
+        "geocoder": FakeGeocoder(),
+        "fetcher": FakeFetcher(),
+        "analyzer": FakeAnalyzer(),
+        "urban_analyzer": FakeUrbanAnalyzer(),
+    }
+    tools.update(overrides)
+    return GeosyncPipeline(**tools)
+
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOSYNC_JOBS_DIR", str(tmp_path / "jobs"))
+
+
+def test_pipeline_chains_tools():
+    """
+    Testa que o pipeline passa as saídas de cada tool à seguinte sem passar por LLM
+    """
+    result = make_pipeline().run("Largo dos Colegiais, Évora", "2024-04-06", "2024-04-13")
+
+    assert result.coordinates.lat == 38.57
+    assert result.images.first_date_images["NE"].endswith("2024-04-06_NE.zip")
+    assert result.urban_growth.new_buildings == 2
+
+    output = result.to_output()
+    assert output["image_path_1"] == "output/rgb_antiga.png"
+    assert output["image_path_2"] == "output/rgb_recente.png"
+    assert output["job_id"]
+    json.dumps(output)
+
+
+def test_pipeline_reports_failing_stage():
+    """
+    Testa que um erro devolvido por uma tool identifica a etapa que falhou
+    """
+    class NotFoundGeocoder:
+        def _run(self, address):
+            return json.dumps({"error": "Address not found."})
+
+    with pytest.raises(PipelineError) as excinfo:
+        make_pipeline(geocoder=NotFoundGeocoder()).run("???", "2024-04-06", "2024-04-13")
+
+    assert excinfo.value.stage == "geocode"
+
+
+def test_server_fetch_passes_the_remote_diff_to_the_analyzer():
+    """
+    Testa que, nos modos "auto"/"server", o fetcher sabe se a segmentação precisa de RGB à
+    resolução total e a diferença calculada no Earth Engine chega ao analisador
+    """
+    received = {}
+
+    class ServerFetcher:
+        def _run(self, lat, lon, first_date, second_date, fetch_mode, indices=None, full_res_rgb=False):
+            received["full_res_rgb"] = full_res_rgb
+            return {
+                "first_date_images": {"FULL": "raw_images/first_preview.tif"},
+                "second_date_images": {"FULL": "raw_images/second_preview.tif"},
+                "ndvi_diff_tiles": ["raw_images/diff_R0C0.tif", "raw_images/diff_R0C1.tif"],
+                "fetch_plan": {"mode": "server", "fetch_mode": "server"},
+            }
+
+    class ServerAnalyzer(FakeAnalyzer):
+        def _run(self, first_date_images, second_date_images, bands=None, job_dir=None, indices=None,
+                 ndvi_diff_tiles=None):
+            received["ndvi_diff_tiles"] = ndvi_diff_tiles
+            return super()._run(first_date_images, second_date_images, bands, job_dir, indices)
+
+    pipeline = make_pipeline(fetcher=ServerFetcher(), analyzer=ServerAnalyzer(), fetch_mode="auto",
+                             urban_growth=False)
+    result = pipeline.run("Largo dos Colegiais, Évora", "2024-04-06", "2024-04-13")
+
+    assert received == {"full_res_rgb": False,
+                        "ndvi_diff_tiles": ["raw_images/diff_R0C0.tif", "raw_images/diff_R0C1.tif"]}
+    assert result.images.fetch_plan["fetch_mode"] == "server"
+
+
+def test_timeseries_appends_only_new_windows(tmp_path, monkeypatch):
+    """
+    Testa que o modo "timeseries" só pede e acrescenta ao cubo as janelas novas
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_origin
+
+    from geosync.tools.timeseries import NDVICube
+
+    monkeypatch.setenv("GEOSYNC_TIMESERIES_DIR", str(tmp_path / "timeseries"))
+
+    class CompositeFetcher:
+        def __init__(self):
+            self.requested = []
+
+        def fetch_composites(self, lat, lon, windows, bands):
+            self.requested.extend(start for start, _ in windows)
+            paths = {}
+            for i, (start, _) in enumerate(windows):
+                path = tmp_path / f"{start}.tif"
+                data = np.full((len(bands), 8, 8), 1000, dtype=np.uint16)
+                # O NIR desce de composite para composite
+                data[bands.index("B8")] = 3000 - 100 * (len(self.requested) - len(windows) + i)
+                with rasterio.open(path, "w", driver="GTiff", width=8, height=8, count=len(bands), dtype="uint16",
+                                   crs="EPSG:4326", transform=from_origin(-7.92, 38.58, 0.0001, 0.0001)) as dst:
+                    dst.write(data)
+                paths[start] = str(path)
+            return paths
+
+    fetcher = CompositeFetcher()
+    pipeline = make_pipeline(fetcher=fetcher)
+    first = pipeline.timeseries("Évora", "2024-01-01", "2024-03-01", cadence_days=30)
+    second = pipeline.timeseries("Évora", "2024-01-01", "2024-04-30", cadence_days=30)
+
+    assert first.appended == ["2024-01-01", "2024-01-31"]
+    assert second.appended == ["2024-03-01", "2024-03-31"]
+    assert fetcher.requested == ["2024-01-01", "2024-01-31", "2024-03-01", "2024-03-31"]
+    assert second.dates == first.dates + second.appended
+    with rasterio.open(second.slope_tif) as src:
+        assert (src.read(1) < 0).all()
+
+    # Outro início: as janelas continuam na grelha do cubo (ancorada em 2024-01-01)
+    third = pipeline.timeseries("Évora", "2024-02-15", "2024-06-30", cadence_days=30)
+    assert third.appended == ["2024-04-30", "2024-05-30", "2024-06-29"]
+    with NDVICube(third.cube) as cube:
+        assert cube.anchor == "2024-01-01"
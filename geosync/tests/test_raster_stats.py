@@ -0,0 +1,45 @@
+# tests/test_raster_stats.py
+import numpy as np
+import pytest
+
+from geosync.tools.raster_stats import RasterStats, describe
+
+
+def test_uint16_percentiles_are_exact():
+    band = np.random.default_rng(0).integers(0, 10000, size=(300, 400), dtype=np.uint16)
+
+    stats = describe(band, percentiles=(2, 50, 98))
+
+    np.testing.assert_allclose([stats["p2"], stats["p50"], stats["p98"]], np.percentile(band, [2, 50, 98]))
+    assert stats["mean"] == pytest.approx(band.mean())
+    assert stats["std"] == pytest.approx(band.std())
+
+
+def test_streaming_float_percentiles_within_accuracy():
+    """
+    Testa que, janela a janela, os percentis de floats ficam dentro do erro configurado
+    e que NaN/inf são ignorados
+    """
+    data = np.random.default_rng(1).normal(0, 0.3, size=(500, 500)).astype(np.float32)
+    data[0, :10] = np.nan
+    data[1, :10] = np.inf
+    finite = data[np.isfinite(data)]
+
+    stats = RasterStats(value_range=(-2, 2), accuracy=1e-3)
+    for row in range(0, 500, 64):
+        stats.update(data[row:row + 64])
+
+    for q, value in stats.percentiles([5, 50, 95]).items():
+        assert abs(value - np.percentile(finite, q)) <= 1e-3
+    assert stats.count == finite.size
+    assert stats.std == pytest.approx(float(finite.std()), rel=1e-5)
+
+
+def test_merge_matches_single_pass():
+    data = np.random.default_rng(2).integers(0, 4000, size=(100, 100), dtype=np.uint16)
+    left = RasterStats(dtype=np.uint16).update(data[:, :50])
+    right = RasterStats(dtype=np.uint16).update(data[:, 50:])
+
+    merged = left.merge(right).result((5, 95))
+
+    assert merged == describe(data, percentiles=(5, 95))
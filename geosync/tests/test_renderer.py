@@ -0,0 +1,44 @@
+# tests/test_renderer.py
+import numpy as np
+from PIL import Image
+
+from geosync.tools import renderer
+
+
+def test_lut_endpoints_and_reversed():
+    assert renderer.LUTS["RdYlGn"][0].tolist() == [0xa5, 0x00, 0x26]
+    assert renderer.LUTS["RdYlGn"][-1].tolist() == [0x00, 0x68, 0x37]
+    assert renderer.LUTS["RdBu_r"][0].tolist() == renderer.LUTS["RdBu"][-1].tolist()
+    assert renderer.LUTS["gray"][128].tolist() == [128, 128, 128]
+
+
+def test_colormap_png_and_webp(tmp_path):
+    """
+    Testa que o raster é colorido à resolução nativa, com os NaN transparentes
+    """
+    data = np.linspace(-1, 1, 64 * 32, dtype=np.float32).reshape(64, 32)
+    data[0, 0] = np.nan
+
+    png = renderer.render_raster(data, str(tmp_path / "ndvi.png"), cmap="RdYlGn", vmin=-1, vmax=1)
+    webp = renderer.render_raster(data, str(tmp_path / "ndvi.webp"), cmap="RdYlGn", vmin=-1, vmax=1)
+
+    with Image.open(png) as image:
+        assert image.size == (32, 64)
+        assert image.mode == "RGBA"
+        pixels = np.asarray(image)
+    assert pixels[0, 0, 3] == 0
+    assert pixels[-1, -1, :3].tolist() == renderer.LUTS["RdYlGn"][-1].tolist()
+    with Image.open(webp) as image:
+        assert image.format == "WEBP"
+
+
+def test_render_parallel_and_legend(tmp_path):
+    paths = [str(tmp_path / f"{i}.png") for i in range(4)]
+    data = np.random.default_rng(0).random((16, 16))
+
+    renderer.render_parallel([lambda path=path: renderer.render_raster(data, path) for path in paths], workers=2)
+    legend = renderer.render_legend(str(tmp_path / "legend.png"), "RdBu_r", -0.3, 0.3, label="ndvi_diff")
+
+    for path in paths + [legend]:
+        with Image.open(path) as image:
+            assert image.format == "PNG"
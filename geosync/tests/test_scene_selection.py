@@ -0,0 +1,38 @@
+# tests/test_scene_selection.py
+import pytest
+
+from geosync.tools.earthengine_tool import choose_scene_source
+
+SCENE = {"id": "20240410T112119_20240410T112714_T29SNC", "time": 1712748079000, "cloud": 3.1,
+         "roi_cloud": 0.05, "composite_cloud": 0.0, "scenes": 6, "start": "2024-04-06", "end": "2024-05-06"}
+
+
+def test_clear_scene_is_used_directly():
+    scene = choose_scene_source(SCENE, "start date: 2024-04-06", max_roi_cloud=0.2)
+    assert scene["composite"] is False
+    assert scene["id"] == SCENE["id"]
+
+
+def test_clouded_roi_falls_back_to_the_composite():
+    """
+    Testa que uma cena com pouca nuvem no tile mas a ROI coberta passa ao composite da janela
+    """
+    clouded = {**SCENE, "roi_cloud": 0.65}
+    assert choose_scene_source(clouded, "start date: 2024-04-06", 0.2)["composite"] is True
+    assert choose_scene_source(SCENE, "start date: 2024-04-06", 0.2, composite="always")["composite"] is True
+
+
+@pytest.mark.parametrize("scene, composite", [
+    ({**SCENE, "roi_cloud": 0.65}, "never"),
+    ({**SCENE, "roi_cloud": 0.65, "composite_cloud": 0.4}, "auto"),
+    # Sem píxeis avaliados (ROI fora da cena) conta como inutilizável
+    ({**SCENE, "roi_cloud": None, "composite_cloud": None}, "auto"),
+])
+def test_unusable_dates_are_rejected_before_download(scene, composite):
+    result = choose_scene_source(scene, "end date: 2024-04-13", 0.2, composite)
+    assert "error" in result
+    assert "end date: 2024-04-13" in result["error"]
+
+
+def test_missing_scene_keeps_the_no_image_error():
+    assert choose_scene_source(None, "start date: 2024-04-06") == {"error": "No image found for start date: 2024-04-06"}
@@ -0,0 +1,39 @@
+# tests/test_scratch_rasters.py
+import numpy as np
+import pytest
+import rasterio
+from rasterio.errors import RasterioIOError
+
+from geosync.tools.scratch_rasters import ScratchRasters
+
+
+def write(path, data):
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype) as dst:
+        dst.write(data, 1)
+
+
+def test_rasters_stay_in_memory_within_the_budget(tmp_path):
+    """
+    Testa que os rasters intermédios ficam em /vsimem/ enquanto cabem no orçamento e que,
+    acima dele, vão para o tmp/ antes de serem escritos
+    """
+    data = np.arange(64 * 64, dtype=np.uint16).reshape(64, 64)
+    scratch = ScratchRasters(str(tmp_path), budget_bytes=64 * 64 * 2)
+
+    in_memory = scratch.path("a.tif", data.shape, data.dtype)
+    on_disk = scratch.path("b.tif", data.shape, data.dtype)
+    assert in_memory.startswith("/vsimem/")
+    assert on_disk == str(tmp_path / "b.tif")
+
+    for path in (in_memory, on_disk):
+        write(path, data)
+        with rasterio.open(path) as src:
+            np.testing.assert_array_equal(src.read(1), data)
+
+    scratch.close()
+    assert scratch.memory_bytes == 0
+    with pytest.raises(RasterioIOError):
+        rasterio.open(in_memory)
+    assert scratch.path("c.tif", data.shape, data.dtype).startswith("/vsimem/")
+    scratch.close()
@@ -0,0 +1,37 @@
+# tests/test_spectral_indices.py
+import numpy as np
+import pytest
+
+from geosync.tools.spectral_indices import IndexSet, compile_formula, required_bands, resolve_indices
+
+
+def test_formula_bands_and_values():
+    """
+    Testa que as fórmulas declaradas usam reflectância (EVI) e a diferença normalizada (nd)
+    """
+    raw = {
+        "B2": np.array([[500]], dtype=np.uint16),
+        "B4": np.array([[1000]], dtype=np.uint16),
+        "B8": np.array([[3000]], dtype=np.uint16),
+    }
+    index_set = IndexSet(resolve_indices(["EVI"]))
+
+    assert index_set.names == ["NDVI", "EVI"]
+    assert index_set.bands == ["B2", "B4", "B8"]
+
+    ndvi, evi = index_set.evaluate(raw)[:, 0, 0]
+    assert ndvi == pytest.approx((3000 - 1000) / (3000 + 1000))
+    assert evi == pytest.approx(2.5 * (0.3 - 0.1) / (0.3 + 6 * 0.1 - 7.5 * 0.05 + 1), rel=1e-5)
+
+
+def test_required_bands_union():
+    assert required_bands(resolve_indices(["NDBI", "MNDWI"])) == ["B3", "B4", "B8", "B11"]
+
+
+def test_invalid_formulas_and_names_are_rejected():
+    with pytest.raises(ValueError):
+        compile_formula("B8 ** 2")
+    with pytest.raises(ValueError):
+        compile_formula("__import__('os')")
+    with pytest.raises(ValueError):
+        resolve_indices(["XYZ"])
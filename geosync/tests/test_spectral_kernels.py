@@ -0,0 +1,54 @@
+# tests/test_spectral_kernels.py
+import numpy as np
+import pytest
+
+from geosync.tools.spectral_kernels import available_backends, ndvi, normalized_difference, resolve_backend
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_backends_match_reference(backend):
+    rng = np.random.default_rng(0)
+    red = rng.integers(0, 4000, size=(300, 200), dtype=np.uint16)
+    nir = rng.integers(0, 4000, size=(300, 200), dtype=np.uint16)
+
+    nir_f, red_f = nir.astype(np.float64), red.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = np.where(nir_f + red_f > 0, (nir_f - red_f) / (nir_f + red_f), 0)
+
+    np.testing.assert_allclose(ndvi(red, nir, normalized=False, backend=backend), expected, atol=1e-6)
+    np.testing.assert_allclose(ndvi(red, nir, backend=backend), (expected + 1) / 2, atol=1e-6)
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_invalid_pixels_are_zero(backend):
+    """
+    Testa que NaN, inf e denominador nulo dão índice 0, e que o resultado é escrito em `out`
+    """
+    a = np.array([0, np.nan, np.inf, 3, 2], dtype=np.float32)
+    b = np.array([0, 1, 1, -3, 2], dtype=np.float32)
+    out = np.full(a.shape, 99, dtype=np.float32)
+
+    result = normalized_difference(a, b, out=out, backend=backend)
+
+    assert result is out
+    np.testing.assert_array_equal(out, [0, 0, 0, 0, 0])
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_non_contiguous_out_is_filled(backend):
+    rng = np.random.default_rng(0)
+    red = rng.integers(1, 4000, size=(30, 20), dtype=np.uint16)
+    nir = rng.integers(1, 4000, size=(30, 20), dtype=np.uint16)
+    buffer = np.zeros((30, 40), dtype=np.float32)
+    out = buffer[:, ::2]
+
+    result = ndvi(red, nir, out=out, normalized=False, backend=backend)
+
+    assert result is out
+    np.testing.assert_allclose(buffer[:, ::2], ndvi(red, nir, normalized=False, backend="numpy"), atol=1e-6)
+    assert not buffer[:, 1::2].any()
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        resolve_backend("cuda")
@@ -0,0 +1,87 @@
+# tests/test_tile_cache.py
+import os
+
+import pytest
+
+from geosync.tools.tile_cache import TileCache, snap_to_grid
+
+
+def test_snap_to_grid_reuses_cell_for_nearby_addresses():
+    """
+    Testa que coordenadas próximas (ou só com formatação diferente) caem na mesma célula
+    """
+    a = snap_to_grid(38.5714, -7.9135, 320)
+    b = snap_to_grid(38.571400000001, -7.91349999, 320)
+    c = snap_to_grid(38.5719, -7.9131, 320)
+    assert a == b == c
+
+    far = snap_to_grid(38.60, -7.9135, 320)
+    assert far[2] != a[2]
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = TileCache(root=str(tmp_path), max_bytes=1024)
+    key = TileCache.make_key("20240406T112119_20240406T112118_T29SNC", "320m:1:2", "NE:256", 10)
+
+    assert cache.get(key) is None
+    path = cache.put(key, lambda f: f.write(b"zip-bytes"), image_id="img", cell="320m:1:2", scale=10)
+    assert cache.get(key) == path
+
+    with open(path, "rb") as f:
+        assert f.read() == b"zip-bytes"
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_failed_download_leaves_no_partial_file(tmp_path):
+    """
+    Testa que um download interrompido não deixa um zip a meio na cache
+    """
+    cache = TileCache(root=str(tmp_path))
+    key = TileCache.make_key("img", "cell", "NE:256", 10)
+
+    def broken_writer(f):
+        f.write(b"half")
+        raise ConnectionError("connection reset")
+
+    with pytest.raises(ConnectionError):
+        cache.put(key, broken_writer)
+
+    assert cache.get(key) is None
+    leftovers = [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith((".zip", ".part"))]
+    assert leftovers == []
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = TileCache(root=str(tmp_path), max_bytes=25, grace_seconds=0)
+    keys = [TileCache.make_key(f"img{i}", "cell", "NE:256", 10) for i in range(3)]
+
+    first = cache.put(keys[0], lambda f: f.write(b"a" * 10))
+    cache.put(keys[1], lambda f: f.write(b"b" * 10))
+    # Acede à primeira entrada para que a segunda passe a ser a menos usada
+    assert cache.get(keys[0]) == first
+    cache.put(keys[2], lambda f: f.write(b"c" * 10))
+
+    assert cache.get(keys[0]) == first
+    assert cache.get(keys[1]) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_spares_recently_returned_entries(tmp_path):
+    """
+    Testa que um put não remove um ficheiro devolvido há pouco por get, que o chamador
+    ainda não abriu
+    """
+    cache = TileCache(root=str(tmp_path), max_bytes=15, grace_seconds=60)
+    keys = [TileCache.make_key(f"img{i}", "cell", "NE:256", 10) for i in range(2)]
+
+    first = cache.put(keys[0], lambda f: f.write(b"a" * 10))
+    assert cache.get(keys[0]) == first
+    cache.put(keys[1], lambda f: f.write(b"b" * 10))
+
+    with open(first, "rb") as f:
+        assert f.read() == b"a" * 10
+    assert cache.stats()["evictions"] == 0
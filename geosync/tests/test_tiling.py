@@ -0,0 +1,60 @@
+# tests/test_tiling.py
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+
+from geosync.tools import tiling
+
+
+def test_tile_math():
+    assert tiling.tile_bounds(0, 0, 0) == pytest.approx(
+        (-tiling.ORIGIN_SHIFT, -tiling.ORIGIN_SHIFT, tiling.ORIGIN_SHIFT, tiling.ORIGIN_SHIFT))
+    # Sentinel-2 (10 m) precisa do zoom 14 (~9.55 m/píxel) para não perder detalhe
+    assert tiling.zoom_for_resolution(10) == 14
+    assert tiling.resolution(14) < 10 < tiling.resolution(13)
+    assert list(tiling.tiles_for_bounds(tiling.tile_bounds(3, 5, 2), 4)) == [(10, 4), (10, 5), (11, 4), (11, 5)]
+
+
+def test_pyramid_levels_and_transparency(tmp_path):
+    """
+    Testa que a pirâmide vai do zoom da resolução nativa até ao nível em que o raster
+    cabe em 2x2 tiles, com os píxeis fora dos dados transparentes
+    """
+    src_path = str(tmp_path / "ndvi.tif")
+    data = np.linspace(-1, 1, 300 * 200, dtype=np.float32).reshape(1, 300, 200)
+    with rasterio.open(src_path, "w", driver="GTiff", width=200, height=300, count=1, dtype="float32",
+                       crs="EPSG:32629", transform=from_origin(580000, 4270000, 10, 10)) as dst:
+        dst.write(data)
+
+    out_dir = tmp_path / "tiles"
+    metadata = tiling.build_tiles(src_path, str(out_dir), tiling.colormap_colorizer("RdYlGn", -1, 1))
+
+    assert metadata["maxzoom"] == 14
+    assert metadata["minzoom"] < metadata["maxzoom"]
+    assert metadata["tiles"] == len(list(out_dir.rglob("*.png")))
+    west, south, east, north = metadata["bounds"]
+    assert -8.1 < west < east < -8.0 and 38.5 < south < north < 38.6
+
+    for z in range(metadata["minzoom"], metadata["maxzoom"] + 1):
+        tiles = sorted((out_dir / str(z)).rglob("*.png"))
+        assert tiles
+        with Image.open(tiles[0]) as image:
+            assert image.size == (tiling.TILE_SIZE, tiling.TILE_SIZE)
+            assert image.mode == "RGBA"
+            alpha = np.asarray(image)[..., 3]
+        # O raster não está alinhado com a grelha: cada tile tem dados e zonas vazias
+        assert alpha.max() == 255 and alpha.min() == 0
+
+
+def test_parent_tile_is_mean_of_children():
+    child = np.full((1, 4, 4), 1.0, dtype=np.float32)
+    child[0, :2, :2] = np.nan
+    parent = tiling._downsample([child, None, None, child * 3], bands=1, tile_size=4)
+
+    assert parent.shape == (1, 4, 4)
+    assert np.isnan(parent[0, 0, 0])
+    assert parent[0, 1, 1] == 1.0
+    assert parent[0, 3, 3] == 3.0
+    assert np.isnan(parent[0, 0, 3])
@@ -0,0 +1,109 @@
+# tests/test_timeseries.py
+import datetime
+
+import h5py
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from geosync.tools.timeseries import NDVICube, ndvi_from_composite, step_windows
+
+PROFILE = {"height": 40, "width": 30, "crs": "EPSG:4326", "transform": from_origin(-7.92, 38.58, 0.0001, 0.0001)}
+DATES = ["2024-01-01", "2024-02-01", "2024-03-01", "2024-04-01", "2024-05-01"]
+
+
+def slices():
+    rng = np.random.default_rng(0)
+    base = rng.uniform(0.2, 0.8, size=(40, 30)).astype(np.float32)
+    values = []
+    for i in range(len(DATES)):
+        ndvi = base + 0.05 * i
+        ndvi[:10] = base[:10] - 0.1 * i  # zona a perder vegetação
+        values.append(ndvi)
+    values[2][20:25, 5:10] = np.nan  # nuvens numa data
+    return values
+
+
+def test_step_windows_cover_the_range():
+    assert step_windows("2024-01-01", "2024-03-10", 30) == [
+        ("2024-01-01", "2024-01-31"), ("2024-01-31", "2024-03-01"), ("2024-03-01", "2024-03-10")]
+    # Ancoradas na grelha de um cubo existente
+    assert step_windows("2024-01-15", "2024-03-10", 30, anchor="2024-01-01") == [
+        ("2024-01-31", "2024-03-01"), ("2024-03-01", "2024-03-10")]
+
+
+def test_incremental_trends_match_full_recomputation(tmp_path):
+    """
+    Testa que o declive e a maior queda, atualizados data a data, coincidem com o cálculo
+    sobre a série completa, e que o cubo pode ser reaberto para novas datas
+    """
+    path = str(tmp_path / "site.h5")
+    values = slices()
+    with NDVICube(path, PROFILE, chunk=16) as cube:
+        for date, ndvi in zip(DATES[:3], values[:3]):
+            cube.append(date, ndvi)
+    with NDVICube(path) as cube:
+        for date, ndvi in zip(DATES[3:], values[3:]):
+            cube.append(date, ndvi)
+        assert [d.isoformat() for d in cube.dates] == DATES
+        slope, max_drop = cube.slope(), cube.max_drop()
+
+    stack = np.stack(values)
+    years = np.array([(datetime.date.fromisoformat(d) - datetime.date(2024, 1, 1)).days for d in DATES]) / 365.25
+    expected = np.polyfit(years, stack.reshape(len(DATES), -1), 1)[0].reshape(40, 30)
+    clear = np.isfinite(stack).all(axis=0)
+    np.testing.assert_allclose(slope[clear], expected[clear], rtol=1e-4, atol=1e-4)
+    assert np.isfinite(slope[~clear]).all()  # 4 observações chegam para o declive
+
+    peaks = np.fmax.accumulate(stack, axis=0)
+    expected_drop = np.nanmax(np.maximum(peaks[:-1] - stack[1:], 0), axis=0)
+    np.testing.assert_allclose(max_drop, expected_drop, rtol=1e-5, atol=1e-6)
+    assert max_drop[:10].min() == pytest.approx(0.4, abs=1e-5)
+
+
+def test_append_rejects_past_dates_and_recovers_partial_slices(tmp_path):
+    path = str(tmp_path / "site.h5")
+    values = slices()
+    with NDVICube(path, PROFILE) as cube:
+        cube.append(DATES[0], values[0])
+        cube.append(DATES[1], values[1])
+        with pytest.raises(ValueError):
+            cube.append(DATES[0], values[0])
+        expected = cube.slope()
+
+    # Simula uma interrupção depois de escrever a fatia e antes de registar a data
+    with h5py.File(path, "a") as f:
+        f["ndvi"].resize(3, axis=0)
+        f["ndvi"][2] = values[2]
+        f["stats/sum_v"][...] += 1
+
+    with NDVICube(path) as cube:
+        assert len(cube) == cube.ndvi.shape[0] == 2
+        np.testing.assert_allclose(cube.slope(), expected, rtol=1e-5)
+
+
+def test_write_trends_and_composite_ndvi(tmp_path):
+    bands = ["B2", "B3", "B4", "B8"]
+    data = np.full((4, 40, 30), 1000, dtype=np.uint16)
+    data[3] = 3000
+    data[:, :5] = 0  # fora da máscara do composite
+    with rasterio.open(tmp_path / "composite.tif", "w", driver="GTiff", width=30, height=40, count=4,
+                       dtype="uint16", crs=PROFILE["crs"], transform=PROFILE["transform"]) as dst:
+        dst.write(data)
+
+    ndvi, profile = ndvi_from_composite(str(tmp_path / "composite.tif"), bands)
+    assert np.isnan(ndvi[:5]).all()
+    assert ndvi[5:] == pytest.approx(0.5)
+
+    with NDVICube(str(tmp_path / "site.h5"), profile) as cube:
+        cube.append(DATES[0], ndvi)
+        cube.append(DATES[1], ndvi - 0.2)
+        paths = cube.write_trends(str(tmp_path / "slope.tif"), str(tmp_path / "drop.tif"))
+
+    with rasterio.open(paths["max_drop"]) as src:
+        assert src.crs.to_epsg() == 4326
+        assert src.transform == PROFILE["transform"]
+        drop = src.read(1)
+    assert np.isnan(drop[:5]).all()
+    assert drop[5:] == pytest.approx(0.2, abs=1e-6)
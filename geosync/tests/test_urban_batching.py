@@ -0,0 +1,129 @@
+# tests/test_urban_batching.py
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+from types import SimpleNamespace
+
+from geosync.tools import model_runtime
+from geosync.tools.urban_analysis_tool import UrbanGrowthAnalyzerTool
+
+
+class FakeSession:
+    """Substitui o modelo ONNX: a classe 0 é o canal vermelho da imagem normalizada."""
+
+    def __init__(self, model_path, *args, **kwargs):
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input", shape=["batch_size", 3, "height", "width"])]
+
+    def get_outputs(self):
+        return [SimpleNamespace(name="output")]
+
+    def run(self, output_names, feeds):
+        batch = feeds["input"]
+        self.batch_sizes.append(batch.shape[0])
+        return [batch[:, :1, ::4, ::4]]
+
+
+def write_image(path, red):
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    image[..., 0] = red
+    Image.fromarray(image).save(path)
+    return str(path)
+
+
+def test_images_are_segmented_in_batches(tmp_path, monkeypatch):
+    """
+    Testa que as imagens seguem em batches de no máximo GEOSYNC_SEGMENTATION_BATCH,
+    com as máscaras devolvidas pela ordem das imagens
+    """
+    monkeypatch.setattr(model_runtime.ort, "InferenceSession", FakeSession)
+    monkeypatch.setenv("GEOSYNC_SEGMENTATION_BATCH", "2")
+    paths = [write_image(tmp_path / f"{i}.png", 255 if i % 2 else 0) for i in range(5)]
+
+    analyzer = UrbanGrowthAnalyzerTool()
+    masks, images_per_second = analyzer.segment_images(paths)
+
+    assert analyzer._model.batch_sizes == [2, 2, 1]
+    assert images_per_second > 0
+    assert [mask.shape for mask in masks] == [(256, 256)] * 5
+    assert [int(mask.max()) for mask in masks] == [0, 1, 0, 1, 0]
+
+
+def test_run_segments_both_dates_in_one_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_runtime.ort, "InferenceSession", FakeSession)
+    monkeypatch.chdir(tmp_path)
+    first = write_image(tmp_path / "first.png", 0)
+    second = write_image(tmp_path / "second.png", 255)
+
+    analyzer = UrbanGrowthAnalyzerTool()
+    result = analyzer._run(image_path_1=first, image_path_2=second)
+
+    assert analyzer._model.batch_sizes == [2]
+    assert result["Edifícios na data 1"] == 0
+    assert result["Edifícios na data 2"] == 1
+
+
+def test_tiled_mode_keeps_native_resolution(tmp_path, monkeypatch):
+    """
+    Testa que o modo "tiled" gera máscaras à resolução da imagem e conta as construções nelas
+    """
+    monkeypatch.setattr(model_runtime.ort, "InferenceSession", FakeSession)
+    monkeypatch.setenv("GEOSYNC_SEGMENTATION_MODE", "tiled")
+    monkeypatch.chdir(tmp_path)
+    squares = [(40, 40), (300, 500), (650, 900)]
+    images = []
+    for name, count in (("first.png", 2), ("second.png", 3)):
+        image = np.zeros((800, 1000, 3), dtype=np.uint8)
+        for row, col in squares[:count]:
+            image[row:row + 30, col:col + 30, 0] = 255
+        Image.fromarray(image).save(tmp_path / name)
+        images.append(str(tmp_path / name))
+
+    analyzer = UrbanGrowthAnalyzerTool()
+    result = analyzer._run(image_path_1=images[0], image_path_2=images[1])
+
+    assert result["Edifícios na data 1"] == 2
+    assert result["Edifícios na data 2"] == 3
+    assert result["Novas construções"] == 1
+    assert result["Construções demolidas"] == 0
+    assert result["Construções inalteradas"] == 2
+    assert os.path.exists(result["Footprints das construções"]["parquet"])
+    with Image.open(result["Máscara de novas construções"]) as mask:
+        assert mask.size == (1000, 800)
+        # O modelo de teste devolve 1/4 da resolução: as bordas dos quadrados variam ligeiramente
+        assert abs(int(np.asarray(mask).sum()) - 30 * 30) < 0.1 * 30 * 30
+
+
+def test_georeferenced_bands_give_masks_in_map_coordinates(tmp_path, monkeypatch):
+    """
+    Testa que um GeoTIFF com as bandas B4/B3/B2 em bruto (uint16) é estirado e segmentado,
+    com as máscaras na georreferência da entrada
+    """
+    monkeypatch.setattr(model_runtime.ort, "InferenceSession", FakeSession)
+    monkeypatch.chdir(tmp_path)
+    transform = from_origin(-7.92, 38.58, 0.0001, 0.0001)
+    paths = []
+    for name, red in (("first.tif", 300), ("second.tif", 3000)):
+        bands = np.full((3, 128, 128), 300, dtype=np.uint16)
+        bands[0, :64] = red
+        with rasterio.open(tmp_path / name, "w", driver="GTiff", width=128, height=128, count=3, dtype="uint16",
+                           crs="EPSG:4326", transform=transform) as dst:
+            dst.write(bands)
+        paths.append(str(tmp_path / name))
+
+    analyzer = UrbanGrowthAnalyzerTool()
+    result = analyzer._run(image_path_1=paths[0], image_path_2=paths[1])
+
+    assert result["Novas construções"] == 1
+    with rasterio.open(result["Máscara de construções na data 2"]) as mask:
+        assert mask.crs.to_epsg() == 4326
+        assert mask.shape == (256, 256)
+        # A máscara de 256x256 cobre a mesma área que a imagem de 128x128
+        assert tuple(mask.bounds) == pytest.approx((-7.92, 38.58 - 0.0128, -7.92 + 0.0128, 38.58))
+        assert mask.read(1)[:128].all() and not mask.read(1)[128:].any()